@@ -1,10 +1,12 @@
 import os
+import sys
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from structlog import get_logger
 
 from app.cli import cli
+from app.support.logs import configure_logging
 
 log = get_logger(name=__name__)
 
@@ -15,11 +17,42 @@ db = SQLAlchemy()
 
 # TOOD: Move all of the config to its own module
 app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
-    basedir, "local", "database.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "SPECTER_DATABASE_URI", "sqlite:///" + os.path.join(basedir, "local", "database.db")
 )
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Wait on SQLite's write lock instead of failing when workers write concurrently
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": {"timeout": 30}}
+# Number of SQLite files the scrape data is partitioned over, 0 turns sharding off
+app.config["SHARD_COUNT"] = int(os.environ.get("SPECTER_SHARDS", 0))
+app.config["SHARD_DIRECTORY"] = os.path.join(basedir, "local", "shards")
+# Only store the values of a scrape that changed since the page's previous scrape
+app.config["DELTA_STORAGE"] = os.environ.get("SPECTER_DELTA_STORAGE", "0") == "1"
+# Weeks of raw scrapes kept before maintenance compact rolls them up by month
+app.config["RETENTION_WEEKS"] = int(os.environ.get("SPECTER_RETENTION_WEEKS", 26))
+app.config["SNAPSHOT_DIRECTORY"] = os.path.join(basedir, "local", "snapshots")
+# Unix socket the warm daemon serves CLI commands on
+app.config["DAEMON_SOCKET"] = os.environ.get(
+    "SPECTER_DAEMON_SOCKET", os.path.join(basedir, "local", "daemon.sock")
+)
+app.config["API_CACHE_SIZE"] = 256
+app.config["EXPORT_BATCH_SIZE"] = 1_000
+app.config["API_EVENT_POLL_SECONDS"] = 5
+# Render for humans when run interactively, otherwise as JSON lines for collection
+app.config["LOG_RENDERER"] = os.environ.get(
+    "SPECTER_LOG_RENDERER", "console" if sys.stderr.isatty() else "json"
+)
+app.config["LOG_LEVEL"] = os.environ.get("SPECTER_LOG_LEVEL", "info")
+# Hot loop events to thin out, keyed by the event message
+app.config["LOG_SAMPLE_EVERY"] = {}
+app.config["LOG_PER_SECOND"] = {"Duplicate file found": 10}
 app.cli.add_command(cli)
+configure_logging(
+    renderer=app.config["LOG_RENDERER"],
+    level=app.config["LOG_LEVEL"],
+    sample_every=app.config["LOG_SAMPLE_EVERY"],
+    per_second=app.config["LOG_PER_SECOND"],
+)
 db.init_app(app)
 
 
@@ -29,3 +62,9 @@ def main():
 
 
 from app import models
+from app.api import api
+
+with app.app_context():
+    models.use_auto_vacuum(db.engine)
+
+app.register_blueprint(api)
@@ -0,0 +1,241 @@
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from sqlalchemy import event as sa_event, func, select
+from sqlalchemy.orm import Session
+from structlog import get_logger
+
+import app.models as m
+from app.support.cache import LRUCache
+from app.support.shards import get_router
+from app.support.stream import MIMETYPES, stream_scrapes
+
+log = get_logger(name=__name__)
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+# Replaced with a cache of the configured size when the blueprint is registered
+cache: LRUCache[Any] = LRUCache()
+
+
+class EventVersion:
+    """
+    Tracks the id of the latest ingested Event. Every cached response and ETag is
+    keyed on this id, so a new ingest invalidates everything served before it. Inserts
+    made by this process expire the version immediately, ingests run by other processes
+    (the cron CLI commands) are picked up at most `API_EVENT_POLL_SECONDS` later.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latest: Optional[int] = None
+        self._checked_at = 0.0
+
+    def expire(self) -> None:
+        with self._lock:
+            self._checked_at = 0.0
+
+    def current(self, poll_seconds: float) -> int:
+        with self._lock:
+            now = time.monotonic()
+            if self._latest is not None and now - self._checked_at < poll_seconds:
+                return self._latest
+
+            latest = m.db.session.execute(select(func.max(m.Event.id))).scalar() or 0
+            if latest != self._latest:
+                log.debug("Event version changed, clearing API cache", event_id=latest)
+                cache.clear()
+
+            self._latest = latest
+            self._checked_at = now
+            return latest
+
+
+event_version = EventVersion()
+
+
+@sa_event.listens_for(m.Event, "after_insert")
+def _expire_on_ingest(*_: Any) -> None:
+    event_version.expire()
+
+
+@api.record_once
+def _configure_cache(state: Any) -> None:
+    global cache
+    cache = LRUCache(maxsize=state.app.config.get("API_CACHE_SIZE", 256))
+
+
+@contextmanager
+def _session_for(website: str) -> Iterator[Session]:
+    # When sharded every row for the site is on the one shard
+    router = get_router()
+    if not router:
+        yield m.db.session
+        return
+
+    with router.session_for(website) as session:
+        yield session
+
+
+def _get_page(session: Session, website: str) -> m.Page:
+    page = session.scalars(select(m.Page).filter_by(website=website)).one_or_none()
+    if not page:
+        abort(404, description=f"No page found for {website}")
+    return page
+
+
+def _latest_scrape_id(session: Session, page: m.Page, child: str) -> Optional[int]:
+    # The id of the scrape the latest children are stored on, which in delta storage
+    # is an earlier scrape when they have not changed since
+    latest = m.resolve_scrape(session, page.id, datetime.max)
+    return latest.get(f"{child}_scrape_id")
+
+
+def _traffic(session: Session, website: str) -> List[Dict[str, int]]:
+    page = _get_page(session, website)
+    rows = session.execute(
+        select(m.PageTraffic.year, m.PageTraffic.month, m.PageTraffic.traffic)
+        .filter_by(page_id=page.id)
+        .order_by(m.PageTraffic.year, m.PageTraffic.month)
+    )
+    return [
+        dict(year=year, month=month, traffic=traffic) for year, month, traffic in rows
+    ]
+
+
+def _growth(session: Session, website: str) -> List[Dict[str, Any]]:
+    # Mirrors the month on month growth used for the summary graphs
+    growth = []
+    last_traffic = None
+    for row in _traffic(session, website):
+        mom_growth = None
+        if last_traffic:
+            mom_growth = row["traffic"] / last_traffic - 1
+        growth.append(dict(row, mom_traffic_growth=mom_growth))
+        last_traffic = row["traffic"]
+    return growth
+
+
+def _countries(session: Session, website: str) -> List[Dict[str, Any]]:
+    scrape_id = _latest_scrape_id(session, _get_page(session, website), "countries")
+    rows = session.execute(
+        select(
+            m.PageCountriesDistribution.rank,
+            m.PageCountriesDistribution.country,
+            m.PageCountriesDistribution.percentage_value,
+        )
+        .filter_by(scrape_id=scrape_id)
+        .order_by(m.PageCountriesDistribution.rank)
+    )
+    return [
+        dict(rank=rank, country=country, percentage_value=percentage_value)
+        for rank, country, percentage_value in rows
+    ]
+
+
+def _demographics(session: Session, website: str) -> List[Dict[str, Any]]:
+    scrape_id = _latest_scrape_id(session, _get_page(session, website), "demographics")
+    rows = session.execute(
+        select(m.PageDemographics.age_range, m.PageDemographics.percentage_value)
+        .filter_by(scrape_id=scrape_id)
+        .order_by(m.PageDemographics.age_range)
+    )
+    return [
+        dict(age_range=age_range, percentage_value=percentage_value)
+        for age_range, percentage_value in rows
+    ]
+
+
+def _page_exists(website: str, event_id: int) -> bool:
+    # Pages are only created by an ingest, so whether one exists is cached per version
+    def load() -> bool:
+        with _session_for(website) as session:
+            return (
+                session.scalars(select(m.Page.id).filter_by(website=website)).first()
+                is not None
+            )
+
+    return cache.get_or_set(("page", website, event_id), load)
+
+
+def _cached_response(
+    resource: str, website: str, loader: Callable[[Session, str], Any]
+) -> Response:
+    event_id = event_version.current(current_app.config["API_EVENT_POLL_SECONDS"])
+    etag = str(event_id)
+    if not _page_exists(website, event_id):
+        abort(404, description=f"No page found for {website}")
+
+    # Conditional GETs are answered without loading the resource
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+
+        def load() -> Dict[str, Any]:
+            with _session_for(website) as session:
+                return dict(website=website, data=loader(session, website))
+
+        payload = cache.get_or_set((resource, website, event_id), load)
+        response = jsonify(payload)
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@api.route("/sites/<website>/traffic")
+def traffic(website: str) -> Response:
+    return _cached_response("traffic", website, _traffic)
+
+
+@api.route("/sites/<website>/growth")
+def growth(website: str) -> Response:
+    return _cached_response("growth", website, _growth)
+
+
+@api.route("/sites/<website>/countries")
+def countries(website: str) -> Response:
+    return _cached_response("countries", website, _countries)
+
+
+@api.route("/sites/<website>/demographics")
+def demographics(website: str) -> Response:
+    return _cached_response("demographics", website, _demographics)
+
+
+@api.route("/scrapes")
+def scrapes() -> Response:
+    """
+    Streams every scrape with its children as NDJSON (the default) or CSV with
+    `?format=csv`, optionally for a single `?website=`. The body is sent chunked as
+    it is read from the DB, and gzipped when the client accepts it.
+    """
+    format_ = request.args.get("format", "ndjson")
+    if format_ not in MIMETYPES:
+        abort(400, description=f"Unknown format {format_}")
+    gzip = "gzip" in request.accept_encodings
+
+    body = stream_scrapes(
+        format_,
+        gzip=gzip,
+        batch_size=current_app.config["EXPORT_BATCH_SIZE"],
+        website=request.args.get("website"),
+    )
+    response = Response(stream_with_context(body), mimetype=MIMETYPES[format_])
+    if gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
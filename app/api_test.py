@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import app.models as m
+
+
+def _ingest_traffic(website, traffic):
+    event = m.Event.create(path=f"test://{website}")
+    page = m.Page(website=website)
+    m.db.session.add(page)
+    m.db.session.flush()
+    scrape = m.PageScrape(
+        event_id=event.id, page_id=page.id, path=website, scraped_at=datetime.now()
+    )
+    m.db.session.add(scrape)
+    m.db.session.flush()
+    for month, visits in enumerate(traffic, start=1):
+        m.db.session.add(
+            m.PageTraffic(
+                page_rank=1,
+                year=2023,
+                month=month,
+                traffic=visits,
+                page_id=page.id,
+                scrape_id=scrape.id,
+            )
+        )
+    m.db.session.commit()
+
+
+def test_traffic__etag_and_not_modified(db_app):
+    _ingest_traffic("google.com", [100, 200])
+    client = db_app.test_client()
+
+    response = client.get("/api/sites/google.com/traffic")
+    assert response.status_code == 200
+    assert [row["traffic"] for row in response.json["data"]] == [100, 200]
+
+    etag = response.headers["ETag"]
+    response = client.get(
+        "/api/sites/google.com/traffic", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_traffic__new_ingest_changes_etag(db_app):
+    _ingest_traffic("google.com", [100])
+    client = db_app.test_client()
+    etag = client.get("/api/sites/google.com/traffic").headers["ETag"]
+
+    _ingest_traffic("bing.com", [50])
+    response = client.get(
+        "/api/sites/google.com/traffic", headers={"If-None-Match": etag}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_traffic__unknown_site_is_not_found(db_app):
+    _ingest_traffic("google.com", [100])
+    client = db_app.test_client()
+    etag = client.get("/api/sites/google.com/traffic").headers["ETag"]
+
+    assert client.get("/api/sites/unknown.com/traffic").status_code == 404
+    # A conditional GET for a site that does not exist is not answered with a 304
+    response = client.get(
+        "/api/sites/unknown.com/growth", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 404
@@ -1,25 +1,110 @@
 import click
+import importlib
 
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 from flask.cli import with_appcontext
 from structlog import get_logger
 
-from .scrape import scrape
-from .ingest import ingest
-from .summary import summary
-
 log = get_logger(name=__name__)
 
 
-@click.group(help="CLI commands for web scraping worker")
+class LazyGroup(click.Group):
+    """
+    Click group that only imports a subcommand's module when that subcommand is
+    invoked. Each command module pulls in its own heavy dependencies (bs4, pandas,
+    matplotlib), so eagerly registering them makes every command pay for all of them.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        lazy_subcommands: Optional[Dict[str, str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        # Maps the command name to the "module:attribute" it is imported from
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.lazy_subcommands:
+            return self._load_command(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _load_command(self, cmd_name: str) -> click.Command:
+        module_name, attr_name = self.lazy_subcommands[cmd_name].split(":")
+        command = getattr(importlib.import_module(module_name), attr_name)
+        assert isinstance(
+            command, click.Command
+        ), f"Lazy command {cmd_name} did not resolve to a click command"
+        return command
+
+
+@click.group(
+    cls=LazyGroup,
+    help="CLI commands for web scraping worker",
+    lazy_subcommands={
+        "scrape": "app.cli.scrape:scrape",
+        "ingest": "app.cli.ingest:ingest",
+        "summary": "app.cli.summary:summary",
+        "pipeline": "app.cli.pipeline:pipeline",
+        "worker": "app.cli.worker:worker",
+        "loadtest": "app.cli.loadtest:loadtest",
+        "export": "app.cli.export:export",
+        "snapshots": "app.cli.snapshots:snapshots",
+        "watch": "app.cli.watch:watch",
+        "maintenance": "app.cli.maintenance:maintenance",
+        "daemon": "app.cli.daemon:daemon",
+    },
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Write a cProfile of the command to app/local/profiles",
+)
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    help="Write tracemalloc top allocations of the command to app/local/profiles",
+)
+@click.option(
+    "--memory-interval",
+    type=float,
+    default=None,
+    help="Also snapshot allocations every given number of seconds while tracing",
+)
 @with_appcontext
-def cli() -> None:
-    pass
+@click.pass_context
+def cli(
+    ctx: click.Context,
+    profile: bool,
+    trace_memory: bool,
+    memory_interval: Optional[float],
+) -> None:
+    if not (profile or trace_memory):
+        return
+
+    from app.support.profiling import Profiler
+
+    profiler = Profiler(
+        command=ctx.invoked_subcommand or "cli",
+        output_dir=Path("app") / "local" / "profiles",
+        profile=profile,
+        trace_memory=trace_memory,
+        memory_interval=memory_interval,
+    )
+    profiler.start()
+    # Closing the group's context happens after the subcommand has finished
+    ctx.call_on_close(profiler.stop)
 
 
 @cli.command("create_tables", help="Create all SQLite tables")
 def create_tables() -> None:
     import app.models as m
+    from app.support.shards import get_router
 
     local_path = Path("app") / "local"
     if not local_path.exists():
@@ -36,11 +121,43 @@ def create_tables() -> None:
 
     log.info("Creating all tables")
     m.db.create_all()
+
+    router = get_router()
+    if router:
+        log.info("Creating all tables on shards", shards=router.count)
+        router.drop_all()
+        router.create_all()
+    log.info("Completed!")
+
+
+@cli.command("upgrade_tables", help="Upgrade the tables of an existing DB in place")
+def upgrade_tables() -> None:
+    import app.models as m
+    from app.support.shards import get_router
+
+    # Run before turning on a feature that needs the new columns, such as delta
+    # storage, on a DB created by an earlier version
+    with m.db.engine.begin() as connection:
+        log.info("Upgraded tables", changed=m.upgrade_schema(connection))
+
+    router = get_router()
+    if router:
+        for index, engine in enumerate(router.engines):
+            with engine.begin() as connection:
+                changed = m.upgrade_schema(connection)
+            log.info("Upgraded shard tables", shard=index, changed=changed)
     log.info("Completed!")
 
 
 @cli.command("tear_down", help="Deletes the database.db file")
 def tear_down() -> None:
+    from app.support.shards import get_router
+
+    router = get_router()
+    if router:
+        log.info("Deleting shard files", shards=router.count)
+        router.drop_all()
+
     log.info("Attempting to delete database.db file")
     db_path = Path("app") / "local" / "database.db"
 
@@ -50,8 +167,3 @@ def tear_down() -> None:
 
     db_path.unlink()
     log.info("Completed!")
-
-
-cli.add_command(scrape)
-cli.add_command(ingest)
-cli.add_command(summary)
@@ -0,0 +1,44 @@
+import click
+import signal
+
+from pathlib import Path
+from typing import Optional
+from flask import current_app
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+
+@click.group("daemon", help="Commands for the warm daemon serving CLI commands")
+def daemon():
+    pass
+
+
+@daemon.command(
+    "serve", help="Serve CLI commands over a Unix socket from a warm process"
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="Socket to listen on, DAEMON_SOCKET by default",
+)
+def serve(socket_path: Optional[Path]):
+    from app.cli import cli
+    from app.support.daemon import Daemon
+
+    warm_daemon = Daemon(
+        current_app._get_current_object(),  # type: ignore
+        cli,
+        socket_path or Path(current_app.config["DAEMON_SOCKET"]),
+    )
+
+    # Commands already running are left to finish in their own processes
+    def shutdown(*_) -> None:
+        log.info("Stopping daemon")
+        warm_daemon.stop.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    warm_daemon.run()
@@ -0,0 +1,56 @@
+import click
+import shutil
+
+from pathlib import Path
+from typing import Optional
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+
+@click.group("export", help="Commands for exporting data for analysis")
+def export():
+    pass
+
+
+@export.command(
+    "parquet", help="Append newly ingested data to the partitioned Parquet export"
+)
+@click.option(
+    "--output",
+    type=click.Path(path_type=Path),
+    default=Path("app/local/export"),
+    show_default=True,
+)
+@click.option("--full", is_flag=True, help="Rebuild the export from scratch")
+def parquet(output: Path, full: bool):
+    from app.support.export import export_parquet
+
+    if full and output.exists():
+        log.warn("Removing existing export to rebuild it", path=output)
+        shutil.rmtree(output)
+
+    events = export_parquet(output)
+    log.info("Completed export", events=events, path=output)
+
+
+@export.command("scrapes", help="Stream every scrape with its children to a file")
+@click.option(
+    "--format",
+    "format_",
+    type=click.Choice(["ndjson", "csv"]),
+    default="ndjson",
+    show_default=True,
+)
+@click.option("--output", default="-", help="File to write to, stdout by default")
+@click.option("--gzip", is_flag=True, help="Gzip the output")
+@click.option("--batch-size", default=1_000, show_default=True)
+@click.option("--website", help="Only export the scrapes of one website")
+def scrapes(
+    format_: str, output: str, gzip: bool, batch_size: int, website: Optional[str]
+):
+    from app.support.stream import stream_scrapes
+
+    with click.open_file(output, "wb") as output_file:
+        for chunk in stream_scrapes(format_, gzip, batch_size, website):
+            output_file.write(chunk)
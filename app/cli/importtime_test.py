@@ -0,0 +1,54 @@
+import subprocess
+import sys
+
+from pathlib import Path
+from typing import Dict
+
+# Cron fires the CLI commands thousands of times a day, so importing the app must stay
+# cheap. The budget is generous to allow for slow CI machines, the heavy modules check
+# is what catches an eager import creeping back in.
+IMPORT_BUDGET_SECONDS = 1.5
+HEAVY_MODULES = {"bs4", "pandas", "matplotlib", "js2xml"}
+ROOT_DIR = Path(__file__).parents[2]
+
+
+def _import_times(code: str) -> Dict[str, int]:
+    """
+    Runs the code in a fresh interpreter with `-X importtime` and returns the
+    cumulative import time in microseconds for every module imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_import_app__under_budget():
+    # Take the best of a few runs to smooth over a cold filesystem cache
+    best = min(_import_times("import app")["app"] for _ in range(3))
+    assert best < IMPORT_BUDGET_SECONDS * 1_000_000
+
+
+def test_import_app__no_heavy_modules():
+    imported = set(_import_times("import app"))
+    assert imported & HEAVY_MODULES == set()
+
+
+def test_resolve_ingest_command__no_heavy_modules():
+    code = (
+        "import click; from app.cli import cli; "
+        "assert cli.get_command(click.Context(cli), 'ingest') is not None"
+    )
+    imported = set(_import_times(code))
+    assert imported & HEAVY_MODULES == set()
@@ -3,9 +3,6 @@ from pathlib import Path
 
 from structlog import get_logger
 
-from app.support.serialise import csv_to_attrs
-from app.support.similarweb import SimilarWebConverter, SimilarWebIn
-
 log = get_logger(name=__name__)
 
 
@@ -19,7 +16,7 @@ def ingest():
 )
 @click.argument("filename")
 def load_similar_web(filename: str):
-    import app.models as m
+    from app.support.ingest import ingest_similar_web_file
 
     assert (
         "similarweb" in filename
@@ -29,57 +26,17 @@ def load_similar_web(filename: str):
     if not load_path.exists():
         raise NameError("No such file exists")
 
-    # Check to see if we have processed this file before
-    if m.Event.query.filter_by(path=str(load_path)).one_or_none():
-        log.warn("Duplicate file found", file=load_path)
-        return
-
-    # Create a new event for the file being ingested
-    event = m.Event.create(path=str(load_path))
-    m.db.session.flush()
-
-    # We don't check headers as this class has a complex structuring strategy
-    content = load_path.read_bytes()
-    parsed_content = csv_to_attrs(
-        SimilarWebIn, SimilarWebConverter, content, check_headers=False
-    )
-
-    # persist to model layer
-    for page in parsed_content:
-        m.PageScrape.create_from_similar_web(event=event, sw_page=page)
-
-    m.db.session.commit()
+    ingest_similar_web_file(load_path)
 
 
 @ingest.command("load_all_similar_web")
 def load_all_similar_web():
-    import app.models as m
+    from app.support.ingest import ingest_similar_web_file
 
     load_path = Path("app/local") / "input"
     if not load_path.exists():
         raise NameError("No such file exists")
 
-    # TODO: Refactor this so there isnt code duplication
     for file in load_path.glob("similarweb*"):
         log.info("Found SimilarWeb file to ingest", file=file)
-
-        # Check to see if we have processed this file before
-        if m.Event.query.filter_by(path=str(file)).one_or_none():
-            log.warn("Duplicate file found", file=file)
-            continue
-
-        # Create a new event for the file being ingested
-        event = m.Event.create(path=str(file))
-        m.db.session.flush()
-
-        # We don't check headers as this class has a complex structuring strategy
-        content = file.read_bytes()
-        parsed_content = csv_to_attrs(
-            SimilarWebIn, SimilarWebConverter, content, check_headers=False
-        )
-
-        # persist to model layer
-        for page in parsed_content:
-            m.PageScrape.create_from_similar_web(event=event, sw_page=page)
-
-        m.db.session.commit()
+        ingest_similar_web_file(file)
@@ -0,0 +1,158 @@
+import click
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+ROOT_DIR = Path(__file__).parents[2]
+
+
+def _run_flask(step_dir: Path, *args: str) -> Tuple[float, int]:
+    """
+    Runs a CLI command against the step's scratch DB in a fresh process, returning
+    the wall time in seconds and the peak RSS of the process in KiB.
+    """
+    env = dict(
+        os.environ,
+        FLASK_APP="app",
+        PYTHONPATH=str(ROOT_DIR),
+        SPECTER_DATABASE_URI="sqlite:///"
+        + str(step_dir.resolve() / "app" / "local" / "database.db"),
+        SPECTER_LOG_RENDERER="json",
+        # Logs go to stderr, only keep the warnings and errors of each step
+        SPECTER_LOG_LEVEL="warning",
+    )
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "flask", "cli", *args],
+        cwd=step_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    # wait4 gives the resource usage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - started
+
+    if process.returncode != 0:
+        raise click.ClickException(f"flask cli {' '.join(args)} failed in {step_dir}")
+    return elapsed, usage.ru_maxrss
+
+
+@click.group("loadtest", help="Commands for load testing ingest with synthetic data")
+def loadtest():
+    pass
+
+
+@loadtest.command("generate", help="Write synthetic SimilarWeb CSVs to a directory")
+@click.option("--pages", default=1_000, show_default=True)
+@click.option("--scrapes", default=10, show_default=True)
+@click.option(
+    "--null-ratio",
+    default=0.1,
+    show_default=True,
+    help="Fraction of rows for low traffic sites with almost no data",
+)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--output", type=click.Path(path_type=Path), default=Path("app/local/input")
+)
+def generate(pages: int, scrapes: int, null_ratio: float, seed: int, output: Path):
+    from app.support.loadtest import generate_similarweb_csvs
+
+    files = generate_similarweb_csvs(output, pages, scrapes, null_ratio, seed)
+    log.info("Generated synthetic files", files=len(files), rows=pages * scrapes)
+
+
+@loadtest.command("run", help="Ingest and summarise synthetic data at each scale step")
+@click.option(
+    "--steps",
+    default="10000,100000,1000000,10000000",
+    show_default=True,
+    help="Comma separated total rows to load at each step",
+)
+@click.option(
+    "--scrapes",
+    default=10,
+    show_default=True,
+    help="Number of scrape rounds the rows of each step are split over",
+)
+@click.option("--null-ratio", default=0.1, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--workdir",
+    type=click.Path(path_type=Path),
+    default=Path("app/local/loadtest"),
+    show_default=True,
+)
+@click.option("--keep/--no-keep", default=False, help="Keep each step's scratch files")
+def run(
+    steps: str, scrapes: int, null_ratio: float, seed: int, workdir: Path, keep: bool
+):
+    from rich.console import Console
+    from rich.table import Table
+    from app.support.loadtest import generate_similarweb_csvs
+
+    results: List[Dict[str, float]] = []
+    for rows in [int(step) for step in steps.split(",")]:
+        step_dir = workdir / f"rows_{rows}"
+        if step_dir.exists():
+            shutil.rmtree(step_dir)
+        local_dir = step_dir / "app" / "local"
+
+        pages = max(rows // scrapes, 1)
+        log.info("Generating load test step", rows=pages * scrapes, pages=pages)
+        generate_similarweb_csvs(
+            local_dir / "input", pages, scrapes, null_ratio=null_ratio, seed=seed
+        )
+
+        _run_flask(step_dir, "create_tables")
+        ingest_seconds, ingest_rss = _run_flask(
+            step_dir, "ingest", "load_all_similar_web"
+        )
+        summary_seconds, summary_rss = _run_flask(
+            step_dir, "summary", "all_analysis", "--force"
+        )
+        result = dict(
+            rows=pages * scrapes,
+            ingest_seconds=ingest_seconds,
+            rows_per_sec=pages * scrapes / ingest_seconds,
+            ingest_peak_rss_mib=ingest_rss / 1024,
+            db_size_mib=(local_dir / "database.db").stat().st_size / 1024**2,
+            summary_seconds=summary_seconds,
+            summary_peak_rss_mib=summary_rss / 1024,
+        )
+        log.info("Completed load test step", **result)
+        results.append(result)
+
+        if not keep:
+            shutil.rmtree(step_dir)
+
+    table = Table(
+        "Rows",
+        "Ingest (s)",
+        "Rows/sec",
+        "Ingest peak RSS (MiB)",
+        "DB size (MiB)",
+        "all_analysis (s)",
+        "all_analysis peak RSS (MiB)",
+        title="Ingest load test",
+    )
+    for result in results:
+        table.add_row(
+            f"{result['rows']:,}",
+            f"{result['ingest_seconds']:.1f}",
+            f"{result['rows_per_sec']:,.0f}",
+            f"{result['ingest_peak_rss_mib']:,.1f}",
+            f"{result['db_size_mib']:,.1f}",
+            f"{result['summary_seconds']:.1f}",
+            f"{result['summary_peak_rss_mib']:,.1f}",
+        )
+    Console().print(table)
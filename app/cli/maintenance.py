@@ -0,0 +1,61 @@
+import click
+
+from flask import current_app
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+
+@click.group("maintenance", help="Commands for keeping the DB size bounded")
+def maintenance():
+    pass
+
+
+@maintenance.command(
+    "compact", help="Roll scrapes older than the retention up into monthly aggregates"
+)
+@click.option(
+    "--keep-weeks",
+    type=int,
+    default=None,
+    help="Weeks of raw scrapes to keep, RETENTION_WEEKS by default",
+)
+@click.option(
+    "--batch-size",
+    default=100,
+    show_default=True,
+    help="Number of pages compacted in each transaction",
+)
+@click.option(
+    "--vacuum/--no-vacuum",
+    default=False,
+    help="Run a full vacuum instead of an incremental one",
+)
+def compact_scrapes(keep_weeks: int, batch_size: int, vacuum: bool):
+    import app.models as m
+    from app.support.maintenance import (
+        compact,
+        optimize,
+        record_compaction,
+        retention_boundary,
+    )
+    from app.support.shards import get_router
+
+    if keep_weeks is None:
+        keep_weeks = current_app.config["RETENTION_WEEKS"]
+    boundary = retention_boundary(keep_weeks)
+    log.info("Compacting scrapes", keep_weeks=keep_weeks, before=boundary.isoformat())
+
+    router = get_router()
+    sessions = (
+        [router.session(index) for index in range(router.count)]
+        if router
+        else [m.db.session]
+    )
+    for session in sessions:
+        compacted = compact(session, boundary, batch_size)
+        log.info("Compacted scrapes", scrapes=compacted)
+    record_compaction(sessions)
+    for session in sessions:
+        optimize(session, vacuum)
+        session.close()
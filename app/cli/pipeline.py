@@ -0,0 +1,194 @@
+import click
+import csv
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from flask import current_app
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+
+@click.group("pipeline", help="Commands for streaming data from scrape to the DB")
+def pipeline():
+    pass
+
+
+@pipeline.command(
+    "run", help="Scrape all local pages and ingest them without an intermediate CSV"
+)
+@click.option(
+    "--scrape-workers",
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of processes parsing pages",
+)
+@click.option(
+    "--structure-workers",
+    default=1,
+    show_default=True,
+    help="Number of threads structuring scraped data",
+)
+@click.option(
+    "--queue-size",
+    default=64,
+    show_default=True,
+    help="Maximum number of pages buffered between each stage",
+)
+@click.option(
+    "--commit-every",
+    default=500,
+    show_default=True,
+    help="Number of pages inserted per DB transaction",
+)
+@click.option(
+    "--tee/--no-tee",
+    default=False,
+    help="Also write the scraped data to a CSV in the input directory for auditing",
+)
+@click.option(
+    "--source",
+    type=click.Choice(["files", "store"]),
+    default="files",
+    show_default=True,
+    help="Scrape the saved pages, or the latest snapshot of every site in the store",
+)
+def run(
+    scrape_workers: int,
+    structure_workers: int,
+    queue_size: int,
+    commit_every: int,
+    tee: bool,
+    source: str,
+):
+    import app.models as m
+    from app.support.ingest import remove_event
+    from app.support.logs import Progress
+    from app.support.pipeline import Stage, run_pipeline
+    from app.support.scrape import scrape_similarweb_content, scrape_similarweb_file
+    from app.support.serialise import field_aliases
+    from app.support.shards import get_router
+    from app.support.similarweb import SimilarWebConverter, SimilarWebIn, SimilarWebRaw
+
+    pages: Iterable[Any]
+    if source == "store":
+        from app.support.snapshots import get_store, snapshot_path
+
+        store = get_store()
+        # Read up front as the session is not shared with the stage threads
+        pages = [(snapshot.digest, snapshot.scraped_at) for snapshot in store.latest()]
+
+        def scrape(executor: ProcessPoolExecutor, page: Any) -> Any:
+            # Blobs are decompressed in the stage threads, and only parsed in the
+            # worker processes
+            digest, scraped_at = page
+            return executor.submit(
+                scrape_similarweb_content,
+                store.get(digest),
+                snapshot_path(digest),
+                scraped_at,
+            ).result()
+
+    else:
+        path = Path("app/local") / "scraped_pages"
+        if not path.exists():
+            raise NameError(f"Local scraping directory does not exist")
+        pages = path.glob("*.html")
+
+        def scrape(executor: ProcessPoolExecutor, page: Any) -> Any:
+            return executor.submit(scrape_similarweb_file, page).result()
+
+    write_path = Path("app/local") / "input"
+    file_name = datetime.utcnow().strftime("similarweb_%Y%m%d_%H%M%S.csv")
+
+    tee_file = None
+    tee_writer: Optional[csv.DictWriter] = None
+    if tee:
+        if not write_path.exists():
+            log.info("Creating local directory for saving scraped data")
+            write_path.mkdir(parents=True)
+
+        tee_path = write_path / file_name
+        log.info("Writing scraped data locally", filename=tee_path)
+        tee_file = open(tee_path, "w", newline="")
+        tee_writer = csv.DictWriter(tee_file, field_aliases(SimilarWebRaw))
+        tee_writer.writeheader()
+        # The tee is recorded as the ingested file so it is not loaded a second time
+        # by ingest load_all_similar_web
+        event_path = str(tee_path)
+    else:
+        event_path = f"pipeline://{file_name}"
+
+    # Rows are committed in batches, so the event is only complete with the last one
+    event = m.Event.create(path=event_path, complete=False)
+    m.db.session.flush()
+    event_id = event.id
+
+    def structure(raw: Dict[str, str]) -> Tuple[Dict[str, str], Any]:
+        return raw, SimilarWebConverter.structure(raw, SimilarWebIn)
+
+    router = get_router()
+    if not router:
+        m.use_storage_mode(m.db.session, current_app.config["DELTA_STORAGE"])
+    batch: List[Any] = []
+
+    def flush_batch() -> None:
+        # When sharded each batch is routed and written to the shards in parallel
+        if router and batch:
+            router.ingest(event, batch, skip_existing=False)
+            batch.clear()
+        m.db.session.commit()
+
+    def insert(item: Tuple[Dict[str, str], Any]) -> None:
+        raw, sw_page = item
+        if tee_writer:
+            tee_writer.writerow(raw)
+
+        if router:
+            batch.append(sw_page)
+        else:
+            m.PageScrape.create_from_similar_web(
+                event=event, sw_page=sw_page, delta=current_app.config["DELTA_STORAGE"]
+            )
+
+        progress.advance()
+        if progress.done % commit_every == 0:
+            flush_batch()
+
+    progress = Progress(log, "Streaming pages to DB")
+    try:
+        # Pages are parsed in worker processes, the stage threads only wait on them
+        with ProcessPoolExecutor(max_workers=scrape_workers) as executor:
+            count = run_pipeline(
+                pages,
+                [
+                    Stage(
+                        "scrape",
+                        lambda page: scrape(executor, page),
+                        workers=scrape_workers,
+                    ),
+                    Stage("structure", structure, workers=structure_workers),
+                ],
+                insert,
+                queue_size=queue_size,
+            )
+        event.complete = True
+        flush_batch()
+        progress.finish()
+    except BaseException:
+        # Rows are committed in batches as they stream in, so a failed run removes
+        # the ones it committed, rather than leaving a partial run recorded as done
+        log.error("Pipeline run failed, removing the rows ingested", path=event_path)
+        remove_event(event_id)
+        if tee_file:
+            tee_file.close()
+            tee_path.unlink(missing_ok=True)
+        raise
+    finally:
+        if tee_file:
+            tee_file.close()
+
+    log.info("Completed pipeline run", pages=count, path=event_path)
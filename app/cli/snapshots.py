@@ -0,0 +1,97 @@
+import click
+
+from pathlib import Path
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+
+@click.group("snapshots", help="Commands for the raw HTML snapshot store")
+def snapshots():
+    pass
+
+
+@snapshots.command("import", help="Import saved pages into the snapshot store")
+@click.option(
+    "--directory",
+    type=click.Path(path_type=Path),
+    default=Path("app/local/scraped_pages"),
+    show_default=True,
+)
+@click.option(
+    "--remove/--no-remove",
+    default=False,
+    help="Remove each page once it is stored",
+)
+def import_pages(directory: Path, remove: bool):
+    import app.models as m
+    from app.support.logs import Progress
+    from app.support.snapshots import get_store
+
+    if not directory.exists():
+        raise NameError(f"{directory} does not exist")
+
+    store = get_store()
+    progress = Progress(log, "Importing snapshots")
+    for file in sorted(directory.glob("*.html")):
+        snapshot = store.add_file(file)
+        if snapshot not in m.db.session.new:
+            log.debug("Snapshot already stored", file=file)
+        m.db.session.commit()
+
+        if remove:
+            file.unlink()
+        progress.advance()
+    progress.finish()
+
+
+@snapshots.command(
+    "train_dictionary", help="Train a zstd dictionary on the stored snapshots"
+)
+@click.option("--samples", default=1_000, show_default=True)
+@click.option("--size", default=112_640, show_default=True, help="Size in bytes")
+def train_dictionary(samples: int, size: int):
+    import app.models as m
+    from sqlalchemy import select
+    from app.support.snapshots import get_store
+
+    store = get_store()
+    digests = m.db.session.scalars(
+        select(m.Snapshot.digest)
+        .distinct()
+        .order_by(m.Snapshot.scraped_at.desc())
+        .limit(samples)
+    ).all()
+    if not digests:
+        raise NameError("No snapshots to train a dictionary on")
+
+    dict_id = store.train_dictionary([store.get(digest) for digest in digests], size)
+    log.info("Trained snapshot dictionary", dict_id=dict_id, samples=len(digests))
+
+
+@snapshots.command("stats", help="Show the size of the snapshot store")
+def stats():
+    import app.models as m
+    from rich.console import Console
+    from rich.table import Table
+    from sqlalchemy import func, select
+    from app.support.snapshots import get_store
+
+    store = get_store()
+    snapshot_count, raw_size = m.db.session.execute(
+        select(func.count(m.Snapshot.id), func.coalesce(func.sum(m.Snapshot.size), 0))
+    ).one()
+    blob_count = m.db.session.execute(
+        select(func.count(m.Snapshot.digest.distinct()))
+    ).scalar()
+    stored_size = store.disk_usage()
+
+    table = Table("Snapshots", "Blobs", "Raw (MiB)", "Stored (MiB)", "Ratio")
+    table.add_row(
+        f"{snapshot_count:,}",
+        f"{blob_count:,}",
+        f"{raw_size / 1024**2:,.2f}",
+        f"{stored_size / 1024**2:,.2f}",
+        f"{raw_size / stored_size:,.1f}x" if stored_size else "-",
+    )
+    Console().print(table)
@@ -1,5 +1,7 @@
 import click
 
+from typing import Optional
+
 
 @click.group("summary", help="Commands for producing summary statistics on data")
 def summary():
@@ -7,8 +9,18 @@ def summary():
 
 
 @summary.command("all_analysis")
-def all_analysis():
+@click.option(
+    "--force", is_flag=True, help="Redraw every graph, even if its data is unchanged"
+)
+@click.option(
+    "--source",
+    type=click.Choice(["sqlite", "parquet"]),
+    default="sqlite",
+    show_default=True,
+    help="Read from the DB or from the Parquet export",
+)
+@click.option("--since", default=None, help="Only include traffic from YYYY-MM")
+def all_analysis(force: bool, source: str, since: Optional[str]):
     import app.support.summary as s
 
-    s.all_analysis()
-    pass
+    s.all_analysis(force=force, source=source, since=since)
@@ -0,0 +1,156 @@
+import click
+import hashlib
+import signal
+
+from functools import partial
+from pathlib import Path
+from typing import List
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+
+def _scrape_batch(files: List[Path], store: bool = False) -> None:
+    import app.models as m
+    from app.support.scrape import save_similarweb_data, scrape_similarweb_file
+
+    snapshots = None
+    if store:
+        from app.support.snapshots import get_store
+
+        snapshots = get_store()
+
+    data_points = []
+    for file in files:
+        try:
+            if snapshots:
+                # Every page is kept in the store and scraped from its snapshot, so
+                # the scraped data points at the snapshot rather than the file
+                snapshot = snapshots.add_file(file)
+                m.db.session.commit()
+                data_points.append(snapshots.scrape(snapshot))
+            else:
+                data_points.append(scrape_similarweb_file(file))
+        except AssertionError:
+            # A malformed page fails the same way every time, so it is not retried
+            log.exception("Failed to scrape page, skipping it", file=file)
+    if not data_points:
+        return
+
+    # Name the output after the batch so that reprocessing a batch after a crash
+    # rewrites the same file, which the ingest then skips if it was already loaded
+    batch_hash = hashlib.sha256()
+    for file in files:
+        batch_hash.update(f"{file.name}:{file.stat().st_ctime_ns}\n".encode("utf-8"))
+    save_similarweb_data(
+        data_points, name=f"similarweb_watch_{batch_hash.hexdigest()[:16]}.csv"
+    )
+
+
+def _ingest_batch(files: List[Path]) -> None:
+    import app.models as m
+    from app.support.ingest import ingest_similar_web_file
+
+    try:
+        for file in files:
+            ingest_similar_web_file(file)
+    finally:
+        # Start every batch with an empty identity map as the watcher never exits,
+        # and without the Event of a failed ingest, which would make its retry skip
+        # the file as a duplicate
+        m.db.session.remove()
+
+
+@click.group("watch", help="Commands for scraping and ingesting files as they land")
+def watch():
+    pass
+
+
+@watch.command("run", help="Watch the local directories and process new files")
+@click.option("--batch-size", default=50, show_default=True)
+@click.option(
+    "--batch-seconds",
+    default=5.0,
+    show_default=True,
+    help="Longest a new file waits for its batch to fill up",
+)
+@click.option(
+    "--settle-seconds",
+    default=1.0,
+    show_default=True,
+    help="How long a file must be unchanged before it is processed",
+)
+@click.option("--poll-seconds", default=1.0, show_default=True)
+@click.option(
+    "--max-attempts",
+    default=3,
+    show_default=True,
+    help="Failures of a file on its own before it is moved into failed/",
+)
+@click.option(
+    "--lookback-seconds",
+    default=60.0,
+    show_default=True,
+    help="How far before the latest file processed a late file is still picked up",
+)
+@click.option(
+    "--polling/--inotify",
+    default=False,
+    help="Poll the directories even where inotify is available",
+)
+@click.option(
+    "--store/--no-store",
+    default=False,
+    help="Add new pages to the snapshot store and scrape them from their snapshot",
+)
+@click.option(
+    "--cursor",
+    type=click.Path(path_type=Path),
+    default=Path("app/local/watch_cursor.json"),
+    show_default=True,
+)
+def run(
+    batch_size: int,
+    batch_seconds: float,
+    settle_seconds: float,
+    poll_seconds: float,
+    max_attempts: int,
+    lookback_seconds: float,
+    polling: bool,
+    store: bool,
+    cursor: Path,
+):
+    from app.support.watch import Cursor, Target, Watcher
+
+    local_path = Path("app/local")
+    targets = [
+        Target(
+            "scraped_pages",
+            local_path / "scraped_pages",
+            "*.html",
+            partial(_scrape_batch, store=store),
+        ),
+        Target("input", local_path / "input", "similarweb*", _ingest_batch),
+    ]
+    for target in targets:
+        target.directory.mkdir(parents=True, exist_ok=True)
+
+    watcher = Watcher(
+        targets,
+        Cursor(cursor, lookback_seconds=lookback_seconds),
+        batch_size=batch_size,
+        batch_seconds=batch_seconds,
+        settle_seconds=settle_seconds,
+        poll_seconds=poll_seconds,
+        use_inotify=not polling,
+        max_attempts=max_attempts,
+    )
+
+    # Finish the batch in flight so the cursor matches what was processed
+    def shutdown(*_) -> None:
+        log.info("Stopping watcher")
+        watcher.stop.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    watcher.run()
@@ -0,0 +1,95 @@
+import click
+import json
+import signal
+
+from typing import Dict, Tuple
+from flask import current_app
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+
+def _parse_concurrency(values: Tuple[str, ...]) -> Dict[str, int]:
+    concurrency = {}
+    for value in values:
+        kind, _, count = value.partition("=")
+        concurrency[kind] = int(count or 1)
+    return concurrency
+
+
+@click.group("worker", help="Commands for the durable job queue and its workers")
+def worker():
+    pass
+
+
+@worker.command("run", help="Run a long lived worker pulling jobs from the queue")
+@click.option(
+    "--concurrency",
+    "-c",
+    multiple=True,
+    default=("scrape_page=4", "ingest_file=1", "summarise_site=1"),
+    show_default=True,
+    help="Number of threads for a job kind, given as kind=count",
+)
+@click.option("--lease-seconds", default=60, show_default=True)
+@click.option("--poll-seconds", default=1.0, show_default=True)
+@click.option(
+    "--retry-seconds",
+    default=30,
+    show_default=True,
+    help="Base delay before a failed job is retried, doubled on every attempt",
+)
+def run(
+    concurrency: Tuple[str, ...],
+    lease_seconds: int,
+    poll_seconds: float,
+    retry_seconds: int,
+):
+    from app.support.jobs import Worker
+
+    job_worker = Worker(
+        current_app._get_current_object(),  # type: ignore
+        _parse_concurrency(concurrency),
+        lease_seconds=lease_seconds,
+        poll_seconds=poll_seconds,
+        retry_seconds=retry_seconds,
+    )
+
+    # Finish the jobs in flight before exiting so their leases are released
+    def shutdown(*_) -> None:
+        log.info("Stopping worker, waiting on running jobs")
+        job_worker.stop.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    job_worker.run()
+
+
+@worker.command("enqueue", help="Add a job to the queue")
+@click.argument("kind")
+@click.argument("payload")
+@click.option("--priority", default=0, show_default=True)
+@click.option("--max-attempts", default=3, show_default=True)
+def enqueue(kind: str, payload: str, priority: int, max_attempts: int):
+    from app.support.jobs import enqueue as enqueue_job
+
+    enqueue_job(kind, json.loads(payload), priority=priority, max_attempts=max_attempts)
+
+
+@worker.command("status", help="Count the jobs in the queue by kind and status")
+def status():
+    import app.models as m
+
+    from rich.console import Console
+    from rich.table import Table
+    from sqlalchemy import func, select
+
+    table = Table("Kind", "Status", "Jobs")
+    rows = m.db.session.execute(
+        select(m.Job.kind, m.Job.status, func.count())
+        .group_by(m.Job.kind, m.Job.status)
+        .order_by(m.Job.kind, m.Job.status)
+    )
+    for kind, job_status, count in rows:
+        table.add_row(kind, job_status, str(count))
+    Console().print(table)
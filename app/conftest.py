@@ -0,0 +1,34 @@
+import pytest
+
+from flask import Flask
+
+
+@pytest.fixture
+def db_app(tmp_path):
+    """
+    A copy of the app bound to an empty SQLite DB in a temporary directory, with
+    the tables created and an app context pushed. The local DB is never touched.
+    """
+    from app import app, db
+    from app.api import api, event_version
+
+    test_app = Flask("app")
+    test_app.config.update(app.config)
+    test_app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'database.db'}",
+        SHARD_COUNT=0,
+        SHARD_DIRECTORY=str(tmp_path / "shards"),
+        SNAPSHOT_DIRECTORY=str(tmp_path / "snapshots"),
+        DELTA_STORAGE=False,
+        API_EVENT_POLL_SECONDS=0,
+    )
+    db.init_app(test_app)
+    test_app.register_blueprint(api)
+
+    with test_app.app_context():
+        db.create_all()
+        event_version.expire()
+        yield test_app
+        db.session.remove()
+        db.engine.dispose()
@@ -1,13 +1,50 @@
 from __future__ import annotations
-from typing import List
+import sqlite3
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Union,
+)
 from attrs import asdict
 from structlog import get_logger
 
 from app import db
 from datetime import datetime
-from sqlalchemy import ForeignKey, String, UnicodeText, UniqueConstraint, func
-from sqlalchemy.orm import Mapped, mapped_column, relationship
-from app.support.similarweb import SimilarWebIn
+from sqlalchemy import (
+    DDL,
+    Connection,
+    Engine,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    UnicodeText,
+    UniqueConstraint,
+    and_,
+    column,
+    event as sa_event,
+    func,
+    insert,
+    inspect,
+    or_,
+    select,
+    table,
+)
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql import FromClause
+from sqlalchemy.orm import Mapped, Session, mapped_column, relationship
+
+if TYPE_CHECKING:
+    from app.support.similarweb import SimilarWebBatch, SimilarWebIn
 
 log = get_logger(name=__name__)
 
@@ -16,22 +53,38 @@ class Event(db.Model):  # type: ignore
     """
     Events are a record of the fact that a file has been ingested. This is persisted
     to prevent duplication of data by processing a file twice.
+
+    An ingest that commits its rows in several transactions, like the pipeline,
+    creates its Event incomplete and only marks it complete with its last rows.
     """
 
     id: Mapped[int] = mapped_column(primary_key=True)
     path: Mapped[str] = mapped_column(index=True)
+    complete: Mapped[bool] = mapped_column(server_default="1")
 
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
 
     __table_args__ = (UniqueConstraint("path"),)
 
     @classmethod
-    def create(cls, path: str) -> Event:
-        event = cls(path=path)
+    def create(cls, path: str, complete: bool = True) -> Event:
+        event = cls(path=path, complete=complete)
         db.session.add(event)
         return event
 
 
+class Setting(db.Model):  # type: ignore
+    """
+    Settings the data in a DB was written with, which later reads and writes of it
+    have to follow whatever the app is configured with now. Every shard has its own.
+    """
+
+    DELTA_STORAGE = "delta_storage"
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    value: Mapped[str] = mapped_column(UnicodeText)
+
+
 class Page(db.Model):  # type: ignore
     """
     Page is to ensure that a scrape we can identify a single website being scraped
@@ -52,7 +105,27 @@ class Page(db.Model):  # type: ignore
     __table_args__ = (UniqueConstraint("website"),)
 
 
+# The values of a scrape that delta storage only stores when they have changed since
+# the previous scrape of the page, left as null otherwise
+DELTA_COLUMNS = [
+    "global_rank",
+    "country_rank",
+    "category_rank",
+    "total_visits",
+    "bounce_rate",
+    "pages_per_visit",
+    "avg_vist_duration",
+]
+
+
 class PageScrape(db.Model):  # type: ignore
+    """
+    A single scrape of a page. With `DELTA_STORAGE` on, the values and the countries
+    and demographics that are unchanged since the previous scrape of the page are
+    not stored again. Values are left null and children are flagged as inherited,
+    and the `*_full` views reconstruct the full record of every scrape.
+    """
+
     id: Mapped[int] = mapped_column(primary_key=True)
     path: Mapped[str] = mapped_column(UnicodeText(265))
 
@@ -64,14 +137,19 @@ class PageScrape(db.Model):  # type: ignore
     page_id: Mapped[int] = mapped_column(ForeignKey("page.id"))
     page: Mapped["Page"] = relationship()
 
-    global_rank: Mapped[int]
-    country_rank: Mapped[int]
-    category_rank: Mapped[int]
+    global_rank: Mapped[Optional[int]]
+    country_rank: Mapped[Optional[int]]
+    category_rank: Mapped[Optional[int]]
 
-    total_visits: Mapped[int]
-    bounce_rate: Mapped[float]
-    pages_per_visit: Mapped[float]
-    avg_vist_duration: Mapped[int]
+    total_visits: Mapped[Optional[int]]
+    bounce_rate: Mapped[Optional[float]]
+    pages_per_visit: Mapped[Optional[float]]
+    avg_vist_duration: Mapped[Optional[int]]
+
+    countries_inherited: Mapped[bool] = mapped_column(default=False, server_default="0")
+    demographics_inherited: Mapped[bool] = mapped_column(
+        default=False, server_default="0"
+    )
 
     demographics: Mapped[List[PageDemographics]] = relationship(
         back_populates="scrape", cascade="all, delete-orphan"
@@ -82,37 +160,77 @@ class PageScrape(db.Model):  # type: ignore
     countries_distribution: Mapped[List[PageCountriesDistribution]] = relationship(
         back_populates="scrape", cascade="all, delete-orphan"
     )
+    rank_history: Mapped[List[PageRankHistory]] = relationship(
+        back_populates="scrape", cascade="all, delete-orphan"
+    )
+
+    __table_args__ = (Index("ix_page_scrape_history", "page_id", "scraped_at", "id"),)
 
     @classmethod
     def create_from_similar_web(
-        cls, *, event: Event, sw_page: SimilarWebIn
+        cls,
+        *,
+        event: Event,
+        sw_page: SimilarWebIn,
+        session: Optional[Session] = None,
+        delta: bool = False,
     ) -> PageScrape:
-        page = Page.query.filter_by(website=sw_page.page).one_or_none()
+        # A session is passed in when writing to one of the shards
+        session = session or db.session
+
+        page = session.scalars(
+            select(Page).filter_by(website=sw_page.page)
+        ).one_or_none()
         if not page:
-            log.info(f"No page found, creating new record", website=sw_page.page)
+            log.debug(f"No page found, creating new record", website=sw_page.page)
             page = Page(website=sw_page.page)
-            db.session.add(page)
-            db.session.flush()
+            session.add(page)
+            session.flush()
+
+        values = {column: getattr(sw_page, column) for column in DELTA_COLUMNS}
+        countries = [asdict(country) for country in sw_page.country_distributions]
+        demographics = [asdict(age) for age in sw_page.demographics]
+        inherited = dict(countries_inherited=False, demographics_inherited=False)
+
+        if delta:
+            # Inserting before a later scrape would change what its deltas resolve to
+            later = session.scalars(
+                select(PageScrape)
+                .filter_by(page_id=page.id)
+                .where(PageScrape.scraped_at > sw_page.scraped_at)
+                .order_by(PageScrape.scraped_at, PageScrape.id)
+                .limit(1)
+            ).first()
+            if later:
+                later.rebase(session)
+
+            previous = resolve_scrape(session, page.id, sw_page.scraped_at)
+            if previous:
+                values = {
+                    column: None if value == previous[column] else value
+                    for column, value in values.items()
+                }
+                inherited["countries_inherited"] = countries == child_values(
+                    session, PageCountriesDistribution, previous["countries_scrape_id"]
+                )
+                inherited["demographics_inherited"] = demographics == child_values(
+                    session, PageDemographics, previous["demographics_scrape_id"]
+                )
 
         scrape = cls(
             event_id=event.id,
             page_id=page.id,
             path=sw_page.path,
             scraped_at=sw_page.scraped_at,
-            global_rank=sw_page.global_rank,
-            country_rank=sw_page.country_rank,
-            category_rank=sw_page.category_rank,
-            total_visits=sw_page.total_visits,
-            bounce_rate=sw_page.bounce_rate,
-            pages_per_visit=sw_page.pages_per_visit,
-            avg_vist_duration=sw_page.avg_vist_duration,
+            **values,
+            **inherited,
         )
-        db.session.add(scrape)
-        db.session.flush()
+        session.add(scrape)
+        session.flush()
 
         additional_ids = dict(page_id=page.id, scrape_id=scrape.id)
 
-        log.info(
+        log.debug(
             "Creating page scrape",
             page_id=page.id,
             page_scrape_id=scrape.id,
@@ -120,24 +238,262 @@ class PageScrape(db.Model):  # type: ignore
         )
         # Create all of the one to many data points
         for sw_traffic in sw_page.monthly_traffic:
-            if PageTraffic.query.filter_by(
-                page_id=page.id, month=sw_traffic.month, year=sw_traffic.year
+            if session.scalars(
+                select(PageTraffic).filter_by(
+                    page_id=page.id, month=sw_traffic.month, year=sw_traffic.year
+                )
             ).one_or_none():
                 continue
 
             traffic = PageTraffic(**asdict(sw_traffic), **additional_ids)
-            db.session.add(traffic)
+            session.add(traffic)
+
+        for sw_rank in sw_page.rank_history:
+            if session.scalars(
+                select(PageRankHistory).filter_by(
+                    page_id=page.id, month=sw_rank.month, year=sw_rank.year
+                )
+            ).one_or_none():
+                continue
+
+            rank = PageRankHistory(**asdict(sw_rank), **additional_ids)
+            session.add(rank)
 
-        for sw_country in sw_page.country_distributions:
-            country = PageCountriesDistribution(**asdict(sw_country), **additional_ids)
-            db.session.add(country)
+        if not scrape.countries_inherited:
+            for country in countries:
+                session.add(PageCountriesDistribution(**country, **additional_ids))
 
-        for sw_demographics in sw_page.demographics:
-            demographics = PageDemographics(**asdict(sw_demographics), **additional_ids)
-            db.session.add(demographics)
+        if not scrape.demographics_inherited:
+            for age in demographics:
+                session.add(PageDemographics(**age, **additional_ids))
 
         return scrape
 
+    @classmethod
+    def create_from_batch(
+        cls,
+        *,
+        event: Event,
+        batch: SimilarWebBatch,
+        session: Optional[Session] = None,
+        delta: bool = False,
+    ) -> int:
+        """
+        Inserts every page of the batch with a multi row insert per table for each
+        slice of `INSERT_BATCH_SIZE` rows, reading the values straight from the
+        batch's columns instead of building a scrape per row. Stores the same rows
+        as `create_from_similar_web` would, in the same order. Returns the number of
+        scrapes inserted.
+        """
+        session = session or db.session
+        if delta:
+            # Delta storage compares each scrape with the one before it
+            for sw_page in batch:
+                cls.create_from_similar_web(
+                    event=event, sw_page=sw_page, session=session, delta=True
+                )
+            return len(batch)
+        if not len(batch):
+            return 0
+
+        # Pages are created in the order they first appear, as one at a time would
+        page_ids = _page_ids(session, list(dict.fromkeys(batch.pages)))
+        # Like the single row insert, only the first scrape to see a month records it
+        seen = {
+            model: _recorded_months(session, model, set(page_ids.values()))
+            for model in [PageTraffic, PageRankHistory]
+        }
+        # Only the parameters of a slice of the batch are built at a time
+        for start in range(0, len(batch), INSERT_BATCH_SIZE):
+            indexes = range(start, min(start + INSERT_BATCH_SIZE, len(batch)))
+            # SQLite gives inserted rows ascending ids in the order they are inserted,
+            # and the ids are sorted back into that order as RETURNING has none
+            scrape_ids = sorted(
+                session.scalars(
+                    insert(PageScrape).returning(PageScrape.id),
+                    [
+                        dict(
+                            event_id=event.id,
+                            page_id=page_ids[batch.pages[index]],
+                            path=batch.paths[index],
+                            scraped_at=batch.scraped_at(index),
+                            **{
+                                column: batch.scalars[column][index]
+                                for column in DELTA_COLUMNS
+                            },
+                        )
+                        for index in indexes
+                    ],
+                ).all()
+            )
+            log.debug(
+                "Created page scrapes", event_id=event.id, scrapes=len(scrape_ids)
+            )
+
+            for model, name in [
+                (PageTraffic, "monthly_traffic"),
+                (PageRankHistory, "rank_history"),
+                (PageCountriesDistribution, "country_distributions"),
+                (PageDemographics, "demographics"),
+            ]:
+                rows = []
+                for index, scrape_id in zip(indexes, scrape_ids):
+                    page_id = page_ids[batch.pages[index]]
+                    for child in batch.child_rows(name, index):
+                        if model in seen:
+                            month = (page_id, child["year"], child["month"])
+                            if month in seen[model]:
+                                continue
+                            seen[model].add(month)
+                        rows.append(dict(child, page_id=page_id, scrape_id=scrape_id))
+                if rows:
+                    session.execute(insert(model), rows)
+        return len(batch)
+
+    def rebase(self, session: Session) -> None:
+        """
+        Materialises every value and child this scrape inherits in delta storage, so
+        it no longer depends on the scrapes before it. This has to happen before a
+        scrape is inserted before it or the scrapes it inherits from are deleted.
+        """
+        resolved = resolve_scrape(session, self.page_id, self.scraped_at, self.id)
+        for column in DELTA_COLUMNS:
+            if getattr(self, column) is None:
+                setattr(self, column, resolved[column])
+
+        additional_ids = dict(page_id=self.page_id, scrape_id=self.id)
+        if self.countries_inherited:
+            for country in child_values(
+                session, PageCountriesDistribution, resolved["countries_scrape_id"]
+            ):
+                session.add(PageCountriesDistribution(**country, **additional_ids))
+            self.countries_inherited = False
+
+        if self.demographics_inherited:
+            for age in child_values(
+                session, PageDemographics, resolved["demographics_scrape_id"]
+            ):
+                session.add(PageDemographics(**age, **additional_ids))
+            self.demographics_inherited = False
+        session.flush()
+
+
+# Keeps the number of bound parameters of an IN query well under SQLite's limit
+IN_BATCH_SIZE = 500
+# Rows of a batch inserted per execute, bounding the parameters built at once
+INSERT_BATCH_SIZE = 5_000
+
+
+def _batches(values: Iterable[Any]) -> Iterator[List[Any]]:
+    values = list(values)
+    for start in range(0, len(values), IN_BATCH_SIZE):
+        yield values[start : start + IN_BATCH_SIZE]
+
+
+def _page_ids(session: Session, websites: List[str]) -> Dict[str, int]:
+    # The id of the Page of each website, creating the ones that do not exist yet
+    page_ids: Dict[str, int] = {}
+    for websites_batch in _batches(websites):
+        page_ids.update(
+            session.execute(
+                select(Page.website, Page.id).where(Page.website.in_(websites_batch))
+            ).all()
+        )
+
+    missing = [website for website in websites if website not in page_ids]
+    if missing:
+        log.debug("No pages found, creating new records", pages=len(missing))
+        page_ids.update(
+            session.execute(
+                insert(Page).returning(Page.website, Page.id),
+                [dict(website=website) for website in missing],
+            ).all()
+        )
+    return page_ids
+
+
+def _recorded_months(session: Session, model: Any, page_ids: Set[int]) -> Set[tuple]:
+    months: Set[tuple] = set()
+    for page_ids_batch in _batches(page_ids):
+        months.update(
+            tuple(row)
+            for row in session.execute(
+                select(model.page_id, model.year, model.month).where(
+                    model.page_id.in_(page_ids_batch)
+                )
+            ).all()
+        )
+    return months
+
+
+def resolve_scrape(
+    session: Session,
+    page_id: int,
+    scraped_at: datetime,
+    scrape_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Resolves the full values of a page as of its latest scrape at or before
+    `scraped_at` (and `scrape_id`, for scrapes at the same time), the same way as the
+    page_scrape_full view. Also resolves the ids of the scrapes the countries and
+    demographics are stored on. Returns an empty dict if there is no such scrape.
+    """
+    until = PageScrape.scraped_at <= scraped_at
+    if scrape_id is not None:
+        until = or_(
+            PageScrape.scraped_at < scraped_at,
+            and_(PageScrape.scraped_at == scraped_at, PageScrape.id <= scrape_id),
+        )
+    rows = session.execute(
+        select(
+            PageScrape.id,
+            PageScrape.countries_inherited,
+            PageScrape.demographics_inherited,
+            *[getattr(PageScrape, column) for column in DELTA_COLUMNS],
+        )
+        .where(PageScrape.page_id == page_id, until)
+        .order_by(PageScrape.scraped_at.desc(), PageScrape.id.desc())
+        .execution_options(yield_per=16)
+    )
+
+    # Walk back until every value has been found, usually only a few scrapes
+    resolved: Dict[str, Any] = {}
+    for row in rows:
+        if not resolved:
+            resolved = dict.fromkeys(
+                [*DELTA_COLUMNS, "countries_scrape_id", "demographics_scrape_id"]
+            )
+        for column in DELTA_COLUMNS:
+            if resolved[column] is None:
+                resolved[column] = getattr(row, column)
+        if resolved["countries_scrape_id"] is None and not row.countries_inherited:
+            resolved["countries_scrape_id"] = row.id
+        if (
+            resolved["demographics_scrape_id"] is None
+            and not row.demographics_inherited
+        ):
+            resolved["demographics_scrape_id"] = row.id
+        if all(value is not None for value in resolved.values()):
+            break
+    return resolved
+
+
+def child_values(
+    session: Session, model: Any, scrape_id: Optional[int]
+) -> List[Dict[str, Any]]:
+    # The values of the child rows of a scrape, in the shape of their attrs class
+    columns = [
+        name
+        for name in model.__table__.columns.keys()
+        if name not in ("id", "page_id", "scrape_id")
+    ]
+    rows = session.execute(
+        select(*[getattr(model, name) for name in columns])
+        .filter_by(scrape_id=scrape_id)
+        .order_by(model.id)
+    )
+    return [dict(zip(columns, row)) for row in rows]
+
 
 class PageTraffic(db.Model):  # type: ignore
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -149,8 +505,32 @@ class PageTraffic(db.Model):  # type: ignore
     page_id: Mapped[int] = mapped_column(ForeignKey("page.id"))
     page: Mapped["Page"] = relationship()
 
-    scrape_id: Mapped[int] = mapped_column(ForeignKey("page_scrape.id"))
-    scrape: Mapped["PageScrape"] = relationship(back_populates="traffic")
+    # Traffic is kept when the scrape that recorded it is compacted, along with the
+    # event the scrape was ingested by
+    scrape_id: Mapped[Optional[int]] = mapped_column(ForeignKey("page_scrape.id"))
+    scrape: Mapped[Optional["PageScrape"]] = relationship(back_populates="traffic")
+    event_id: Mapped[Optional[int]] = mapped_column(ForeignKey("event.id"))
+
+    __table_args__ = (UniqueConstraint("page_id", "month", "year"),)
+
+
+class PageRankHistory(db.Model):  # type: ignore
+    """
+    The global rank of a page at the end of each month, decoded from the ranking
+    chart. Like the traffic, a month is only recorded by the first scrape to see it.
+    """
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    month: Mapped[int]
+    year: Mapped[int]
+    rank: Mapped[int]
+
+    page_id: Mapped[int] = mapped_column(ForeignKey("page.id"))
+    page: Mapped["Page"] = relationship()
+
+    scrape_id: Mapped[Optional[int]] = mapped_column(ForeignKey("page_scrape.id"))
+    scrape: Mapped[Optional["PageScrape"]] = relationship(back_populates="rank_history")
+    event_id: Mapped[Optional[int]] = mapped_column(ForeignKey("event.id"))
 
     __table_args__ = (UniqueConstraint("page_id", "month", "year"),)
 
@@ -163,7 +543,8 @@ class PageDemographics(db.Model):  # type: ignore
     page_id: Mapped[int] = mapped_column(ForeignKey("page.id"))
     page: Mapped["Page"] = relationship()
 
-    scrape_id: Mapped[int] = mapped_column(ForeignKey("page_scrape.id"))
+    # Indexed as the children of each scrape are looked up by it
+    scrape_id: Mapped[int] = mapped_column(ForeignKey("page_scrape.id"), index=True)
     scrape: Mapped["PageScrape"] = relationship(back_populates="demographics")
 
 
@@ -176,5 +557,356 @@ class PageCountriesDistribution(db.Model):  # type: ignore
     page_id: Mapped[int] = mapped_column(ForeignKey("page.id"))
     page: Mapped["Page"] = relationship()
 
-    scrape_id: Mapped[int] = mapped_column(ForeignKey("page_scrape.id"))
+    scrape_id: Mapped[int] = mapped_column(ForeignKey("page_scrape.id"), index=True)
     scrape: Mapped["PageScrape"] = relationship(back_populates="countries_distribution")
+
+
+class PageScrapeMonthly(db.Model):  # type: ignore
+    """
+    The roll up of a page's scrapes in a month, written when maintenance compact
+    deletes scrapes older than the retention period. Values are the mean over the
+    month's scrapes, and the countries and demographics are the mean percentage of
+    each country and age range, stored as JSON lists.
+
+    The Event is the compaction that last wrote the roll up, which is only set once
+    the compaction has finished, see `record_compaction`.
+    """
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    year: Mapped[int]
+    month: Mapped[int]
+
+    page_id: Mapped[int] = mapped_column(ForeignKey("page.id"))
+    page: Mapped["Page"] = relationship()
+
+    scrapes: Mapped[int]
+    first_scraped_at: Mapped[datetime]
+    last_scraped_at: Mapped[datetime]
+
+    global_rank: Mapped[Optional[float]]
+    country_rank: Mapped[Optional[float]]
+    category_rank: Mapped[Optional[float]]
+
+    total_visits: Mapped[Optional[float]]
+    bounce_rate: Mapped[Optional[float]]
+    pages_per_visit: Mapped[Optional[float]]
+    avg_vist_duration: Mapped[Optional[float]]
+
+    countries: Mapped[str] = mapped_column(UnicodeText, default="[]")
+    demographics: Mapped[str] = mapped_column(UnicodeText, default="[]")
+
+    event_id: Mapped[Optional[int]] = mapped_column(ForeignKey("event.id"))
+
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (UniqueConstraint("page_id", "year", "month"),)
+
+
+class Job(db.Model):  # type: ignore
+    """
+    Jobs are units of work (scraping a page, ingesting a file, summarising a site)
+    pulled from the queue by long running workers. A worker holds a lease on the job
+    while running it and keeps extending it with heartbeats, if the worker dies the
+    lease expires and the job is picked up again by another worker.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50))
+    payload: Mapped[str] = mapped_column(UnicodeText)
+    status: Mapped[str] = mapped_column(String(15), default=PENDING)
+    priority: Mapped[int] = mapped_column(default=0)
+
+    attempts: Mapped[int] = mapped_column(default=0)
+    max_attempts: Mapped[int] = mapped_column(default=3)
+    last_error: Mapped[Optional[str]] = mapped_column(UnicodeText)
+
+    run_after: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(100))
+    lease_expires_at: Mapped[Optional[datetime]]
+    heartbeat_at: Mapped[Optional[datetime]]
+
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    finished_at: Mapped[Optional[datetime]]
+
+    __table_args__ = (Index("ix_job_lease", "status", "kind", "priority"),)
+
+
+class Snapshot(db.Model):  # type: ignore
+    """
+    Snapshots index the raw HTML of a scraped page in the content addressed snapshot
+    store. Identical pages share the same blob, identified by the sha256 digest of
+    the uncompressed HTML.
+    """
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    website: Mapped[str] = mapped_column(UnicodeText(100))
+    scraped_at: Mapped[datetime]
+    digest: Mapped[str] = mapped_column(String(64))
+    size: Mapped[int]
+
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (UniqueConstraint("website", "scraped_at"),)
+
+
+def _page_scrape_full_sql() -> str:
+    # A running count of the non null values of a column numbers the runs of scrapes
+    # inheriting the same value, so the value of each run is the max over it. This
+    # resolves every scrape in a single pass instead of a lookup per scrape.
+    groups = [
+        f"count({column}) over history as {column}_run" for column in DELTA_COLUMNS
+    ]
+    values = [
+        f"max({column}) over (partition by page_id, {column}_run) as {column}"
+        for column in DELTA_COLUMNS
+    ]
+    for child in ["countries", "demographics"]:
+        stored = f"case when not {child}_inherited then id end"
+        groups.append(f"count({stored}) over history as {child}_run")
+        values.append(
+            f"max({stored}) over (partition by page_id, {child}_run) "
+            f"as {child}_scrape_id"
+        )
+
+    return f"""
+    create view if not exists page_scrape_full as
+    with runs as (
+        select *, {", ".join(groups)}
+        from page_scrape
+        window history as (partition by page_id order by scraped_at, id)
+    )
+    select id, path, scraped_at, created_at, event_id, page_id, {", ".join(values)}
+    from runs
+    """
+
+
+def _child_full_sql(child_table: str, child: str, columns: List[str]) -> str:
+    # Every scrape reads the child rows of the scrape they are stored on
+    return f"""
+    create view if not exists {child_table}_full as
+    select c.id, {", ".join(f"c.{column}" for column in columns)},
+        psf.page_id, psf.id as scrape_id
+    from page_scrape_full psf
+    join {child_table} c on c.scrape_id = psf.{child}_scrape_id
+    """
+
+
+# Views reconstructing the full record of every scrape from delta storage. In full
+# storage nothing is inherited, so they read the same as the tables.
+VIEWS = {
+    "page_scrape_full": _page_scrape_full_sql(),
+    "page_countries_distribution_full": _child_full_sql(
+        "page_countries_distribution",
+        "countries",
+        ["rank", "country", "percentage_value"],
+    ),
+    "page_demographics_full": _child_full_sql(
+        "page_demographics", "demographics", ["age_range", "percentage_value"]
+    ),
+}
+
+
+def _set_auto_vacuum(dbapi_connection: Any, _: Any) -> None:
+    # Only applies to a DB created by this connection
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("pragma auto_vacuum = incremental")
+    cursor.close()
+
+
+def use_auto_vacuum(engine: Engine) -> None:
+    """
+    Creates the DBs of the engine with incremental auto vacuum, which lets
+    maintenance compact hand the pages it frees back to the file system. Only the
+    engines of the app and its shards are set up, not every engine in the process.
+    """
+    sa_event.listen(engine, "connect", _set_auto_vacuum)
+
+
+for sql in VIEWS.values():
+    sa_event.listen(db.metadata, "after_create", DDL(sql))
+for name in reversed(VIEWS):
+    sa_event.listen(db.metadata, "before_drop", DDL(f"drop view if exists {name}"))
+
+
+def _rebuild_table(connection: Connection, table: Table, columns: List[str]) -> None:
+    # SQLite cannot alter a column, so the table is created again under a temporary
+    # name without its indexes, the rows copied over and the new table renamed
+    metadata = MetaData()
+    for other in db.metadata.sorted_tables:
+        other.to_metadata(metadata)
+    rebuilt = table.to_metadata(metadata, name=f"_upgrade_{table.name}")
+    rebuilt.indexes.clear()
+    rebuilt.create(connection)
+
+    names = ", ".join(columns)
+    connection.exec_driver_sql(
+        f"insert into {rebuilt.name} ({names}) select {names} from {table.name}"
+    )
+    connection.exec_driver_sql(f"drop table {table.name}")
+    connection.exec_driver_sql(f"alter table {rebuilt.name} rename to {table.name}")
+
+
+def upgrade_schema(connection: Connection) -> List[str]:
+    """
+    Brings a DB created by an earlier version up to date with the models, returning
+    the tables changed. `create_all` only creates missing tables, so columns added
+    since are added with their server default, and tables with a column that has
+    since become nullable are rebuilt. Missing tables, indexes and views are then
+    created as usual.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+
+    # The views read the tables being rebuilt, they are created again at the end
+    for name in reversed(VIEWS):
+        connection.exec_driver_sql(f"drop view if exists {name}")
+
+    changed = []
+    for model_table in db.metadata.sorted_tables:
+        if model_table.name not in existing_tables:
+            continue
+        existing = {
+            column["name"]: column for column in inspector.get_columns(model_table.name)
+        }
+        missing = [c for c in model_table.columns if c.name not in existing]
+        relaxed = [
+            c
+            for c in model_table.columns
+            if c.name in existing and c.nullable and not existing[c.name]["nullable"]
+        ]
+        if not missing and not relaxed:
+            continue
+
+        for added in missing:
+            assert (
+                added.nullable or added.server_default is not None
+            ), f"Column {model_table.name}.{added.name} needs a server default"
+        if relaxed:
+            _rebuild_table(
+                connection,
+                model_table,
+                [name for name in existing if name in model_table.columns],
+            )
+        else:
+            for added in missing:
+                ddl = CreateColumn(added).compile(dialect=connection.dialect)
+                connection.exec_driver_sql(
+                    f"alter table {model_table.name} add column {ddl}"
+                )
+        log.info(
+            "Upgraded table",
+            table=model_table.name,
+            added=[c.name for c in missing],
+            nullable=[c.name for c in relaxed],
+        )
+        changed.append(model_table.name)
+
+    for model_table in db.metadata.sorted_tables:
+        if model_table.name in existing_tables:
+            for index in model_table.indexes:
+                index.create(connection, checkfirst=True)
+    db.metadata.create_all(connection)
+    return changed
+
+
+# Typed like the table so that values such as scraped_at are read back as datetimes
+page_scrape_full = table(
+    "page_scrape_full",
+    *[
+        column(name, PageScrape.__table__.c[name].type)
+        for name in ["id", "path", "scraped_at", "event_id", "page_id", *DELTA_COLUMNS]
+    ],
+    column("countries_scrape_id", Integer),
+    column("demographics_scrape_id", Integer),
+)
+
+
+def stored_delta(connection: Union[Session, Connection]) -> bool:
+    """
+    Returns whether the scrapes of the DB were written with delta storage, as
+    recorded by `use_storage_mode`, rather than whether it is turned on now. A DB
+    written before the mode was recorded is in delta storage if any scrape inherits
+    its countries or demographics.
+    """
+    value = connection.scalar(
+        select(Setting.value).filter_by(name=Setting.DELTA_STORAGE)
+    )
+    if value is not None:
+        return value == "1"
+    inherited = PageScrape.countries_inherited | PageScrape.demographics_inherited
+    return (
+        connection.scalar(select(PageScrape.id).where(inherited).limit(1)) is not None
+    )
+
+
+def use_storage_mode(session: Session, delta: bool) -> None:
+    """
+    Records the storage mode of the DB before scrapes are ingested into it. A DB in
+    full storage can be switched to delta storage, as its full rows are read the
+    same by the views, but a DB in delta storage can not be ingested into without
+    it, as the rows would be read through the views and inherit values they do not.
+    """
+    setting = session.get(Setting, Setting.DELTA_STORAGE)
+    stored = stored_delta(session)
+    if stored and not delta:
+        raise ValueError(
+            "The DB was ingested with delta storage, turn on SPECTER_DELTA_STORAGE "
+            "to ingest into it"
+        )
+    if setting and setting.value == str(int(delta)):
+        return
+
+    if delta and session.scalar(select(PageScrape.id).limit(1)) is not None:
+        log.warn("Switching the DB to delta storage")
+    if setting:
+        setting.value = str(int(delta))
+    else:
+        session.add(Setting(name=Setting.DELTA_STORAGE, value=str(int(delta))))
+    session.flush()
+
+
+def page_scrape_source(delta: bool) -> FromClause:
+    """
+    Returns the scrapes in the shape of `page_scrape_full`, with the values they
+    inherit resolved and the ids of the scrapes their countries and demographics are
+    stored on. Without delta storage nothing is inherited, so the table is read
+    directly rather than through the view, whose window functions sort every scrape.
+    """
+    if delta:
+        return page_scrape_full
+    scrape = PageScrape.__table__.c
+    return select(
+        *[scrape[name] for name in page_scrape_full.c.keys() if name in scrape],
+        scrape.id.label("countries_scrape_id"),
+        scrape.id.label("demographics_scrape_id"),
+    ).subquery("page_scrape_stored")
+
+
+page_countries_distribution_full = table(
+    "page_countries_distribution_full",
+    *[
+        column(name)
+        for name in [
+            "id",
+            "rank",
+            "country",
+            "percentage_value",
+            "page_id",
+            "scrape_id",
+        ]
+    ],
+)
+page_demographics_full = table(
+    "page_demographics_full",
+    *[
+        column(name)
+        for name in ["id", "age_range", "percentage_value", "page_id", "scrape_id"]
+    ],
+)
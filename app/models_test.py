@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import pytest
+
+from sqlalchemy import create_engine, text
+
+import app.models as m
+from support.ingest import ingest_similar_web_file
+from support.ingest_test import ROW, write_csv
+from support.stream import iter_scrape_batches
+
+# The tables as the first version created them, before delta storage
+OLD_SCHEMA = [
+    """
+    create table event (
+        id integer not null, path varchar not null,
+        created_at datetime default current_timestamp not null,
+        primary key (id), unique (path)
+    )
+    """,
+    "create index ix_event_path on event (path)",
+    """
+    create table page (
+        id integer not null, website text(100) not null,
+        created_at datetime default current_timestamp not null,
+        primary key (id), unique (website)
+    )
+    """,
+    """
+    create table page_scrape (
+        id integer not null, path text(265) not null, scraped_at datetime not null,
+        created_at datetime default current_timestamp not null,
+        event_id integer not null, page_id integer not null,
+        global_rank integer not null, country_rank integer not null,
+        category_rank integer not null, total_visits integer not null,
+        bounce_rate double not null, pages_per_visit double not null,
+        avg_vist_duration integer not null,
+        primary key (id),
+        foreign key(event_id) references event (id),
+        foreign key(page_id) references page (id)
+    )
+    """,
+    "insert into event (id, path) values (1, 'old.csv')",
+    "insert into page (id, website) values (1, 'google.com')",
+    """
+    insert into page_scrape values (
+        1, 'old.html', '2023-01-14 00:00:00.000000', '2023-01-14 00:00:00.000000',
+        1, 1, 1, 1, 1, 86400000000, 0.2877, 8.29, 635
+    )
+    """,
+]
+
+
+def test_upgrade_schema__old_db(db_app, tmp_path):
+    db_app.config["DELTA_STORAGE"] = True
+    m.db.drop_all()
+    with m.db.engine.begin() as connection:
+        for sql in OLD_SCHEMA:
+            connection.exec_driver_sql(sql)
+
+    with m.db.engine.begin() as connection:
+        assert m.upgrade_schema(connection) == ["event", "page_scrape"]
+    with m.db.engine.begin() as connection:
+        assert m.upgrade_schema(connection) == []
+
+    assert ingest_similar_web_file(write_csv(tmp_path / "new.csv", [ROW]))
+    old, new = m.PageScrape.query.order_by(m.PageScrape.id).all()
+    assert (old.total_visits, old.countries_inherited) == (86_400_000_000, False)
+    # Unchanged since the old scrape, so delta storage leaves it null
+    assert new.scraped_at == datetime(2023, 1, 15, 12, 49, 28, 850051)
+    assert new.total_visits is None
+    assert (
+        m.db.session.execute(
+            text("select total_visits from page_scrape_full where id = :id"),
+            dict(id=new.id),
+        ).scalar()
+        == 86_400_000_000
+    )
+
+
+def test_use_auto_vacuum__only_engines_set_up(tmp_path):
+    def auto_vacuum(engine):
+        with engine.begin() as connection:
+            connection.exec_driver_sql("create table t (x)")
+            return connection.exec_driver_sql("pragma auto_vacuum").scalar()
+
+    other = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    app_engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    m.use_auto_vacuum(app_engine)
+
+    assert (auto_vacuum(other), auto_vacuum(app_engine)) == (0, 2)
+
+
+def test_use_storage_mode__delta_db_is_read_as_delta(db_app, tmp_path):
+    db_app.config["DELTA_STORAGE"] = True
+    later = dict(ROW, **{"Scraped At": "2023-01-16T00:00:00"})
+    ingest_similar_web_file(write_csv(tmp_path / "first.csv", [ROW]))
+    ingest_similar_web_file(write_csv(tmp_path / "second.csv", [later]))
+
+    # The inherited values are still resolved once delta storage is turned off,
+    # but no more scrapes can be ingested without it
+    db_app.config["DELTA_STORAGE"] = False
+    scrapes = [row for batch in iter_scrape_batches() for row in batch]
+    assert [scrape["global_rank"] for scrape in scrapes] == [1, 1]
+    assert [len(scrape["countries"]) for scrape in scrapes] == [2, 2]
+
+    third = dict(ROW, **{"Scraped At": "2023-01-17T00:00:00"})
+    with pytest.raises(ValueError, match="delta storage"):
+        ingest_similar_web_file(write_csv(tmp_path / "third.csv", [third]))
+
+
+def test_use_storage_mode__full_db_switches_to_delta(db_app, tmp_path):
+    ingest_similar_web_file(write_csv(tmp_path / "first.csv", [ROW]))
+    assert not m.stored_delta(m.db.session)
+
+    db_app.config["DELTA_STORAGE"] = True
+    later = dict(ROW, **{"Scraped At": "2023-01-16T00:00:00"})
+    assert ingest_similar_web_file(write_csv(tmp_path / "second.csv", [later]))
+
+    assert m.stored_delta(m.db.session)
+    assert m.db.session.get(m.Setting, m.Setting.DELTA_STORAGE).value == "1"
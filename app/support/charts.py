@@ -0,0 +1,193 @@
+import re
+
+from typing import List, Optional, Tuple
+from bs4 import Tag
+
+import numpy as np
+
+# A command letter or a number in SVG path data, numbers may run together as in
+# `10-5` or `1.5.5`
+PATH_TOKEN_PATTERN = re.compile(r"[A-Za-z]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+# The number of parameters taken by each path command, the point a segment ends on
+# is always the last pair (or the single coordinate of a horizontal or vertical line)
+PATH_PARAMETERS = {
+    "M": 2,
+    "L": 2,
+    "H": 1,
+    "V": 1,
+    "C": 6,
+    "S": 4,
+    "Q": 4,
+    "T": 2,
+    "A": 7,
+}
+TRANSLATE_PATTERN = re.compile(r"translate\(\s*(-?[\d.]+)(?:[\s,]+(-?[\d.]+))?\s*\)")
+UNITS = {"K": 1e3, "M": 1e6, "B": 1e9, "T": 1e12}
+
+
+def parse_label(label: str) -> Optional[float]:
+    """
+    Parses an axis tick label such as `#1,000`, `2.5M` or `40%` into a number,
+    returning None for labels that are not numbers.
+    """
+    text = label.strip().lstrip("#").rstrip("%").replace(",", "")
+    scale = 1.0
+    if text and text[-1].upper() in UNITS:
+        scale = UNITS[text[-1].upper()]
+        text = text[:-1]
+    try:
+        return float(text) * scale
+    except ValueError:
+        return None
+
+
+def _offset(tag: Tag) -> np.ndarray:
+    # The sum of the translations of the tag and every group it is drawn in
+    offset = np.zeros(2)
+    for element in [tag, *tag.parents]:
+        if not isinstance(element, Tag) or element.name == "svg":
+            break
+        match = TRANSLATE_PATTERN.search(element.get("transform", ""))
+        if match:
+            offset += [float(match.group(1)), float(match.group(2) or 0)]
+    return offset
+
+
+def _coordinate(tag: Tag, attribute: str) -> float:
+    return float(tag.get(attribute, 0))
+
+
+def fit_axis(pixels: np.ndarray, values: np.ndarray) -> Tuple[float, float]:
+    """
+    Least squares fit of the linear map from pixel position to value along an axis,
+    returning the slope and intercept. Fitting every tick rather than using the first
+    and last absorbs the rounding of the tick label positions.
+    """
+    assert len(pixels) >= 2, f"At least 2 ticks are needed, found {len(pixels)}"
+    design = np.column_stack([pixels, np.ones_like(pixels)])
+    (slope, intercept), *_ = np.linalg.lstsq(design, values, rcond=None)
+    return float(slope), float(intercept)
+
+
+def path_points(path: str) -> np.ndarray:
+    """
+    Returns the point every segment of SVG path data ends on as an (n, 2) array of
+    absolute positions. The control points of curves are skipped, as the points of
+    a spline series are where its curves meet. Closing a path adds no point.
+    """
+    tokens = PATH_TOKEN_PATTERN.findall(path)
+    assert (
+        tokens and tokens[0] in "Mm"
+    ), f"Path must start with a move, recieved: {path}"
+
+    points: List[Tuple[float, float]] = []
+    current = start = (0.0, 0.0)
+    index = 0
+    while index < len(tokens):
+        command = tokens[index]
+        index += 1
+        if command in "Zz":
+            current = start
+            continue
+        assert command.upper() in PATH_PARAMETERS, f"Unknown path command: {command}"
+
+        # A command repeats for as many sets of parameters as follow it
+        count = PATH_PARAMETERS[command.upper()]
+        while True:
+            parameters = tokens[index : index + count]
+            assert len(parameters) == count and not any(
+                token.isalpha() for token in parameters
+            ), f"Expected {count} parameters for {command} in path: {path}"
+            index += count
+
+            x, y = current if command.islower() else (0.0, 0.0)
+            values = [float(token) for token in parameters]
+            if command in "Hh":
+                current = (x + values[0], current[1])
+            elif command in "Vv":
+                current = (current[0], y + values[0])
+            else:
+                current = (x + values[-2], y + values[-1])
+            points.append(current)
+
+            if command in "Mm":
+                start = current
+                # Pairs after a move are lines
+                command = "l" if command == "m" else "L"
+            if index >= len(tokens) or tokens[index].isalpha():
+                break
+    return np.array(points)
+
+
+def _y_axis(chart: Tag) -> Tuple[float, float]:
+    ticks = [
+        (_coordinate(label, "y") + _offset(label)[1], parse_label(label.text))
+        for label in chart.select(".highcharts-yaxis-labels text")
+    ]
+    ticks = sorted((pixel, value) for pixel, value in ticks if value is not None)
+    pixels = np.array([pixel for pixel, _ in ticks])
+    values = np.array([value for _, value in ticks])
+
+    # Grid lines sit exactly on the ticks, whereas the labels are offset by the font
+    # baseline, so use the grid when there is a line for every label. Both are paired
+    # top to bottom.
+    grid_lines = chart.select(".highcharts-yaxis-grid path")
+    if len(grid_lines) == len(ticks):
+        pixels = np.sort(
+            [
+                path_points(line.get("d", ""))[0, 1] + _offset(line)[1]
+                for line in grid_lines
+            ]
+        )
+    return fit_axis(pixels, values)
+
+
+def _series_points(chart: Tag) -> np.ndarray:
+    """
+    Returns the plotted points of the first series as an (n, 2) array of absolute x
+    and y pixel positions, from either a line or spline's path or a column's rects.
+    """
+    series = chart.select_one(".highcharts-series")
+    assert series, "No series found in chart"
+    offset = _offset(series)
+
+    graph = series.select_one("path.highcharts-graph")
+    if graph:
+        return path_points(graph["d"]) + offset
+
+    rects = series.select("rect.highcharts-point")
+    assert rects, "Series has neither a graph nor points"
+    geometry = np.array(
+        [
+            [_coordinate(rect, "x"), _coordinate(rect, "y"), _coordinate(rect, "width")]
+            for rect in rects
+        ]
+    )
+    # The value of a column is at the centre of its top edge
+    return (
+        np.column_stack([geometry[:, 0] + geometry[:, 2] / 2, geometry[:, 1]]) + offset
+    )
+
+
+def decode_series(chart: Tag) -> List[Tuple[str, float]]:
+    """
+    Decodes the first series of a server rendered Highcharts SVG back into the
+    values it plots, keyed by the x axis label each point sits on. The y axis is
+    recovered from its tick labels, and every point is transformed at once.
+    """
+    slope, intercept = _y_axis(chart)
+    points = _series_points(chart)
+    values = points[:, 1] * slope + intercept
+
+    x_labels = chart.select(".highcharts-xaxis-labels text")
+    assert x_labels, "No x axis labels found in chart"
+    label_x = np.array(
+        [_coordinate(label, "x") + _offset(label)[0] for label in x_labels]
+    )
+
+    # Each label takes the value of the point plotted closest to it
+    nearest = np.abs(points[None, :, 0] - label_x[:, None]).argmin(axis=1)
+    return [
+        (label.text.strip(), float(values[index]))
+        for label, index in zip(x_labels, nearest)
+    ]
@@ -0,0 +1,108 @@
+import pytest
+
+from bs4 import BeautifulSoup
+
+from support.charts import decode_series, fit_axis, parse_label, path_points
+
+# A ranking chart as Highcharts renders it, the plot area is translated inside the
+# SVG and the rank axis is reversed so the best rank is at the top
+RANKING_CHART = """
+<div class="wa-rank-list__chart"><svg width="400" height="200">
+<g class="highcharts-grid highcharts-yaxis-grid">
+<path d="M 50 20.5 L 390 20.5"></path>
+<path d="M 50 80.5 L 390 80.5"></path>
+<path d="M 50 140.5 L 390 140.5"></path>
+</g>
+<g class="highcharts-series-group">
+<g class="highcharts-series" transform="translate(50,10) scale(1 1)">
+<path class="highcharts-graph" d="M 20 70.5 L 120 40.5 L 220 10.5 L 320 130.5"></path>
+</g>
+</g>
+<g class="highcharts-axis-labels highcharts-xaxis-labels">
+<text x="70" y="190">Sep</text><text x="170" y="190">Oct</text>
+<text x="270" y="190">Nov</text><text x="370" y="190">Dec</text>
+</g>
+<g class="highcharts-axis-labels highcharts-yaxis-labels">
+<text x="40" y="24">#1,000</text><text x="40" y="84">#2,000</text>
+<text x="40" y="144">#3,000</text>
+</g>
+</svg></div>
+"""
+
+
+def test_parse_label():
+    assert parse_label("#1,000") == 1_000
+    assert parse_label("2.5M") == 2_500_000
+    assert parse_label("40%") == 40
+    assert parse_label("Oct") is None
+
+
+def test_fit_axis__least_squares():
+    slope, intercept = fit_axis([0.0, 10.0, 20.1], [0.0, 100.0, 200.0])
+
+    assert slope == pytest.approx(9.95, abs=0.01)
+    assert intercept == pytest.approx(0.0, abs=1)
+
+
+def test_decode_series__line_chart():
+    chart = BeautifulSoup(RANKING_CHART, "html.parser")
+
+    series = decode_series(chart)
+
+    assert [month for month, _ in series] == ["Sep", "Oct", "Nov", "Dec"]
+    assert [round(rank) for _, rank in series] == [2_000, 1_500, 1_000, 3_000]
+
+
+def test_decode_series__spline_chart():
+    # The same points joined by curves, in relative coordinates
+    spline = "m 20 70.5 c 30 0 70 -30 100 -30 s 70 -30 100 -30 c 40 0 60 120 100 120"
+    chart = BeautifulSoup(
+        RANKING_CHART.replace("M 20 70.5 L 120 40.5 L 220 10.5 L 320 130.5", spline),
+        "html.parser",
+    )
+
+    series = decode_series(chart)
+
+    assert [round(rank) for _, rank in series] == [2_000, 1_500, 1_000, 3_000]
+
+
+def test_path_points__commands():
+    assert path_points("M10,20 30-5h5v.5Z").tolist() == [
+        [10, 20],
+        [30, -5],
+        [35, -5],
+        [35, -4.5],
+    ]
+    assert path_points("m 10 20 l 5 5 z m 1 1").tolist() == [
+        [10, 20],
+        [15, 25],
+        [11, 21],
+    ]
+
+
+def test_path_points__malformed():
+    with pytest.raises(AssertionError, match="Unknown path command"):
+        path_points("M 10 20 X 30 40")
+    with pytest.raises(AssertionError, match="Expected 2 parameters"):
+        path_points("M 10 20 L 30")
+
+
+def test_decode_series__column_chart():
+    chart = BeautifulSoup(
+        """
+        <svg>
+        <g class="highcharts-series" transform="translate(10,0)">
+        <rect class="highcharts-point" x="0" y="50" width="20" height="50"></rect>
+        <rect class="highcharts-point" x="40" y="25" width="20" height="75"></rect>
+        </g>
+        <g class="highcharts-xaxis-labels"><text x="20">Jan</text><text x="60">Feb</text></g>
+        <g class="highcharts-yaxis-labels"><text y="100">0</text><text y="0">100K</text></g>
+        </svg>
+        """,
+        "html.parser",
+    )
+
+    assert decode_series(chart) == [
+        ("Jan", pytest.approx(50_000)),
+        ("Feb", pytest.approx(75_000)),
+    ]
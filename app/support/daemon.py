@@ -0,0 +1,230 @@
+import click
+import importlib
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+
+from pathlib import Path
+from typing import Any, Dict, List
+from flask import Flask
+from structlog import get_logger
+
+import app.models as m
+from app.support.logs import flush_logging
+from app.support.shards import get_router
+
+log = get_logger(name=__name__)
+
+# The modules behind the commands, imported once by the daemon instead of by every
+# command. Importing summary also builds matplotlib's font cache.
+WARM_MODULES = [
+    "app.support.scrape",
+    "app.support.similarweb",
+    "app.support.ingest",
+    "app.support.pipeline",
+    "app.support.summary",
+    "app.support.stream",
+]
+
+# Requests are a single JSON message sent with the stdin, stdout and stderr of the
+# client attached, so a request is never near this size
+MAX_REQUEST_SIZE = 64 * 1024
+
+
+def _send(connection: socket.socket, message: Dict[str, Any]) -> None:
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def _parse_request(data: bytes) -> Dict[str, Any]:
+    """
+    Decodes a request, raising a ValueError for anything that is not the object sent
+    by the client, so a bad request is refused before a child is forked for it.
+    """
+    request = json.loads(data)
+    if not isinstance(request, dict):
+        raise ValueError(f"Request is not an object. Recieved: {request!r}")
+    args = request.get("args")
+    if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+        raise ValueError(f"Request args are not a list of strings. Recieved: {args!r}")
+    if not isinstance(request.get("cwd"), str):
+        raise ValueError(
+            f"Request cwd is not a string. Recieved: {request.get('cwd')!r}"
+        )
+    return request
+
+
+def _close(fds: List[int]) -> None:
+    for fd in fds:
+        os.close(fd)
+
+
+class Daemon:
+    """
+    Long lived process serving CLI commands over a Unix socket, with the app, the
+    DB engine and every command's dependencies already imported and warm.
+
+    Each request is run in a child forked from the warm daemon, which takes over
+    the client's stdin, stdout and stderr, passed over the socket, so the command's
+    output and logs go straight to the client. The child replies with its pid when
+    it starts and the command's exit code when it finishes. Forking gives every
+    command a clean copy of the warm state that can not leak into the next one.
+    """
+
+    def __init__(self, app: Flask, cli: click.Group, socket_path: Path) -> None:
+        self.app = app
+        self.cli = cli
+        self.socket_path = socket_path
+        self.stop = threading.Event()
+        self.children: Dict[int, List[str]] = {}
+
+    def warm(self) -> None:
+        for module in WARM_MODULES:
+            importlib.import_module(module)
+
+        # Resolving the lazy commands imports every command module
+        with click.Context(self.cli) as ctx:
+            for name in self.cli.list_commands(ctx):
+                self.cli.get_command(ctx, name)
+
+        with m.db.engine.connect() as connection:
+            connection.exec_driver_sql("select 1")
+        router = get_router()
+        if router:
+            for engine in router.engines:
+                with engine.connect() as connection:
+                    connection.exec_driver_sql("select 1")
+
+    def _listen(self) -> socket.socket:
+        if self.socket_path.exists():
+            # A socket left behind by a daemon that was killed
+            log.warn("Removing existing socket", path=self.socket_path)
+            self.socket_path.unlink()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the user running the daemon can submit commands to it. The socket is
+        # created without access for anyone else, rather than changed once it exists
+        umask = os.umask(0o177)
+        try:
+            server.bind(str(self.socket_path))
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(64)
+        server.settimeout(1.0)
+        return server
+
+    def _reap(self) -> None:
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            args = self.children.pop(pid, [])
+            log.info(
+                "Command finished",
+                pid=pid,
+                args=args,
+                exit_code=os.waitstatus_to_exitcode(status),
+            )
+
+    def _run_child(self, connection: socket.socket, request: Dict[str, Any]) -> int:
+        # Child processes must not share the daemon's pooled SQLite connections
+        m.db.engine.dispose(close=False)
+        router = get_router()
+        if router:
+            for engine in router.engines:
+                engine.dispose(close=False)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        os.chdir(request["cwd"])
+        _send(connection, {"pid": os.getpid()})
+
+        args = request["args"]
+        if args[:1] == ["daemon"]:
+            print("The daemon can not run daemon commands", file=sys.stderr)
+            return 2
+
+        try:
+            with self.app.app_context():
+                self.cli.main(args=args, prog_name="flask cli")
+        except SystemExit as error:
+            code = error.code
+            return code if isinstance(code, int) else int(code is not None)
+        except BaseException:
+            traceback.print_exc()
+            return 1
+        return 0
+
+    def _handle(self, server: socket.socket, connection: socket.socket) -> None:
+        # A client that connects but never sends its request can not hold up the rest
+        connection.settimeout(5.0)
+        data, fds, _, _ = socket.recv_fds(connection, MAX_REQUEST_SIZE, 3)
+        connection.settimeout(None)
+        if len(fds) != 3:
+            log.warn("Request without stdin, stdout and stderr", fds=len(fds))
+            _close(fds)
+            return
+        try:
+            request = _parse_request(data)
+            pid = os.fork()
+        except ValueError as error:
+            _close(fds)
+            log.warn("Invalid request", error=str(error))
+            # Refused like a usage error, without forking a child to run it
+            _send(connection, {"exit_code": 2})
+            return
+        except OSError:
+            _close(fds)
+            raise
+
+        if pid:
+            _close(fds)
+            self.children[pid] = request["args"]
+            log.info("Running command", pid=pid, args=request["args"])
+            return
+
+        code = 1
+        try:
+            server.close()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            code = self._run_child(connection, request)
+        finally:
+            flush_logging()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            try:
+                _send(connection, {"exit_code": code})
+            finally:
+                os._exit(code)
+
+    def run(self) -> None:
+        self.warm()
+        server = self._listen()
+        log.info("Daemon listening", path=self.socket_path, pid=os.getpid())
+        try:
+            while not self.stop.is_set():
+                self._reap()
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    try:
+                        self._handle(server, connection)
+                    except Exception:
+                        # A bad request or client must never take the daemon down
+                        log.exception("Failed to start command")
+        finally:
+            server.close()
+            self.socket_path.unlink(missing_ok=True)
+            self._reap()
+            log.info("Daemon stopped", running=len(self.children))
@@ -0,0 +1,67 @@
+"""
+Thin client for the warm daemon started with `flask cli daemon serve`. It only
+imports the standard library, so submitting a command costs milliseconds instead of
+importing the app:
+
+    python app/support/daemon_client.py ingest load_all_similar_web
+
+The client's stdin, stdout and stderr are handed to the command, and the client
+exits with the command's exit code.
+"""
+
+import json
+import os
+import signal
+import socket
+import sys
+
+from pathlib import Path
+from typing import List, Optional
+
+DEFAULT_SOCKET = Path(__file__).resolve().parents[1] / "local" / "daemon.sock"
+
+
+def run(args: List[str], socket_path: Optional[str] = None) -> int:
+    path = socket_path or os.environ.get("SPECTER_DAEMON_SOCKET", str(DEFAULT_SOCKET))
+    request = json.dumps({"args": args, "cwd": os.getcwd()}).encode("utf-8")
+
+    # Anything buffered has to be written before the command shares the streams
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            print(f"No daemon is listening on {path}", file=sys.stderr)
+            return 1
+        # Descriptors 0, 1 and 2 are the stdin, stdout and stderr of the process
+        socket.send_fds(client, [request], [0, 1, 2])
+        client.shutdown(socket.SHUT_WR)
+
+        pid, buffer = None, b""
+        while True:
+            try:
+                chunk = client.recv(4096)
+            except KeyboardInterrupt:
+                # Pass the interrupt on to the command and wait for it to exit
+                if pid:
+                    os.kill(pid, signal.SIGINT)
+                continue
+            if not chunk:
+                break
+
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                message = json.loads(line)
+                if "pid" in message:
+                    pid = message["pid"]
+                if "exit_code" in message:
+                    return message["exit_code"]
+
+    print("Daemon closed the connection without an exit code", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:]))
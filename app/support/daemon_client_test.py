@@ -0,0 +1,38 @@
+import json
+import os
+import socket
+import threading
+
+from support.daemon_client import run
+
+
+def _serve_once(server: socket.socket, received: dict) -> None:
+    connection, _ = server.accept()
+    with connection:
+        data, fds, _, _ = socket.recv_fds(connection, 4096, 3)
+        received.update(json.loads(data), fds=len(fds))
+        for fd in fds:
+            os.close(fd)
+        connection.sendall(b'{"pid": 1}\n{"exit_code": 3}\n')
+
+
+def test_run__returns_exit_code_of_command(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    received = {}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen(1)
+        thread = threading.Thread(target=_serve_once, args=(server, received))
+        thread.start()
+
+        assert run(["worker", "status"], socket_path=path) == 3
+        thread.join()
+
+    assert received["args"] == ["worker", "status"]
+    assert received["cwd"] == os.getcwd()
+    # The stdin, stdout and stderr of the client are passed to the daemon
+    assert received["fds"] == 3
+
+
+def test_run__no_daemon(tmp_path):
+    assert run(["worker", "status"], socket_path=str(tmp_path / "daemon.sock")) == 1
@@ -0,0 +1,112 @@
+import json
+import os
+import socket
+import sys
+
+import click
+import pytest
+
+from support.daemon import Daemon
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("shout")
+@click.option("--exit-code", type=int, default=0)
+def shout(exit_code):
+    click.echo(sys.stdin.read().upper())
+    click.echo(os.getcwd(), err=True)
+    sys.exit(exit_code)
+
+
+def _use_standard_streams(monkeypatch):
+    # The streams of the daemon are descriptors 0, 1 and 2. pytest puts its captures
+    # back before every test runs, so this is called by the test and not a fixture
+    for name, fd, mode in [("stdin", 0, "r"), ("stdout", 1, "w"), ("stderr", 2, "w")]:
+        monkeypatch.setattr(sys, name, open(fd, mode, closefd=False))
+
+
+def _submit(daemon, tmp_path, request, fds=3):
+    (tmp_path / "stdin").write_text("hello")
+    streams = [
+        open(tmp_path / "stdin", "rb"),
+        open(tmp_path / "stdout", "wb"),
+        open(tmp_path / "stderr", "wb"),
+    ][:fds]
+    client, connection = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client, socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        data = request if isinstance(request, bytes) else json.dumps(request).encode()
+        socket.send_fds(client, [data], [stream.fileno() for stream in streams])
+        client.shutdown(socket.SHUT_WR)
+        for stream in streams:
+            stream.close()
+        with connection:
+            daemon._handle(server, connection)
+
+        messages = client.makefile("rb").read().splitlines()
+    for pid in list(daemon.children):
+        os.waitpid(pid, 0)
+    return [json.loads(message) for message in messages]
+
+
+def test_handle__runs_command_in_child_with_client_streams(
+    db_app, tmp_path, monkeypatch
+):
+    _use_standard_streams(monkeypatch)
+    daemon = Daemon(db_app, cli, tmp_path / "daemon.sock")
+    request = dict(args=["shout", "--exit-code", "3"], cwd=str(tmp_path))
+
+    started, finished = _submit(daemon, tmp_path, request)
+
+    # The command ran in a forked child, not in the daemon
+    assert started["pid"] != os.getpid()
+    assert list(daemon.children) == [started["pid"]]
+    assert finished == {"exit_code": 3}
+    assert (tmp_path / "stdout").read_text() == "HELLO\n"
+    assert (tmp_path / "stderr").read_text() == f"{tmp_path}\n"
+
+
+def test_handle__refuses_daemon_commands(db_app, tmp_path, monkeypatch):
+    _use_standard_streams(monkeypatch)
+    daemon = Daemon(db_app, cli, tmp_path / "daemon.sock")
+    request = dict(args=["daemon", "serve"], cwd=str(tmp_path))
+
+    assert _submit(daemon, tmp_path, request)[-1] == {"exit_code": 2}
+    assert "can not run daemon commands" in (tmp_path / "stderr").read_text()
+
+
+@pytest.mark.parametrize(
+    "request_data",
+    [b"{}", b"not json", b"[]", b'{"args": "shout", "cwd": "/"}', b'{"args": []}'],
+)
+def test_handle__invalid_request_is_refused_without_fork(
+    db_app, tmp_path, request_data
+):
+    daemon = Daemon(db_app, cli, tmp_path / "daemon.sock")
+
+    assert _submit(daemon, tmp_path, request_data) == [{"exit_code": 2}]
+    assert daemon.children == {}
+
+
+def test_handle__request_without_streams_is_dropped(db_app, tmp_path):
+    daemon = Daemon(db_app, cli, tmp_path / "daemon.sock")
+    request = dict(args=["shout"], cwd=str(tmp_path))
+
+    assert _submit(daemon, tmp_path, request, fds=1) == []
+    assert daemon.children == {}
+
+
+def test_listen__socket_is_never_open_to_others(db_app, tmp_path, monkeypatch):
+    daemon = Daemon(db_app, cli, tmp_path / "daemon.sock")
+    # Without the chmod after bind, the socket keeps the mode it was created with
+    monkeypatch.setattr(os, "chmod", lambda *args: None)
+    umask = os.umask(0o022)
+    try:
+        with daemon._listen():
+            assert (tmp_path / "daemon.sock").stat().st_mode & 0o777 == 0o600
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(umask)
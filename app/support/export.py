@@ -0,0 +1,218 @@
+import json
+
+from pathlib import Path
+from typing import Any, Dict, Optional
+from sqlalchemy import Connection, func, select, text
+from structlog import get_logger
+
+import pandas as pd
+
+import app.models as m
+from app.support.shards import get_router
+
+log = get_logger(name=__name__)
+
+EXPORT_PATH = Path("app") / "local" / "export"
+
+# Every table is denormalised with the website and the event it was ingested by, and
+# partitioned by the year and month the data is for. Each query selects the rows of
+# the events between the last export and the latest complete event when the export
+# started. Traffic and ranking history outlive their scrape when it is compacted and
+# keep its event, and the monthly roll ups are exported with the compaction that
+# wrote them, so a month merged again is exported again under a later event.
+# In delta storage scrapes are read through the full view, so the values they
+# inherit are exported too. Otherwise nothing is inherited and the table is read
+# directly, as the view's window functions sort every scrape. Each DB is read in the
+# mode its scrapes were written in, see `m.stored_delta`.
+EXPORT_QUERIES: Dict[str, str] = {
+    "page_scrape": """
+    select ps.id, ps.event_id, p.website, ps.path, ps.scraped_at,
+        ps.global_rank, ps.country_rank, ps.category_rank, ps.total_visits,
+        ps.bounce_rate, ps.pages_per_visit, ps.avg_vist_duration,
+        cast(strftime('%Y', ps.scraped_at) as integer) as year,
+        cast(strftime('%m', ps.scraped_at) as integer) as month
+    from {scrapes} ps
+    join page p on p.id = ps.page_id
+    where ps.event_id > :after_event_id and ps.event_id <= :until_event_id
+    """,
+    "page_traffic": """
+    select pt.id, pt.scrape_id, coalesce(ps.event_id, pt.event_id) as event_id,
+        p.website, pt.page_rank, pt.traffic, pt.year, pt.month
+    from page_traffic pt
+    join page p on p.id = pt.page_id
+    left join page_scrape ps on ps.id = pt.scrape_id
+    where coalesce(ps.event_id, pt.event_id) > :after_event_id
+        and coalesce(ps.event_id, pt.event_id) <= :until_event_id
+    """,
+    "page_rank_history": """
+    select pr.id, pr.scrape_id, coalesce(ps.event_id, pr.event_id) as event_id,
+        p.website, pr.rank, pr.year, pr.month
+    from page_rank_history pr
+    join page p on p.id = pr.page_id
+    left join page_scrape ps on ps.id = pr.scrape_id
+    where coalesce(ps.event_id, pr.event_id) > :after_event_id
+        and coalesce(ps.event_id, pr.event_id) <= :until_event_id
+    """,
+    "page_countries_distribution": """
+    select pc.id, ps.id as scrape_id, ps.event_id, p.website, pc.rank, pc.country,
+        pc.percentage_value,
+        cast(strftime('%Y', ps.scraped_at) as integer) as year,
+        cast(strftime('%m', ps.scraped_at) as integer) as month
+    from {scrapes} ps
+    join page_countries_distribution pc on pc.scrape_id = ps.countries_scrape_id
+    join page p on p.id = ps.page_id
+    where ps.event_id > :after_event_id and ps.event_id <= :until_event_id
+    """,
+    "page_demographics": """
+    select pd.id, ps.id as scrape_id, ps.event_id, p.website, pd.age_range,
+        pd.percentage_value,
+        cast(strftime('%Y', ps.scraped_at) as integer) as year,
+        cast(strftime('%m', ps.scraped_at) as integer) as month
+    from {scrapes} ps
+    join page_demographics pd on pd.scrape_id = ps.demographics_scrape_id
+    join page p on p.id = ps.page_id
+    where ps.event_id > :after_event_id and ps.event_id <= :until_event_id
+    """,
+    "page_scrape_monthly": """
+    select pm.id, pm.event_id, p.website, pm.scrapes, pm.first_scraped_at,
+        pm.last_scraped_at, pm.global_rank, pm.country_rank, pm.category_rank,
+        pm.total_visits, pm.bounce_rate, pm.pages_per_visit, pm.avg_vist_duration,
+        pm.countries, pm.demographics, pm.year, pm.month
+    from page_scrape_monthly pm
+    join page p on p.id = pm.page_id
+    where pm.event_id > :after_event_id and pm.event_id <= :until_event_id
+    """,
+}
+
+
+SCRAPES = {
+    True: "page_scrape_full",
+    False: """(
+        select *, id as countries_scrape_id, id as demographics_scrape_id
+        from page_scrape
+    )""",
+}
+
+
+def _import_pyarrow() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "The Parquet export requires pyarrow, install the analytics extra"
+        ) from error
+    return pyarrow
+
+
+def _read_sql(query: str, params: Dict[str, Any]) -> pd.DataFrame:
+    def format_query(connection: Connection) -> str:
+        return query.format(scrapes=SCRAPES[m.stored_delta(connection)])
+
+    router = get_router()
+    if router:
+        return router.read_sql(format_query, params)
+
+    with m.db.engine.connect() as connection:
+        return pd.read_sql_query(
+            text(format_query(connection)), connection, params=params
+        )
+
+
+def _load_state(path: Path) -> Dict[str, int]:
+    state_path = path / "_state.json"
+    if not state_path.exists():
+        return dict(last_event_id=0)
+    return json.loads(state_path.read_text())
+
+
+def _save_state(path: Path, state: Dict[str, int]) -> None:
+    # Write to a temporary file first so a crash never leaves a half written state
+    tmp_path = path / "_state.json.tmp"
+    tmp_path.write_text(json.dumps(state))
+    tmp_path.replace(path / "_state.json")
+
+
+def _last_complete_event_id() -> int:
+    """
+    Returns the id of the latest event that every earlier event is complete before.
+    Events still being ingested are held back, along with every event after them,
+    as the cursor could not go back for their rows once it had moved past them.
+    """
+    latest, pending = m.db.session.execute(
+        select(
+            func.max(m.Event.id),
+            func.min(m.Event.id).filter(m.Event.complete.is_(False)),
+        )
+    ).one()
+    if pending is not None:
+        log.warn("Holding back export of incomplete event", event_id=pending)
+        return pending - 1
+    return latest or 0
+
+
+def export_parquet(path: Path = EXPORT_PATH) -> int:
+    """
+    Appends the rows of every Event completed since the last export to a Parquet
+    dataset per table, partitioned as `<table>/year=YYYY/month=M/`. The export is
+    only marked done once every table is written, and the file names are derived
+    from the events exported, so a failed export rewrites the same files on retry.
+    Returns the number of events exported.
+    """
+    pa = _import_pyarrow()
+
+    path.mkdir(parents=True, exist_ok=True)
+    state = _load_state(path)
+
+    after_event_id = state["last_event_id"]
+    until_event_id = _last_complete_event_id()
+    if until_event_id <= after_event_id:
+        log.info("No new events to export", last_event_id=after_event_id)
+        return 0
+
+    params = dict(after_event_id=after_event_id, until_event_id=until_event_id)
+    for table, query in EXPORT_QUERIES.items():
+        df = _read_sql(query, params)
+        log.info("Exporting table", table=table, rows=len(df), **params)
+        if df.empty:
+            continue
+
+        pa.parquet.write_to_dataset(
+            pa.Table.from_pandas(df, preserve_index=False),
+            root_path=str(path / table),
+            partition_cols=["year", "month"],
+            basename_template=f"events-{after_event_id + 1}-{until_event_id}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    _save_state(path, dict(last_event_id=until_event_id))
+    return until_event_id - after_event_id
+
+
+def read_traffic_parquet(
+    path: Path = EXPORT_PATH, since: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Reads the exported monthly traffic in the shape of the all_analysis query. The
+    `since` month (YYYY-MM) is pushed down to the year and month partitions so older
+    partitions are never opened.
+    """
+    pa = _import_pyarrow()
+    ds = pa.dataset
+
+    dataset = ds.dataset(
+        str(path / "page_traffic"), format="parquet", partitioning="hive"
+    )
+
+    filter_ = None
+    if since:
+        year, month = (int(part) for part in since.split("-"))
+        filter_ = (ds.field("year") > year) | (
+            (ds.field("year") == year) & (ds.field("month") >= month)
+        )
+
+    df = dataset.to_table(
+        columns=["website", "month", "year", "traffic"], filter=filter_
+    ).to_pandas()
+    return df.sort_values(["website", "year", "month"], ignore_index=True)
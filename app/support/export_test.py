@@ -0,0 +1,59 @@
+import json
+
+from datetime import datetime
+
+import pytest
+
+import app.models as m
+from app.support.export import export_parquet
+from app.support.ingest import ingest_similar_web_file
+from app.support.maintenance import compact, record_compaction
+from app.support.similarweb import SimilarWebBatch
+from support.ingest_test import ROW, write_csv
+
+
+def _exported_events(path, table="page_scrape"):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(str(path / table), partitioning="hive").to_table()
+    return sorted(dataset.column("event_id").to_pylist())
+
+
+@pytest.mark.parametrize("delta", [False, True])
+def test_export_parquet__holds_back_incomplete_event(db_app, tmp_path, delta):
+    db_app.config["DELTA_STORAGE"] = delta
+    output = tmp_path / "export"
+    assert ingest_similar_web_file(write_csv(tmp_path / "first.csv", [ROW]))
+    # A pipeline run has committed some of its rows, and a file is ingested meanwhile
+    running = m.Event.create(path="pipeline://running", complete=False)
+    m.db.session.flush()
+    rows = write_csv(tmp_path / "running.csv", [dict(ROW, Page="yahoo.com")])
+    m.PageScrape.create_from_batch(event=running, batch=SimilarWebBatch.from_csv(rows))
+    m.db.session.commit()
+    assert ingest_similar_web_file(
+        write_csv(tmp_path / "second.csv", [dict(ROW, Page="bing.com")])
+    )
+
+    assert export_parquet(output) == 1
+    assert _exported_events(output) == [1]
+    assert json.loads((output / "_state.json").read_text()) == dict(last_event_id=1)
+
+    running.complete = True
+    m.db.session.commit()
+    assert export_parquet(output) == 2
+    assert _exported_events(output) == [1, 2, 3]
+
+
+def test_export_parquet__compacted_before_export(db_app, tmp_path):
+    output = tmp_path / "export"
+    for index, scraped_at in enumerate(["2023-01-10T00:00:00", "2023-02-05T00:00:00"]):
+        row = dict(ROW, **{"Scraped At": scraped_at})
+        assert ingest_similar_web_file(write_csv(tmp_path / f"{index}.csv", [row]))
+    assert compact(m.db.session, datetime(2023, 2, 1)) == 1
+    compaction = record_compaction([m.db.session])
+
+    assert export_parquet(output) == 3
+    # The traffic of the compacted scrape is exported by the event that ingested it
+    assert _exported_events(output, "page_traffic") == [1, 1]
+    assert _exported_events(output, "page_rank_history") == [1, 1, 1]
+    assert _exported_events(output, "page_scrape_monthly") == [compaction]
@@ -0,0 +1,122 @@
+from pathlib import Path
+from flask import current_app
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.orm import Session
+from structlog import get_logger
+
+import app.models as m
+from app.support.logs import Progress
+from app.support.shards import get_router
+from app.support.similarweb import SimilarWebBatch
+
+log = get_logger(name=__name__)
+
+
+def ingest_similar_web_file(load_path: Path) -> bool:
+    """
+    Loads a SimilarWeb CSV into the DB, recording an Event for the file so that it
+    is never ingested twice. Returns False if the file had already been ingested.
+    """
+    # Check to see if we have processed this file before
+    if m.Event.query.filter_by(path=str(load_path)).one_or_none():
+        log.warn("Duplicate file found", file=load_path)
+        return False
+
+    # Create a new event for the file being ingested
+    event = m.Event.create(path=str(load_path))
+    m.db.session.flush()
+
+    # The rows are parsed into columns and inserted from them table by table, rather
+    # than structuring and inserting each row on its own
+    batch = SimilarWebBatch.from_csv(load_path)
+
+    # persist to model layer
+    progress = Progress(log, "Ingesting SimilarWeb file", file=str(load_path))
+    router = get_router()
+    if router:
+        # The event is only committed to the main DB once every shard has committed
+        progress.advance(router.ingest(event, batch))
+    else:
+        delta = current_app.config["DELTA_STORAGE"]
+        m.use_storage_mode(m.db.session, delta)
+        progress.advance(
+            m.PageScrape.create_from_batch(event=event, batch=batch, delta=delta)
+        )
+
+    m.db.session.commit()
+    progress.finish()
+    return True
+
+
+def _rebase_dependants(session: Session, event_id: int) -> None:
+    # In delta storage a scrape of another event can inherit from one of the event's
+    pages = select(m.PageScrape.page_id).filter_by(event_id=event_id)
+    scrapes = session.scalars(
+        select(m.PageScrape)
+        .where(m.PageScrape.page_id.in_(pages))
+        .order_by(m.PageScrape.page_id, m.PageScrape.scraped_at, m.PageScrape.id)
+    )
+    previous = None
+    for scrape in scrapes:
+        if (
+            previous
+            and previous.page_id == scrape.page_id
+            and previous.event_id == event_id
+            and scrape.event_id != event_id
+        ):
+            scrape.rebase(session)
+        previous = scrape
+
+
+def _remove_event_rows(session: Session, event_id: int) -> int:
+    if m.stored_delta(session):
+        _rebase_dependants(session, event_id)
+
+    scrape_ids = select(m.PageScrape.id).filter_by(event_id=event_id)
+    for model in [m.PageTraffic, m.PageRankHistory]:
+        # Including the rows kept from scrapes of the event that were compacted
+        session.execute(
+            delete(model)
+            .where(or_(model.scrape_id.in_(scrape_ids), model.event_id == event_id))
+            .execution_options(synchronize_session=False)
+        )
+    for model in [m.PageCountriesDistribution, m.PageDemographics]:
+        session.execute(
+            delete(model)
+            .where(model.scrape_id.in_(scrape_ids))
+            .execution_options(synchronize_session=False)
+        )
+    # Roll ups of a removed compaction are recorded again by the next one
+    session.execute(
+        update(m.PageScrapeMonthly)
+        .filter_by(event_id=event_id)
+        .values(event_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    removed = session.execute(
+        delete(m.PageScrape)
+        .filter_by(event_id=event_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    session.execute(delete(m.Event).filter_by(id=event_id))
+    session.commit()
+    return removed
+
+
+def remove_event(event_id: int) -> int:
+    """
+    Deletes an Event with every scrape ingested under it, from the main DB and every
+    shard, so that a failed ingest can be run again from scratch. Returns the number
+    of scrapes removed.
+    """
+    m.db.session.rollback()
+
+    removed = 0
+    router = get_router()
+    if router:
+        for index in range(router.count):
+            with router.session(index) as session:
+                removed += _remove_event_rows(session, event_id)
+    removed += _remove_event_rows(m.db.session, event_id)
+    log.info("Removed event", event_id=event_id, scrapes=removed)
+    return removed
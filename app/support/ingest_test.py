@@ -0,0 +1,83 @@
+import csv
+
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+import app.models as m
+from support.ingest import ingest_similar_web_file, remove_event
+from support.serialise import field_aliases
+from support.similarweb import SimilarWebRaw
+
+ROW = {
+    "Path": "local/scraped_pages/similarweb-google-com.html",
+    "Scraped At": "2023-01-15T12:49:28.850051",
+    "Page": "google.com",
+    "Global Rank": "#1",
+    "Country Rank": "#1",
+    "Category Rank": "#1",
+    "Total Visits": "86.4B",
+    "Bounce Rate": "28.77%",
+    "Pages per Visit": "8.29",
+    "Avg Visit Duration": "00:10:35",
+    "Monthly Traffic P1": "Nov:87.0B",
+    "Monthly Traffic P2": "Dec:85.1B",
+    "Top Countries (1)": "United States:27.04%",
+    "Top Countries (2)": "India:4.51%",
+    "Demographics (18 - 24)": "23.86%",
+    "Ranking History": "Nov:3|Dec:2|Jan:1",
+}
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, field_aliases(SimilarWebRaw), restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def _count(model):
+    return m.db.session.execute(select(func.count()).select_from(model)).scalar()
+
+
+def test_remove_event__removes_rows_of_event(db_app, tmp_path):
+    first = write_csv(tmp_path / "first.csv", [ROW])
+    second = write_csv(
+        tmp_path / "second.csv",
+        [dict(ROW, **{"Page": "bing.com", "Scraped At": "2023-01-16T00:00:00"})],
+    )
+    assert ingest_similar_web_file(first)
+    assert ingest_similar_web_file(second)
+    event_id = m.Event.query.filter_by(path=str(first)).one().id
+
+    assert remove_event(event_id) == 1
+
+    assert [event.path for event in m.Event.query.all()] == [str(second)]
+    assert _count(m.PageScrape) == 1
+    assert _count(m.PageTraffic) == 2
+    assert _count(m.PageCountriesDistribution) == 2
+    # The file can be ingested again from scratch
+    assert ingest_similar_web_file(first)
+
+
+def test_remove_event__rebases_delta_scrapes(db_app, tmp_path):
+    db_app.config["DELTA_STORAGE"] = True
+    first = write_csv(tmp_path / "first.csv", [ROW])
+    # Unchanged a day later, so delta storage inherits every value from the first
+    second = write_csv(
+        tmp_path / "second.csv", [dict(ROW, **{"Scraped At": "2023-01-16T00:00:00"})]
+    )
+    ingest_similar_web_file(first)
+    ingest_similar_web_file(second)
+    later = m.PageScrape.query.filter_by(scraped_at=datetime(2023, 1, 16)).one()
+    assert later.global_rank is None and later.countries_inherited
+
+    remove_event(m.Event.query.filter_by(path=str(first)).one().id)
+
+    later = m.PageScrape.query.one()
+    assert later.global_rank == 1 and not later.countries_inherited
+    assert [
+        row["country"]
+        for row in m.child_values(m.db.session, m.PageCountriesDistribution, later.id)
+    ] == ["United States", "India"]
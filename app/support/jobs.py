@@ -0,0 +1,281 @@
+import json
+import os
+import socket
+import threading
+import traceback
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from flask import Flask
+from sqlalchemy import and_, or_, select, update
+from structlog import get_logger
+
+import app.models as m
+
+log = get_logger(name=__name__)
+
+# Handlers are called with the job's payload and id
+Handler = Callable[[Dict[str, Any], int], None]
+
+# Registry of every kind of job a worker can run, keyed by `Job.kind`
+HANDLERS: Dict[str, Handler] = {}
+
+
+def handler(kind: str) -> Callable[[Handler], Handler]:
+    def register(func: Handler) -> Handler:
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+@handler("scrape_page")
+def scrape_page(payload: Dict[str, Any], job_id: int) -> None:
+    from app.support.scrape import save_similarweb_data, scrape_similarweb_file
+
+    path = Path(payload["path"])
+    if not path.exists():
+        raise NameError(f"{path} does not exist")
+
+    # Named by the job so that a retry after the file was written overwrites it,
+    # rather than writing the page to a second file that would be ingested twice
+    write_file = save_similarweb_data(
+        [scrape_similarweb_file(path)], name=f"similarweb_job_{job_id}.csv"
+    )
+    # Chain the ingest of the scraped data so it lands in the DB without a cron run
+    enqueue("ingest_file", dict(filename=write_file.name))
+
+
+@handler("ingest_file")
+def ingest_file(payload: Dict[str, Any], _: int) -> None:
+    from app.support.ingest import ingest_similar_web_file
+
+    load_path = Path("app") / "local" / "input" / payload["filename"]
+    if not load_path.exists():
+        raise NameError(f"{load_path} does not exist")
+
+    ingest_similar_web_file(load_path)
+
+
+@handler("summarise_site")
+def summarise_site(payload: Dict[str, Any], _: int) -> None:
+    import app.support.summary as s
+
+    s.site_analysis(payload["website"], force=payload.get("force", False))
+
+
+def enqueue(
+    kind: str, payload: Dict[str, Any], priority: int = 0, max_attempts: int = 3
+) -> m.Job:
+    assert kind in HANDLERS, f"Unknown job kind, recieved: {kind}"
+    job = m.Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        priority=priority,
+        max_attempts=max_attempts,
+    )
+    m.db.session.add(job)
+    m.db.session.commit()
+    log.info("Enqueued job", job_id=job.id, kind=kind)
+    return job
+
+
+def _leasable(kind: str, now: datetime) -> Any:
+    # A job can be leased if it is waiting to run, or if the worker running it has
+    # stopped heart beating and its lease has expired
+    return and_(
+        m.Job.kind == kind,
+        m.Job.attempts < m.Job.max_attempts,
+        or_(
+            and_(m.Job.status == m.Job.PENDING, m.Job.run_after <= now),
+            and_(m.Job.status == m.Job.RUNNING, m.Job.lease_expires_at < now),
+        ),
+    )
+
+
+def lease(kind: str, owner: str, lease_seconds: int) -> Optional[m.Job]:
+    """
+    Claims the highest priority job of the kind. The claim is a compare and set on
+    the job's row, so when several workers race for the same job only one of their
+    updates matches and the rest move on to the next candidate.
+    """
+    now = datetime.utcnow()
+    candidates = m.db.session.scalars(
+        select(m.Job.id)
+        .where(_leasable(kind, now))
+        .order_by(m.Job.priority.desc(), m.Job.id)
+        .limit(5)
+    ).all()
+
+    for job_id in candidates:
+        result = m.db.session.execute(
+            update(m.Job)
+            .where(m.Job.id == job_id, _leasable(kind, now))
+            .values(
+                status=m.Job.RUNNING,
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                heartbeat_at=now,
+                attempts=m.Job.attempts + 1,
+            )
+        )
+        m.db.session.commit()
+        if result.rowcount == 1:  # type: ignore
+            return m.db.session.get(m.Job, job_id, populate_existing=True)
+
+    return None
+
+
+def heartbeat(job_id: int, owner: str, lease_seconds: int) -> bool:
+    """
+    Extends the lease on a running job, returns False if the lease has been lost to
+    another worker. Uses its own connection so it never commits the handler's work.
+    """
+    now = datetime.utcnow()
+    with m.db.engine.begin() as connection:
+        result = connection.execute(
+            update(m.Job)
+            .where(m.Job.id == job_id, m.Job.lease_owner == owner)
+            .values(
+                heartbeat_at=now,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+            )
+        )
+    return result.rowcount == 1
+
+
+def complete(job: m.Job, owner: str) -> None:
+    m.db.session.execute(
+        update(m.Job)
+        .where(m.Job.id == job.id, m.Job.lease_owner == owner)
+        .values(status=m.Job.DONE, finished_at=datetime.utcnow(), lease_owner=None)
+    )
+    m.db.session.commit()
+
+
+def fail(job: m.Job, owner: str, error: str, retry_seconds: int) -> None:
+    # Retry with an exponential backoff until the job runs out of attempts
+    retry = job.attempts < job.max_attempts
+    values: Dict[str, Any] = dict(last_error=error, lease_owner=None)
+    if retry:
+        delay = retry_seconds * 2 ** (job.attempts - 1)
+        values.update(
+            status=m.Job.PENDING,
+            run_after=datetime.utcnow() + timedelta(seconds=delay),
+        )
+    else:
+        values.update(status=m.Job.FAILED, finished_at=datetime.utcnow())
+
+    m.db.session.execute(
+        update(m.Job)
+        .where(m.Job.id == job.id, m.Job.lease_owner == owner)
+        .values(**values)
+    )
+    m.db.session.commit()
+
+
+def reap_expired() -> int:
+    # Jobs whose worker died on their final attempt can never be leased again
+    result = m.db.session.execute(
+        update(m.Job)
+        .where(
+            m.Job.status == m.Job.RUNNING,
+            m.Job.lease_expires_at < datetime.utcnow(),
+            m.Job.attempts >= m.Job.max_attempts,
+        )
+        .values(
+            status=m.Job.FAILED,
+            last_error="Lease expired on final attempt",
+            finished_at=datetime.utcnow(),
+        )
+    )
+    m.db.session.commit()
+    return result.rowcount  # type: ignore
+
+
+class Worker:
+    """
+    Long running worker pulling jobs from the queue. Each job kind gets its own pool
+    of threads so that, for example, scraping can run wide while the SQLite writes
+    of ingesting stay serialised.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        concurrency: Dict[str, int],
+        lease_seconds: int = 60,
+        poll_seconds: float = 1.0,
+        retry_seconds: int = 30,
+    ) -> None:
+        unknown = set(concurrency) - set(HANDLERS)
+        assert not unknown, f"Unknown job kinds, recieved: {unknown}"
+
+        self.app = app
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self.stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def run(self) -> None:
+        for kind, count in self.concurrency.items():
+            for index in range(count):
+                thread = threading.Thread(
+                    target=self._loop, args=(kind,), name=f"worker-{kind}-{index}"
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        log.info("Worker started", concurrency=self.concurrency)
+        while not self.stop.wait(self.lease_seconds):
+            with self.app.app_context():
+                reaped = reap_expired()
+            if reaped:
+                log.warn("Failed jobs with expired leases", jobs=reaped)
+
+        for thread in self._threads:
+            thread.join()
+        log.info("Worker stopped")
+
+    def _loop(self, kind: str) -> None:
+        owner = (
+            f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        )
+        while not self.stop.is_set():
+            # Every thread needs its own app context, and with it its own DB session
+            with self.app.app_context():
+                job = lease(kind, owner, self.lease_seconds)
+                if job:
+                    self._run_job(job, owner)
+                    continue
+            self.stop.wait(self.poll_seconds)
+
+    def _run_job(self, job: m.Job, owner: str) -> None:
+        log.info("Running job", job_id=job.id, kind=job.kind, attempt=job.attempts)
+
+        done = threading.Event()
+
+        def beat() -> None:
+            while not done.wait(self.lease_seconds / 3):
+                with self.app.app_context():
+                    if not heartbeat(job.id, owner, self.lease_seconds):
+                        log.warn("Lost lease on job", job_id=job.id)
+                        return
+
+        beater = threading.Thread(target=beat, name=f"heartbeat-{job.id}")
+        beater.start()
+        try:
+            HANDLERS[job.kind](json.loads(job.payload), job.id)
+        except Exception as error:
+            m.db.session.rollback()
+            log.error("Job failed", job_id=job.id, kind=job.kind, error=error)
+            fail(job, owner, traceback.format_exc(), self.retry_seconds)
+        else:
+            complete(job, owner)
+            log.info("Completed job", job_id=job.id, kind=job.kind)
+        finally:
+            done.set()
+            beater.join()
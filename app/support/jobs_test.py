@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+import app.models as m
+import support.jobs as jobs
+from support.serialise import field_aliases
+from support.similarweb import SimilarWebRaw
+
+# Every column of a scraped page, left blank
+BLANK_PAGE = dict.fromkeys(field_aliases(SimilarWebRaw), "")
+
+
+def _job(job_id):
+    return m.db.session.get(m.Job, job_id, populate_existing=True)
+
+
+def test_lease__only_one_owner(db_app):
+    job_id = jobs.enqueue("summarise_site", dict(website="google.com")).id
+
+    job = jobs.lease("summarise_site", "worker-a", lease_seconds=60)
+    assert job.id == job_id
+    assert (job.status, job.lease_owner, job.attempts) == (m.Job.RUNNING, "worker-a", 1)
+    assert jobs.lease("summarise_site", "worker-b", lease_seconds=60) is None
+
+
+def test_lease__higher_priority_first(db_app):
+    jobs.enqueue("summarise_site", dict(website="low.com"))
+    high = jobs.enqueue("summarise_site", dict(website="high.com"), priority=5)
+
+    assert jobs.lease("summarise_site", "worker-a", lease_seconds=60).id == high.id
+
+
+def test_lease__expired_lease_is_reclaimed(db_app):
+    job_id = jobs.enqueue("summarise_site", dict(website="google.com")).id
+    # The worker dies straight after leasing, so its lease is already expired
+    jobs.lease("summarise_site", "worker-a", lease_seconds=-1)
+
+    job = jobs.lease("summarise_site", "worker-b", lease_seconds=60)
+    assert (job.id, job.lease_owner, job.attempts) == (job_id, "worker-b", 2)
+    # The first worker finds out it lost the lease on its next heartbeat
+    assert not jobs.heartbeat(job_id, "worker-a", lease_seconds=60)
+    assert jobs.heartbeat(job_id, "worker-b", lease_seconds=60)
+
+
+def test_fail__retries_with_backoff_then_fails(db_app):
+    job_id = jobs.enqueue("summarise_site", dict(website="google.com")).id
+
+    job = jobs.lease("summarise_site", "worker-a", lease_seconds=60)
+    jobs.fail(job, "worker-a", "first error", retry_seconds=30)
+    job = _job(job_id)
+    assert job.status == m.Job.PENDING and job.last_error == "first error"
+    assert job.run_after - datetime.utcnow() > timedelta(seconds=25)
+    # Not leasable again until the backoff has passed
+    assert jobs.lease("summarise_site", "worker-a", lease_seconds=60) is None
+
+    job.run_after = datetime.utcnow()
+    m.db.session.commit()
+    job = jobs.lease("summarise_site", "worker-a", lease_seconds=60)
+    jobs.fail(job, "worker-a", "second error", retry_seconds=30)
+    # The backoff doubles with every attempt
+    assert _job(job_id).run_after - datetime.utcnow() > timedelta(seconds=55)
+
+    job = _job(job_id)
+    job.run_after = datetime.utcnow()
+    m.db.session.commit()
+    job = jobs.lease("summarise_site", "worker-a", lease_seconds=60)
+    jobs.fail(job, "worker-a", "third error", retry_seconds=30)
+    assert _job(job_id).status == m.Job.FAILED
+
+
+def test_complete__only_by_lease_owner(db_app):
+    job_id = jobs.enqueue("summarise_site", dict(website="google.com")).id
+    job = jobs.lease("summarise_site", "worker-a", lease_seconds=60)
+
+    jobs.complete(job, "worker-b")
+    assert _job(job_id).status == m.Job.RUNNING
+
+    jobs.complete(job, "worker-a")
+    job = _job(job_id)
+    assert job.status == m.Job.DONE and job.lease_owner is None
+    assert job.finished_at is not None
+
+
+def test_reap_expired__fails_final_attempt(db_app):
+    job_id = jobs.enqueue("summarise_site", dict(website="g.com"), max_attempts=1).id
+    jobs.lease("summarise_site", "worker-a", lease_seconds=-1)
+
+    assert jobs.reap_expired() == 1
+    assert _job(job_id).status == m.Job.FAILED
+
+
+def test_scrape_page__retry_overwrites_csv(db_app, tmp_path, monkeypatch):
+    import app.support.scrape as scrape
+
+    monkeypatch.chdir(tmp_path)
+    page = tmp_path / "similarweb-google-com.html"
+    page.write_text("<html></html>")
+    monkeypatch.setattr(
+        scrape,
+        "scrape_similarweb_file",
+        lambda path: dict(BLANK_PAGE, Page="google.com"),
+    )
+
+    # The job is retried after the CSV was written, e.g. as its lease expired
+    jobs.scrape_page(dict(path=str(page)), 7)
+    jobs.scrape_page(dict(path=str(page)), 7)
+
+    assert [path.name for path in (tmp_path / "app/local/input").iterdir()] == [
+        "similarweb_job_7.csv"
+    ]
@@ -0,0 +1,117 @@
+import csv
+import random
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from app.support.serialise import field_aliases
+from app.support.similarweb import SimilarWebRaw
+
+MONTHS = ["Oct", "Nov", "Dec"]
+COUNTRIES = [
+    "United States",
+    "India",
+    "Brazil",
+    "United Kingdom",
+    "Japan",
+    "Germany",
+    "France",
+    "Australia",
+]
+AGE_RANGES = ["18 - 24", "25 - 34", "35 - 44", "45 - 54", "55 - 64", "65+"]
+
+
+def _big_number(rng: random.Random) -> str:
+    if rng.random() < 0.5:
+        return f"{rng.uniform(1, 999):.1f}M"
+    return f"{rng.uniform(1, 99):.1f}B"
+
+
+def _percentage(rng: random.Random, high: float = 100.0) -> str:
+    return f"{rng.uniform(0, high):.2f}%"
+
+
+def _rank(rng: random.Random) -> str:
+    return f"#{rng.randint(1, 10_000_000):,}"
+
+
+def _synthetic_row(
+    rng: random.Random, page: int, scraped_at: datetime, null_ratio: float
+) -> Dict[str, str]:
+    website = f"loadtest-{page}.com"
+    row = {
+        "Path": f"app/local/scraped_pages/similarweb-loadtest-{page}-com.html",
+        "Scraped At": scraped_at.isoformat(),
+        "Page": website,
+        "Global Rank": _rank(rng),
+        "Country Rank": _rank(rng),
+        "Category Rank": _rank(rng),
+        "Total Visits": _big_number(rng),
+        "Bounce Rate": _percentage(rng),
+        "Pages per Visit": f"{rng.uniform(1, 20):.2f}",
+        "Avg Visit Duration": f"00:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+    }
+    for idx, month in enumerate(MONTHS):
+        row[f"Monthly Traffic P{idx + 1}"] = f"{month}:{_big_number(rng)}"
+    for idx, country in enumerate(rng.sample(COUNTRIES, 5)):
+        row[f"Top Countries ({idx + 1})"] = f"{country}:{_percentage(rng, 50)}"
+    for age_range in AGE_RANGES:
+        row[f"Demographics ({age_range})"] = _percentage(rng, 40)
+
+    # Low traffic sites have almost nothing scraped, mirror what the website shows
+    if rng.random() < null_ratio:
+        row.update(
+            {
+                key: ""
+                for key in row
+                if key not in ("Path", "Scraped At", "Page", "Global Rank")
+            }
+        )
+        row["Total Visits"] = "< 5K"
+        return row
+
+    # Otherwise blank out a handful of the optional data points
+    for key in rng.sample(list(row)[4:], rng.randint(0, 3)):
+        if key != "Total Visits":
+            row[key] = ""
+    return row
+
+
+def synthetic_rows(
+    pages: int, scrape: int, null_ratio: float = 0.1, seed: int = 0
+) -> Iterator[Dict[str, str]]:
+    """
+    Yields one row per page for the given scrape round, in the column format of
+    SimilarWebRaw. Rows are deterministic for the seed and scrape round.
+    """
+    rng = random.Random(f"{seed}:{scrape}")
+    scraped_at = datetime(2023, 1, 1) + timedelta(weeks=scrape)
+    for page in range(pages):
+        yield _synthetic_row(rng, page, scraped_at, null_ratio)
+
+
+def generate_similarweb_csvs(
+    directory: Path,
+    pages: int,
+    scrapes: int,
+    null_ratio: float = 0.1,
+    seed: int = 0,
+) -> List[Path]:
+    """
+    Writes `scrapes` SimilarWeb CSVs of `pages` rows each to the directory, the same
+    shape as the output of repeatedly running scrape parse_all_pages. Rows are
+    streamed to disk so memory stays flat at any scale.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+
+    files = []
+    for scrape in range(scrapes):
+        path = directory / f"similarweb_loadtest_{scrape:05d}.csv"
+        with open(path, "w", newline="") as csvfile:
+            writer = csv.DictWriter(csvfile, field_aliases(SimilarWebRaw))
+            writer.writeheader()
+            writer.writerows(synthetic_rows(pages, scrape, null_ratio, seed))
+        files.append(path)
+
+    return files
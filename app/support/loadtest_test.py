@@ -0,0 +1,24 @@
+from support.loadtest import generate_similarweb_csvs
+from support.serialise import csv_to_attrs
+from support.similarweb import SimilarWebConverter, SimilarWebIn
+
+
+def test_generate_similarweb_csvs__structures_as_similar_web_in(tmp_path):
+    files = generate_similarweb_csvs(tmp_path, pages=200, scrapes=2, null_ratio=0.2)
+
+    assert len(files) == 2
+    for file in files:
+        rows = csv_to_attrs(
+            SimilarWebIn, SimilarWebConverter, file.read_bytes(), check_headers=False
+        )
+        assert len(rows) == 200
+        # The null heavy rows have no traffic, countries or demographics at all
+        assert any(row.total_visits == 0 and not row.demographics for row in rows)
+        assert any(len(row.country_distributions) == 5 for row in rows)
+
+
+def test_generate_similarweb_csvs__deterministic(tmp_path):
+    first = generate_similarweb_csvs(tmp_path / "first", pages=10, scrapes=1)
+    second = generate_similarweb_csvs(tmp_path / "second", pages=10, scrapes=1)
+
+    assert first[0].read_bytes() == second[0].read_bytes()
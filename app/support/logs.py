@@ -0,0 +1,264 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from typing import Any, Callable, Dict, Optional, TextIO
+from structlog import DropEvent
+from structlog.typing import EventDict, WrappedLogger
+
+import structlog
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _dumps(obj: Any, **kwargs: Any) -> str:
+    # orjson is several times faster than the json module but is optional
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode()
+    return json.dumps(obj, default=str, separators=(",", ":"))
+
+
+class QueueSink:
+    """
+    Writes rendered log lines to the stream from a background thread, so the hot
+    loop only pays for putting a string on a queue rather than for the write itself.
+    The writer thread is restarted in forked children, and the queue is drained when
+    the interpreter exits. Once closed, lines are written straight to the stream.
+    """
+
+    def __init__(self, stream: TextIO, maxsize: int = 10_000) -> None:
+        self.stream = stream
+        self.maxsize = maxsize
+        self._start()
+        atexit.register(self.close)
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self) -> None:
+        self._closed = False
+        self._queue: queue.Queue[Optional[str]] = queue.Queue(maxsize=self.maxsize)
+        self._thread = threading.Thread(
+            target=self._write, name="log-sink", daemon=True
+        )
+        self._thread.start()
+
+    def _write(self) -> None:
+        while True:
+            line = self._queue.get()
+            if line is None:
+                break
+
+            lines = [line]
+            # Batch up whatever else is waiting to cut down on writes
+            while len(lines) < 1_000:
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if line is None:
+                    self._flush(lines)
+                    return
+                lines.append(line)
+            self._flush(lines)
+
+    def _flush(self, lines: list) -> None:
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+
+    def put(self, line: str) -> None:
+        if self._closed:
+            # Nothing drains the queue any more
+            self._flush([line])
+            return
+        # Blocks once full so a burst of logging can not grow memory without bound
+        self._queue.put(line)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        # Lines put while the writer was stopping
+        lines = []
+        while True:
+            try:
+                line = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if line is not None:
+                lines.append(line)
+        if lines:
+            self._flush(lines)
+
+    def reopen(self, stream: TextIO) -> None:
+        # Writes everything queued to the old stream before switching to the new one
+        self.close()
+        self.stream = stream
+        self._start()
+
+
+class QueueLogger:
+    def __init__(self, sink: QueueSink) -> None:
+        self._sink = sink
+
+    def msg(self, message: str) -> None:
+        self._sink.put(message)
+
+    log = debug = info = warn = warning = msg
+    error = err = critical = exception = fatal = msg
+
+
+class EventSampler:
+    """
+    Processor that thins out high volume events by their message. `every` keeps
+    one in N occurrences of an event, and `per_second` caps how many of an event are
+    logged each second. Events kept by `every` record the rate they were sampled at.
+    """
+
+    def __init__(
+        self,
+        every: Optional[Dict[str, int]] = None,
+        per_second: Optional[Dict[str, float]] = None,
+    ) -> None:
+        self.every = every or {}
+        self.per_second = per_second or {}
+        self._counters: Dict[str, Any] = {
+            event: itertools.count() for event in self.every
+        }
+        # Token bucket per rate limited event, holding (tokens, last refill time)
+        self._buckets = {
+            event: (rate, time.monotonic()) for event, rate in self.per_second.items()
+        }
+        self._lock = threading.Lock()
+
+    def __call__(self, _: WrappedLogger, __: str, event_dict: EventDict) -> EventDict:
+        event = event_dict.get("event")
+
+        every = self.every.get(event)  # type: ignore
+        if every:
+            if next(self._counters[event]) % every:  # type: ignore
+                raise DropEvent
+            event_dict["sampled_every"] = every
+
+        rate = self.per_second.get(event)  # type: ignore
+        if rate:
+            with self._lock:
+                tokens, last = self._buckets[event]  # type: ignore
+                now = time.monotonic()
+                tokens = min(rate, tokens + (now - last) * rate)
+                if tokens < 1:
+                    self._buckets[event] = (tokens, now)  # type: ignore
+                    raise DropEvent
+                self._buckets[event] = (tokens - 1, now)  # type: ignore
+
+        return event_dict
+
+
+class Progress:
+    """
+    Aggregates progress through a hot loop into a periodic log line with the rows
+    done and the rate, instead of logging every row.
+    """
+
+    def __init__(
+        self,
+        logger: Any,
+        event: str,
+        every_seconds: float = 5.0,
+        **context: Any,
+    ) -> None:
+        self.logger = logger
+        self.event = event
+        self.every_seconds = every_seconds
+        self.context = context
+        self.done = 0
+        self._started = self._last = time.monotonic()
+
+    def advance(self, rows: int = 1) -> None:
+        self.done += rows
+        now = time.monotonic()
+        if now - self._last >= self.every_seconds:
+            self._last = now
+            self._emit(now)
+
+    def finish(self) -> None:
+        self._emit(time.monotonic(), finished=True)
+
+    def _emit(self, now: float, **extra: Any) -> None:
+        elapsed = now - self._started
+        self.logger.info(
+            self.event,
+            rows_done=self.done,
+            rows_per_sec=round(self.done / elapsed, 1) if elapsed else None,
+            elapsed=round(elapsed, 2),
+            **self.context,
+            **extra,
+        )
+
+
+_sink: Optional[QueueSink] = None
+
+
+def configure_logging(
+    renderer: str = "json",
+    level: str = "info",
+    sample_every: Optional[Dict[str, int]] = None,
+    per_second: Optional[Dict[str, float]] = None,
+    stream: Optional[TextIO] = None,
+) -> None:
+    """
+    Configures structlog for production use. Events below `level` are dropped by
+    the bound logger before any processing, events are rendered as JSON (or for the
+    console when developing) and written to the stream from a background thread.
+    Logs go to stderr by default, leaving stdout to the output of commands such as
+    `export scrapes`.
+    """
+    render: Callable[..., Any]
+    if renderer == "json":
+        render = structlog.processors.JSONRenderer(serializer=_dumps)
+    else:
+        render = structlog.dev.ConsoleRenderer()
+
+    # The sink is reused, as every sink has a thread and exit and fork handlers
+    global _sink
+    if _sink:
+        _sink.reopen(stream or sys.stderr)
+    else:
+        _sink = QueueSink(stream or sys.stderr)
+    sink = _sink
+    structlog.configure(
+        processors=[
+            EventSampler(every=sample_every, per_second=per_second),
+            structlog.contextvars.merge_contextvars,
+            structlog.processors.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso", utc=True),
+            structlog.processors.format_exc_info,
+            render,
+        ],
+        wrapper_class=structlog.make_filtering_bound_logger(
+            logging.getLevelName(level.upper())
+        ),
+        logger_factory=lambda *_: QueueLogger(sink),
+        cache_logger_on_first_use=True,
+    )
+
+
+def flush_logging() -> None:
+    """
+    Writes every queued log line before returning, and every line logged after it
+    straight to the stream. For processes that leave with `os._exit`, such as forked
+    children, which skip the exit handlers draining the queue.
+    """
+    if _sink:
+        _sink.close()
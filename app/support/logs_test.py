@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+import structlog
+
+from structlog import DropEvent
+
+from support.logs import EventSampler, configure_logging, flush_logging
+
+
+def _kept(sampler, event, times):
+    kept = 0
+    for _ in range(times):
+        try:
+            sampler(None, "info", {"event": event})
+            kept += 1
+        except DropEvent:
+            pass
+    return kept
+
+
+def test_event_sampler__keeps_one_in_every():
+    sampler = EventSampler(every={"Creating page scrape": 10})
+
+    assert _kept(sampler, "Creating page scrape", 100) == 10
+    # Events without a sampling rate are always kept
+    assert _kept(sampler, "Completed!", 5) == 5
+
+
+def test_event_sampler__rate_limits_bursts():
+    sampler = EventSampler(per_second={"Duplicate file found": 5})
+
+    assert _kept(sampler, "Duplicate file found", 100) == 5
+
+
+def test_configure_logging__defaults_to_stderr(capsys):
+    try:
+        configure_logging(renderer="json")
+        structlog.get_logger().info("Exported scrapes")
+        flush_logging()
+        captured = capsys.readouterr()
+    finally:
+        # Point later tests back at the real stderr
+        with capsys.disabled():
+            configure_logging(renderer="json")
+
+    assert captured.out == ""
+    assert '"event":"Exported scrapes"' in captured.err
+
+
+def _sink_threads():
+    return len(
+        [thread for thread in threading.enumerate() if thread.name == "log-sink"]
+    )
+
+
+def test_configure_logging__reuses_sink(capsys):
+    try:
+        configure_logging(renderer="json")
+        sinks = _sink_threads()
+        configure_logging(renderer="json")
+        configure_logging(renderer="json")
+        assert _sink_threads() == sinks
+        flush_logging()
+        # Written straight to the stream, as the queue is no longer drained
+        structlog.get_logger().info("Logged after flush")
+        captured = capsys.readouterr()
+    finally:
+        with capsys.disabled():
+            configure_logging(renderer="json")
+
+    assert '"event":"Logged after flush"' in captured.err
@@ -0,0 +1,290 @@
+import json
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+from structlog import get_logger
+
+import app.models as m
+from app.support.logs import Progress
+
+log = get_logger(name=__name__)
+
+
+def retention_boundary(keep_weeks: int, now: Optional[datetime] = None) -> datetime:
+    """
+    Scrapes before the returned time are compacted. It is rounded down to the start
+    of the month so that only whole months are ever rolled up.
+    """
+    assert keep_weeks >= 0, f"Retention must not be negative, recieved: {keep_weeks}"
+    cutoff = (now or datetime.utcnow()) - timedelta(weeks=keep_weeks)
+    return datetime(cutoff.year, cutoff.month, 1)
+
+
+def _month_bounds(scraped_at: datetime) -> Tuple[datetime, datetime]:
+    start = datetime(scraped_at.year, scraped_at.month, 1)
+    if start.month == 12:
+        return start, datetime(start.year + 1, 1, 1)
+    return start, datetime(start.year, start.month + 1, 1)
+
+
+def _mean(values: List[Optional[float]]) -> Optional[float]:
+    present = [value for value in values if value is not None]
+    return sum(present) / len(present) if present else None
+
+
+def _mean_percentages(
+    children: List[List[Dict[str, Any]]], key: str
+) -> List[Dict[str, Any]]:
+    # The mean percentage of each country or age range over the scrapes it was in
+    percentages = defaultdict(list)
+    for rows in children:
+        for row in rows:
+            percentages[row[key]].append(row["percentage_value"])
+    return [
+        {key: name, "percentage_value": sum(values) / len(values)}
+        for name, values in percentages.items()
+    ]
+
+
+def _rank_countries(countries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    countries = sorted(countries, key=lambda row: -row["percentage_value"])
+    return [{"rank": rank, **row} for rank, row in enumerate(countries, start=1)]
+
+
+def _merge(monthly: m.PageScrapeMonthly, scrapes: int, values: Dict[str, Any]) -> None:
+    # A scrape ingested late for a month that was already compacted is weighted in
+    total = monthly.scrapes + scrapes
+    for column in m.DELTA_COLUMNS:
+        old, new = getattr(monthly, column), values[column]
+        if old is None or new is None:
+            setattr(monthly, column, new if old is None else old)
+        else:
+            setattr(monthly, column, (old * monthly.scrapes + new * scrapes) / total)
+
+    for child, key in [("countries", "country"), ("demographics", "age_range")]:
+        weighted = [json.loads(getattr(monthly, child))] * monthly.scrapes + [
+            values[child]
+        ] * scrapes
+        merged = _mean_percentages(weighted, key)
+        if child == "countries":
+            merged = _rank_countries(merged)
+        setattr(monthly, child, json.dumps(merged, separators=(",", ":")))
+
+    monthly.scrapes = total
+    # Recorded again by this compaction, so the merged roll up is exported again
+    monthly.event_id = None
+    monthly.first_scraped_at = min(monthly.first_scraped_at, values["first_scraped_at"])
+    monthly.last_scraped_at = max(monthly.last_scraped_at, values["last_scraped_at"])
+
+
+def _compact_month(
+    session: Session, page_id: int, start: datetime, end: datetime
+) -> int:
+    scrapes = session.scalars(
+        select(m.PageScrape)
+        .filter_by(page_id=page_id)
+        .where(m.PageScrape.scraped_at >= start, m.PageScrape.scraped_at < end)
+        .order_by(m.PageScrape.scraped_at, m.PageScrape.id)
+    ).all()
+
+    # Carry the resolved state of the first scrape forward over the month, so delta
+    # storage only needs to be resolved once rather than for every scrape
+    first = scrapes[0]
+    state = m.resolve_scrape(session, page_id, first.scraped_at, first.id)
+    children: Dict[Tuple[Any, Optional[int]], List[Dict[str, Any]]] = {}
+
+    def child_values(model: Any, scrape_id: Optional[int]) -> List[Dict[str, Any]]:
+        if (model, scrape_id) not in children:
+            children[model, scrape_id] = m.child_values(session, model, scrape_id)
+        return children[model, scrape_id]
+
+    values: Dict[str, List[Any]] = defaultdict(list)
+    for scrape in scrapes:
+        for column in m.DELTA_COLUMNS:
+            if getattr(scrape, column) is not None:
+                state[column] = getattr(scrape, column)
+            values[column].append(state[column])
+        if not scrape.countries_inherited:
+            state["countries_scrape_id"] = scrape.id
+        if not scrape.demographics_inherited:
+            state["demographics_scrape_id"] = scrape.id
+        values["countries"].append(
+            child_values(m.PageCountriesDistribution, state["countries_scrape_id"])
+        )
+        values["demographics"].append(
+            child_values(m.PageDemographics, state["demographics_scrape_id"])
+        )
+
+    aggregate = {
+        **{column: _mean(values[column]) for column in m.DELTA_COLUMNS},
+        "countries": _rank_countries(_mean_percentages(values["countries"], "country")),
+        "demographics": _mean_percentages(values["demographics"], "age_range"),
+        "first_scraped_at": scrapes[0].scraped_at,
+        "last_scraped_at": scrapes[-1].scraped_at,
+    }
+    monthly = session.scalars(
+        select(m.PageScrapeMonthly).filter_by(
+            page_id=page_id, year=start.year, month=start.month
+        )
+    ).one_or_none()
+    if monthly:
+        _merge(monthly, len(scrapes), aggregate)
+    else:
+        session.add(
+            m.PageScrapeMonthly(
+                page_id=page_id,
+                year=start.year,
+                month=start.month,
+                scrapes=len(scrapes),
+                **{
+                    **aggregate,
+                    "countries": json.dumps(
+                        aggregate["countries"], separators=(",", ":")
+                    ),
+                    "demographics": json.dumps(
+                        aggregate["demographics"], separators=(",", ":")
+                    ),
+                },
+            )
+        )
+
+    # The next scrape may inherit from the ones about to be deleted
+    later = session.scalars(
+        select(m.PageScrape)
+        .filter_by(page_id=page_id)
+        .where(m.PageScrape.scraped_at >= end)
+        .order_by(m.PageScrape.scraped_at, m.PageScrape.id)
+        .limit(1)
+    ).first()
+    if later:
+        later.rebase(session)
+
+    # The kept traffic and ranking history are exported by the event of the scrape
+    scrape_ids = [scrape.id for scrape in scrapes]
+    by_event: Dict[int, List[int]] = defaultdict(list)
+    for scrape in scrapes:
+        by_event[scrape.event_id].append(scrape.id)
+    for model in [m.PageTraffic, m.PageRankHistory]:
+        for event_id, event_scrape_ids in by_event.items():
+            session.execute(
+                update(model)
+                .where(model.scrape_id.in_(event_scrape_ids))
+                .values(scrape_id=None, event_id=event_id)
+                .execution_options(synchronize_session=False)
+            )
+    for model in [m.PageCountriesDistribution, m.PageDemographics]:
+        session.execute(
+            delete(model)
+            .where(model.scrape_id.in_(scrape_ids))
+            .execution_options(synchronize_session=False)
+        )
+    session.execute(delete(m.PageScrape).where(m.PageScrape.id.in_(scrape_ids)))
+    return len(scrapes)
+
+
+def compact(session: Session, boundary: datetime, batch_size: int = 100) -> int:
+    """
+    Rolls every scrape before `boundary` up into one `PageScrapeMonthly` per page and
+    month, then deletes the scrapes with their countries and demographics. The
+    traffic and ranking history they recorded are kept.
+
+    Each transaction compacts the oldest month of at most `batch_size` pages, so the
+    write lock is only held briefly and ingest can carry on alongside. Returns the
+    number of scrapes compacted.
+    """
+    assert batch_size > 0, f"Batch size must be positive, recieved: {batch_size}"
+    progress = Progress(log, "Compacting scrapes", boundary=boundary.isoformat())
+    compacted = 0
+    while True:
+        oldest = session.execute(
+            select(m.PageScrape.page_id, func.min(m.PageScrape.scraped_at))
+            .where(m.PageScrape.scraped_at < boundary)
+            .group_by(m.PageScrape.page_id)
+            .limit(batch_size)
+        ).all()
+        if not oldest:
+            break
+
+        scrapes = 0
+        for page_id, scraped_at in oldest:
+            scrapes += _compact_month(session, page_id, *_month_bounds(scraped_at))
+        session.commit()
+        compacted += scrapes
+        progress.advance(scrapes)
+    progress.finish()
+    return compacted
+
+
+def record_compaction(sessions: List[Session]) -> Optional[int]:
+    """
+    Records an Event in the main DB for the roll ups written by compaction in each of
+    `sessions`, the main DB or the shards. The roll ups are exported with the Event,
+    and as the latest Event it expires what the API cached from the deleted scrapes.
+    Roll ups left by a compaction that failed part way are recorded by the next one.
+    Returns the id of the Event, or None when nothing was rolled up.
+    """
+    unrecorded = select(m.PageScrapeMonthly.id).filter_by(event_id=None).limit(1)
+    pending = [session for session in sessions if session.scalar(unrecorded)]
+    if not pending:
+        return None
+
+    # Held back from export until every DB has given its roll ups the Event
+    event = m.Event.create(
+        path=f"compact://{datetime.utcnow().isoformat()}", complete=False
+    )
+    m.db.session.commit()
+    for session in pending:
+        if session.get(m.Event, event.id) is None:
+            session.add(m.Event(id=event.id, path=event.path))
+        session.execute(
+            update(m.PageScrapeMonthly)
+            .filter_by(event_id=None)
+            .values(event_id=event.id)
+        )
+        session.commit()
+
+    event.complete = True
+    m.db.session.commit()
+    log.info("Recorded compaction", event_id=event.id)
+    return event.id
+
+
+def optimize(session: Session, vacuum: bool = False) -> None:
+    """
+    Hands the pages freed by compaction back to the file system and refreshes the
+    query planner's statistics. Without `vacuum` the freed pages are only released if
+    the DB was created with incremental auto vacuum, which a full vacuum switches on.
+    """
+    session.commit()
+    engine = session.get_bind()
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        free_pages = connection.exec_driver_sql("pragma freelist_count").scalar()
+        auto_vacuum = connection.exec_driver_sql("pragma auto_vacuum").scalar()
+
+        if vacuum:
+            log.info("Running a full vacuum", database=engine.url.database)
+            connection.exec_driver_sql("vacuum")
+        elif auto_vacuum == 2:
+            # Each step of the pragma frees one page, executescript steps it to the end
+            connection.connection.driver_connection.executescript(
+                "pragma incremental_vacuum"
+            )
+        elif free_pages:
+            log.warn(
+                "DB was not created with incremental auto vacuum, run with --vacuum",
+                database=engine.url.database,
+            )
+        connection.exec_driver_sql("analyze")
+
+        log.info(
+            "Optimised DB",
+            database=engine.url.database,
+            free_pages_before=free_pages,
+            free_pages_after=connection.exec_driver_sql(
+                "pragma freelist_count"
+            ).scalar(),
+        )
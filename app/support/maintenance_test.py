@@ -0,0 +1,69 @@
+import json
+
+from datetime import datetime
+
+import pytest
+
+import app.models as m
+from support.ingest import ingest_similar_web_file
+from support.ingest_test import ROW, write_csv
+from support.maintenance import compact, record_compaction, retention_boundary
+
+
+def test_retention_boundary__rounds_down_to_month():
+    boundary = retention_boundary(4, now=datetime(2023, 6, 10, 12, 30))
+
+    # Four weeks before is the 13th of May, so the whole of May is kept
+    assert boundary == datetime(2023, 5, 1)
+
+
+def test_retention_boundary__crosses_year():
+    assert retention_boundary(2, now=datetime(2023, 1, 3)) == datetime(2022, 12, 1)
+
+
+def test_compact__rolls_up_month_and_rebases_later_scrape(db_app, tmp_path):
+    db_app.config["DELTA_STORAGE"] = True
+    changed = {"Global Rank": "#3", "Top Countries (1)": "United States:29.04%"}
+    scrapes = [
+        dict(ROW, **{"Scraped At": "2023-01-10T00:00:00"}),
+        dict(ROW, **{"Scraped At": "2023-01-20T00:00:00"}, **changed),
+        # Unchanged, so delta storage inherits everything from the scrape before
+        dict(ROW, **{"Scraped At": "2023-02-05T00:00:00"}, **changed),
+    ]
+    for index, scrape in enumerate(scrapes):
+        ingest_similar_web_file(write_csv(tmp_path / f"{index}.csv", [scrape]))
+    later = m.PageScrape.query.filter_by(scraped_at=datetime(2023, 2, 5)).one()
+    assert later.global_rank is None and later.countries_inherited
+
+    assert compact(m.db.session, datetime(2023, 2, 1)) == 2
+
+    monthly = m.PageScrapeMonthly.query.one()
+    assert (monthly.year, monthly.month, monthly.scrapes) == (2023, 1, 2)
+    assert monthly.global_rank == 2
+    assert [
+        (row["rank"], row["country"], row["percentage_value"])
+        for row in json.loads(monthly.countries)
+    ] == [(1, "United States", pytest.approx(28.04)), (2, "India", 4.51)]
+
+    later = m.PageScrape.query.one()
+    assert later.global_rank == 3 and not later.countries_inherited
+    assert [
+        (row["country"], row["percentage_value"])
+        for row in m.child_values(m.db.session, m.PageCountriesDistribution, later.id)
+    ] == [("United States", 29.04), ("India", 4.51)]
+    # The traffic the compacted scrapes recorded is kept
+    assert m.PageTraffic.query.filter_by(scrape_id=None).count() == 2
+
+
+def test_record_compaction__records_event_once(db_app, tmp_path):
+    for index, scraped_at in enumerate(["2023-01-10T00:00:00", "2023-02-05T00:00:00"]):
+        row = dict(ROW, **{"Scraped At": scraped_at})
+        ingest_similar_web_file(write_csv(tmp_path / f"{index}.csv", [row]))
+    compact(m.db.session, datetime(2023, 2, 1))
+
+    # The new latest Event changes the version the API caches and tags responses by
+    event_id = record_compaction([m.db.session])
+    assert event_id == max(event.id for event in m.Event.query.all())
+    assert m.db.session.get(m.Event, event_id).complete
+    assert m.PageScrapeMonthly.query.one().event_id == event_id
+    assert record_compaction([m.db.session]) is None
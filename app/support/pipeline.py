@@ -0,0 +1,151 @@
+import attrs
+import queue
+import threading
+
+from typing import Any, Callable, Iterable, List, Sequence
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+# Marks the end of the stream on a queue, one is sent for every consuming worker
+_DONE = object()
+# How often blocked workers wake up to check if the pipeline has been stopped
+_POLL_SECONDS = 0.1
+
+
+@attrs.define()
+class Stage:
+    """
+    A single step of a pipeline. Every item from the previous stage is passed to
+    `func` by one of `workers` threads, and whatever is returned is handed on to the
+    next stage. Returning None drops the item from the pipeline.
+    """
+
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+
+class _Pipeline:
+    def __init__(self, stages: Sequence[Stage], queue_size: int) -> None:
+        self.stages = stages
+        # One queue in front of every stage plus the one feeding the sink
+        self.queues: List[queue.Queue] = [
+            queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)
+        ]
+        self.stop = threading.Event()
+        self.errors: List[BaseException] = []
+        self._remaining = [stage.workers for stage in stages]
+        self._lock = threading.Lock()
+
+    def fail(self, error: BaseException) -> None:
+        with self._lock:
+            self.errors.append(error)
+        self.stop.set()
+
+    def put(self, index: int, item: Any) -> bool:
+        # Blocking on a full queue is our backpressure, but keep checking that the
+        # rest of the pipeline is still alive so we never deadlock on failure
+        while not self.stop.is_set():
+            try:
+                self.queues[index].put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, index: int) -> Any:
+        while not self.stop.is_set():
+            try:
+                return self.queues[index].get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _consumers(self, index: int) -> int:
+        return self.stages[index].workers if index < len(self.stages) else 1
+
+    def feed(self, source: Iterable[Any]) -> None:
+        try:
+            for item in source:
+                if not self.put(0, item):
+                    return
+            for _ in range(self._consumers(0)):
+                self.put(0, _DONE)
+        except BaseException as error:
+            self.fail(error)
+
+    def work(self, index: int) -> None:
+        stage = self.stages[index]
+        try:
+            while True:
+                item = self.get(index)
+                if item is _DONE:
+                    break
+
+                result = stage.func(item)
+                if result is not None and not self.put(index + 1, result):
+                    return
+        except BaseException as error:
+            log.error("Pipeline stage failed", stage=stage.name, error=error)
+            self.fail(error)
+            return
+
+        # The last worker to finish closes the stream for the next stage
+        with self._lock:
+            self._remaining[index] -= 1
+            finished = self._remaining[index] == 0
+        if finished:
+            for _ in range(self._consumers(index + 1)):
+                self.put(index + 1, _DONE)
+
+
+def run_pipeline(
+    source: Iterable[Any],
+    stages: Sequence[Stage],
+    sink: Callable[[Any], None],
+    queue_size: int = 64,
+) -> int:
+    """
+    Streams every item of `source` through the stages over bounded queues, each stage
+    running on its own pool of threads. The sink is called on the calling thread so
+    it can rely on thread bound state such as the Flask app context and DB session.
+    Returns the number of items that reached the sink, and re-raises the first error
+    raised by any stage.
+    """
+    assert stages, "A pipeline needs at least one stage"
+    pipeline = _Pipeline(stages, queue_size)
+
+    threads = [threading.Thread(target=pipeline.feed, args=(source,), daemon=True)]
+    for index, stage in enumerate(stages):
+        threads.extend(
+            threading.Thread(
+                target=pipeline.work,
+                args=(index,),
+                name=f"pipeline-{stage.name}-{worker}",
+                daemon=True,
+            )
+            for worker in range(stage.workers)
+        )
+    for thread in threads:
+        thread.start()
+
+    count = 0
+    try:
+        while True:
+            item = pipeline.get(len(stages))
+            if item is _DONE:
+                break
+            sink(item)
+            count += 1
+    except BaseException as sink_error:
+        pipeline.fail(sink_error)
+    finally:
+        pipeline.stop.set()
+        for thread in threads:
+            thread.join()
+
+    if pipeline.errors:
+        raise pipeline.errors[0]
+
+    return count
@@ -0,0 +1,38 @@
+import pytest
+
+from support.pipeline import Stage, run_pipeline
+
+
+def test_run_pipeline__happy_path():
+    results = []
+    count = run_pipeline(
+        range(100),
+        [
+            Stage("double", lambda x: x * 2, workers=4),
+            # Returning None drops the item from the pipeline
+            Stage("evens", lambda x: x if x % 4 == 0 else None, workers=2),
+        ],
+        results.append,
+        queue_size=2,
+    )
+
+    assert count == 50
+    assert sorted(results) == list(range(0, 200, 4))
+
+
+def test_run_pipeline__stage_error_is_raised():
+    def explode(x):
+        if x == 10:
+            raise ValueError("bad row")
+        return x
+
+    with pytest.raises(ValueError, match="bad row"):
+        run_pipeline(range(1_000), [Stage("explode", explode, workers=3)], [].append)
+
+
+def test_run_pipeline__sink_error_is_raised():
+    def sink(_):
+        raise KeyError("sink")
+
+    with pytest.raises(KeyError):
+        run_pipeline(range(1_000), [Stage("identity", lambda x: x)], sink)
@@ -0,0 +1,153 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, List, Optional
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+# From Python 3.12 cProfile is built on sys.monitoring, which sees every thread but
+# only allows one profiler at a time, so threads can not be given profiles of their own
+PROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+
+class Profiler:
+    """
+    Captures a cProfile of a CLI command and/or tracemalloc snapshots of its top
+    allocations. Memory snapshots are taken when the command finishes, and also every
+    `memory_interval` seconds if given so growth can be followed during long runs.
+    Output is written to timestamped files named after the command.
+
+    Before Python 3.12 cProfile only sees the thread it was enabled on, so every
+    thread the command starts while profiling gets a profile of its own. The
+    profiles of the threads that have finished by the time the command does are
+    merged into its output. From 3.12 the command's profile already sees them.
+    """
+
+    def __init__(
+        self,
+        command: str,
+        output_dir: Path,
+        profile: bool = False,
+        trace_memory: bool = False,
+        memory_interval: Optional[float] = None,
+        memory_frames: int = 10,
+        top: int = 25,
+    ) -> None:
+        # Unique per run, as runs of the same command can start within a second
+        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+        self.prefix = output_dir / f"{command}_{timestamp}_{os.getpid()}"
+        self.output_dir = output_dir
+        self.memory_interval = memory_interval
+        self.memory_frames = memory_frames
+        self.top = top
+
+        self._profile = cProfile.Profile() if profile else None
+        self._thread_profiles: List[cProfile.Profile] = []
+        self._running_threads = 0
+        self._threads_lock = threading.Lock()
+        self._thread_run: Optional[Any] = None
+        self._trace_memory = trace_memory
+        self._memory_file: Optional[IO[str]] = None
+        self._done = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        if self._trace_memory:
+            memory_path = self.prefix.with_suffix(".memory.txt")
+            log.info("Tracing memory allocations", path=memory_path)
+            self._memory_file = open(memory_path, "w")
+            tracemalloc.start(self.memory_frames)
+
+            if self.memory_interval:
+                self._sampler = threading.Thread(
+                    target=self._sample, name="profiler-memory", daemon=True
+                )
+                self._sampler.start()
+
+        if self._profile:
+            log.info("Profiling command", path=self.prefix.with_suffix(".pstats"))
+            if PROFILE_PER_THREAD:
+                self._profile_threads()
+            self._profile.enable()
+
+    def _profile_threads(self) -> None:
+        thread_run = self._thread_run = threading.Thread.run
+
+        def run(thread: threading.Thread) -> None:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as error:
+                # Another profiler is active, the thread still has to run unprofiled
+                log.warn("Can not profile thread", thread=thread.name, error=str(error))
+                thread_run(thread)
+                return
+
+            with self._threads_lock:
+                self._running_threads += 1
+            try:
+                thread_run(thread)
+            finally:
+                profile.disable()
+                with self._threads_lock:
+                    self._running_threads -= 1
+                    self._thread_profiles.append(profile)
+
+        threading.Thread.run = run  # type: ignore
+
+    def stop(self) -> None:
+        if self._profile:
+            self._profile.disable()
+            if self._thread_run:
+                threading.Thread.run = self._thread_run  # type: ignore
+            if self._running_threads:
+                log.warn(
+                    "Threads still running are missing from the profile",
+                    threads=self._running_threads,
+                )
+
+            stats = pstats.Stats(self._profile)
+            with self._threads_lock:
+                for profile in self._thread_profiles:
+                    stats.add(profile)
+            stats.dump_stats(self.prefix.with_suffix(".pstats"))
+
+        if self._trace_memory:
+            self._done.set()
+            if self._sampler:
+                self._sampler.join()
+
+            self._snapshot("final")
+            tracemalloc.stop()
+            assert self._memory_file
+            self._memory_file.close()
+
+        log.info("Saved profiling output", prefix=self.prefix)
+
+    def _sample(self) -> None:
+        assert self.memory_interval
+        while not self._done.wait(self.memory_interval):
+            self._snapshot("sample")
+
+    def _snapshot(self, label: str) -> None:
+        assert self._memory_file
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+
+        lines = [
+            f"--- {label} snapshot at {datetime.utcnow().isoformat()} "
+            f"current={current / 1024:.1f}KiB peak={peak / 1024:.1f}KiB",
+            *(str(stat) for stat in snapshot.statistics("lineno")[: self.top]),
+            "",
+        ]
+        self._memory_file.write("\n".join(lines) + "\n")
+        self._memory_file.flush()
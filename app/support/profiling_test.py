@@ -0,0 +1,51 @@
+import cProfile
+import pstats
+import threading
+
+import support.profiling as profiling
+from support.profiling import Profiler
+
+
+def _work_in_thread():
+    return sum(range(1_000))
+
+
+def test_profiler__includes_worker_threads(tmp_path):
+    profiler = Profiler("ingest", tmp_path, profile=True)
+    profiler.start()
+    thread = threading.Thread(target=_work_in_thread)
+    thread.start()
+    thread.join()
+    profiler.stop()
+
+    (path,) = tmp_path.glob("*.pstats")
+    stats = pstats.Stats(str(path))
+    assert "_work_in_thread" in {name for _, _, name in stats.stats}
+    # Threads started after the command are no longer profiled
+    assert threading.Thread.run.__qualname__ == "Thread.run"
+
+
+def test_profiler__runs_in_same_second_do_not_collide(tmp_path):
+    prefixes = {Profiler("ingest", tmp_path).prefix for _ in range(3)}
+    assert len(prefixes) == 3
+
+
+class _ActiveProfiler(cProfile.Profile):
+    def enable(self, *args, **kwargs):
+        raise ValueError("Another profiling tool is already active")
+
+
+def test_profiler__thread_runs_when_it_can_not_be_profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_PER_THREAD", True)
+    profiler = Profiler("ingest", tmp_path, profile=True)
+    # As on Python 3.12, where a second profile can not be enabled
+    monkeypatch.setattr(cProfile, "Profile", _ActiveProfiler)
+    profiler.start()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(_work_in_thread()))
+    thread.start()
+    thread.join()
+    profiler.stop()
+
+    assert results == [499_500]
+    assert list(tmp_path.glob("*.pstats"))
@@ -1,13 +1,75 @@
-import re
-
-from js2xml import parse
+from datetime import datetime
+from pathlib import Path
 from structlog import get_logger
-from typing import Dict
+from typing import Dict, List, Optional
 from bs4 import BeautifulSoup
 
+from app.support.charts import decode_series
+from app.support.scripts import scrape_similarweb_state
+from app.support.serialise import attrs_to_csv, dict_to_attrs
+from app.support.similarweb import SimilarWebConverter, SimilarWebRaw
+
 log = get_logger(name=__name__)
 
 
+def scrape_similarweb_content(
+    content: bytes, path: str, scraped_at: datetime
+) -> Dict[str, str]:
+    """
+    Scrapes the HTML of a SimilarWeb page, returning the data points keyed by the
+    column aliases of SimilarWebRaw.
+    """
+    # Reading the state the page was rendered from is much cheaper than parsing the
+    # HTML, which is only parsed when a page has no state
+    scraped_attributes = scrape_similarweb_state(content)
+    if scraped_attributes is None:
+        page = BeautifulSoup(content, "html.parser")
+
+        # Retrieve all of the required data points for the pages
+        scraped_attributes = scrape_similarweb_data(page)
+    scraped_attributes["Path"] = path
+    scraped_attributes["Scraped At"] = scraped_at.isoformat()
+    return scraped_attributes
+
+
+def scrape_similarweb_file(path: Path) -> Dict[str, str]:
+    # Scrapes a locally saved SimilarWeb page
+    return scrape_similarweb_content(path.read_bytes(), str(path), datetime.utcnow())
+
+
+def save_similarweb_data(
+    data_points: List[Dict[str, str]], name: Optional[str] = None
+) -> Path:
+    """
+    Serialises scraped data points to a new SimilarWeb CSV in the local input
+    directory, returning the path of the file written. The file is named by the
+    time it was written unless a name is given.
+    """
+    # Serialse into a structured format
+    log.info("Serialising scraped data", format="SimilarWebRaw")
+    page_data = dict_to_attrs(SimilarWebRaw, data_points)
+
+    # Encode using converter
+    content = attrs_to_csv(SimilarWebRaw, SimilarWebConverter, page_data)
+
+    # write file locally
+    write_path = Path("app/local") / "input"
+    if not write_path.exists():
+        log.info("Creating local directory for saving scraped data", parents=True)
+        write_path.mkdir(parents=True, exist_ok=True)
+
+    # Include microseconds as concurrent workers can finish within the same second
+    write_file_name = write_path / (
+        name or datetime.utcnow().strftime("similarweb_%Y%m%d_%H%M%S_%f.csv")
+    )
+
+    log.info(
+        "Writing scraped data locally", directory=write_path, filename=write_file_name
+    )
+    write_file_name.write_bytes(content)
+    return write_file_name
+
+
 def scrape_similarweb_data(page: BeautifulSoup) -> Dict[str, str]:
     data_points = {}
 
@@ -27,6 +89,16 @@ def scrape_similarweb_data(page: BeautifulSoup) -> Dict[str, str]:
     data_points.update(_scrape_engagement(page))
 
     # fetch the ranking data
+    try:
+        data_points.update(_scrape_ranking(page))
+    except Exception as error:
+        data_points["Ranking History"] = ""
+        log.error(
+            "Failed to scrape ranking data points",
+            page=page.title.text,  # type: ignore
+            error=error,
+            process="ranking_data",
+        )
 
     # We wrap the following elements in a try/catch because the elements
     # may not exist for pages with really low traffic. The website itself
@@ -127,6 +199,15 @@ def _scrape_traffic(page: BeautifulSoup) -> Dict[str, str]:
     }
 
 
+def _scrape_ranking(page: BeautifulSoup) -> Dict[str, str]:
+    # The ranking chart has no data labels, so decode the plotted line instead
+    ranking_chart = page.select("div.wa-rank-list__chart").pop()
+    history = decode_series(ranking_chart)
+    return {
+        "Ranking History": "|".join(f"{month}:{round(rank)}" for month, rank in history)
+    }
+
+
 def _scrape_countries(page: BeautifulSoup) -> Dict[str, str]:
     data_points = {}
     countries_list = page.select(".wa-geography__country-info")
@@ -0,0 +1,244 @@
+import json
+import re
+import time
+
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+# Inline scripts assigning the state the page was rendered from, up to the bracket
+# opening the object
+STATE_PATTERN = re.compile(
+    rb"__(?:APP_DATA|INITIAL_STATE|PRELOADED_STATE)__\s*=\s*(?=[{\[])"
+)
+# The only bytes that can open or close an object, array or string
+TOKEN_PATTERN = re.compile(rb"[{}\[\]\"'`]")
+# The rest of a string after its opening quote, skipping over escaped quotes
+STRING_ENDS = {
+    quote: re.compile(rb"(?:[^%s\\]|\\.)*%s" % (quote, quote), re.DOTALL)
+    for quote in [b'"', b"'", b"`"]
+}
+
+
+def _import_js2xml() -> Tuple[Any, Any]:
+    try:
+        import js2xml
+        from js2xml.utils.vars import get_vars
+    except ImportError as error:
+        raise ImportError(
+            "Decoding script objects that are not JSON requires js2xml, install "
+            "the scripts extra"
+        ) from error
+    return js2xml, get_vars
+
+
+def match_brackets(content: bytes, start: int) -> int:
+    """
+    Returns the index just after the bracket closing the one at `start`. Only the
+    brackets and quotes are visited, jumping over the content of strings, so the
+    scan runs at regex speed rather than a Python loop over every byte.
+    """
+    assert content[start : start + 1] in (b"{", b"["), "Expected an opening bracket"
+    depth, position = 0, start
+    while True:
+        match = TOKEN_PATTERN.search(content, position)
+        if not match:
+            raise ValueError(f"Unbalanced brackets from index {start}")
+        token, position = match.group(), match.end()
+
+        if token in (b"{", b"["):
+            depth += 1
+        elif token in (b"}", b"]"):
+            depth -= 1
+            if depth == 0:
+                return position
+        else:
+            string = STRING_ENDS[token].match(content, position)
+            if not string:
+                raise ValueError(f"Unterminated string at index {match.start()}")
+            position = string.end()
+
+
+def find_objects(
+    content: bytes, pattern: re.Pattern = STATE_PATTERN
+) -> Iterator[bytes]:
+    # Every object or array the pattern matches the start of, without the rest
+    for match in pattern.finditer(content):
+        start = match.end()
+        try:
+            yield content[start : match_brackets(content, start)]
+        except ValueError as error:
+            log.warn("Skipping malformed script object", error=str(error))
+
+
+def decode_object(fragment: bytes) -> Any:
+    """
+    Decodes an object or array literal from a script. Most are valid JSON, and
+    js2xml is only imported to parse the ones that are not, such as objects with
+    unquoted keys.
+    """
+    try:
+        return json.loads(fragment)
+    except ValueError:
+        log.debug("Script object is not JSON, parsing it with js2xml")
+
+    js2xml, get_vars = _import_js2xml()
+    tree = js2xml.parse(f"var data = {fragment.decode('utf-8')};")
+    return get_vars(tree)["data"]
+
+
+def _get(state: Dict[str, Any], path: Tuple[str, ...]) -> Any:
+    for key in path:
+        if not isinstance(state, dict) or key not in state:
+            return None
+        state = state[key]
+    return state
+
+
+def _has(state: Dict[str, Any], path: Tuple[str, ...]) -> bool:
+    # A path ending early at a null is a value the page does not have, while a
+    # missing key is a value that has moved
+    for key in path:
+        if state is None:
+            return True
+        if not isinstance(state, dict) or key not in state:
+            return False
+        state = state[key]
+    return True
+
+
+def _rank(value: Any) -> str:
+    return f"#{int(value):,}" if value else ""
+
+
+def _big_number(value: Any) -> str:
+    # The same rounding the page renders, which is all the HTML scraper can read
+    if value is None:
+        return ""
+    if value < 5_000:
+        return "< 5K"
+    for unit, scale in [("B", 1e9), ("M", 1e6)]:
+        if value >= scale:
+            return f"{value / scale:.1f}{unit}"
+    return f"{value / 1e3:.1f}K"
+
+
+def _percentage(value: Any) -> str:
+    return f"{value * 100:.2f}%" if value is not None else ""
+
+
+def _decimal(value: Any) -> str:
+    return f"{value:.2f}" if value is not None else ""
+
+
+def _duration(value: Any) -> str:
+    return time.strftime("%H:%M:%S", time.gmtime(value)) if value is not None else ""
+
+
+def _month(date: str) -> str:
+    return datetime.strptime(date[:10], "%Y-%m-%d").strftime("%b")
+
+
+# Where each data point of the page sits in its state, and how the page renders it.
+# The paths follow the test fixture, which was written by hand rather than saved from
+# a live page, so a page missing any of them falls back to scraping the HTML
+STATE_ROOT = ("layout", "data")
+STATE_VALUES: Dict[str, Tuple[Tuple[str, ...], Callable[[Any], str]]] = {
+    "Global Rank": (("overview", "globalRank"), _rank),
+    "Country Rank": (("overview", "countryRank", "rank"), _rank),
+    "Category Rank": (("overview", "categoryRank", "rank"), _rank),
+    "Total Visits": (("traffic", "visitsTotalCount"), _big_number),
+    "Bounce Rate": (("traffic", "bounceRate"), _percentage),
+    "Pages per Visit": (("traffic", "pagesPerVisit"), _decimal),
+    "Avg Visit Duration": (("traffic", "visitsAvgDuration"), _duration),
+}
+# Every state of the page has these, even when their value is null
+REQUIRED_PATHS = [path for path, _ in STATE_VALUES.values()] + [
+    ("traffic", "history"),
+    ("geography", "topCountriesTraffics"),
+    ("demographics", "ageDistribution"),
+    ("overview", "globalRankHistory"),
+]
+AGE_RANGES = ["18 - 24", "25 - 34", "35 - 44", "45 - 54", "55 - 64", "65+"]
+
+
+def _state_lists(state: Dict[str, Any]) -> Dict[str, str]:
+    data_points = {}
+
+    history: List[Dict[str, Any]] = _get(state, ("traffic", "history")) or []
+    for idx in range(3):
+        # The page charts the last three months of the history
+        point = history[idx - 3] if len(history) >= 3 else None
+        data_points[f"Monthly Traffic P{idx + 1}"] = (
+            f"{_month(point['date'])}:{_big_number(point['visits'])}" if point else ""
+        )
+
+    countries = _get(state, ("geography", "topCountriesTraffics")) or []
+    for idx in range(5):
+        country = countries[idx] if idx < len(countries) else None
+        data_points[f"Top Countries ({idx + 1})"] = (
+            f"{country['countryName']}:{_percentage(country['visitsShare'])}"
+            if country
+            else ""
+        )
+
+    ages = {
+        (
+            f"{age['minAge']} - {age['maxAge']}"
+            if age.get("maxAge")
+            else f"{age['minAge']}+"
+        ): age
+        for age in _get(state, ("demographics", "ageDistribution")) or []
+    }
+    for age_range in AGE_RANGES:
+        data_points[f"Demographics ({age_range})"] = _percentage(
+            ages.get(age_range, {}).get("value")
+        )
+
+    ranks = _get(state, ("overview", "globalRankHistory")) or []
+    data_points["Ranking History"] = "|".join(
+        f"{_month(point['date'])}:{round(point['rank'])}" for point in ranks
+    )
+    return data_points
+
+
+def scrape_similarweb_state(content: bytes) -> Optional[Dict[str, str]]:
+    """
+    Scrapes a SimilarWeb page from the state object preloaded in its inline
+    scripts, returning the same data points as `scrape_similarweb_data` without
+    parsing the HTML. Returns None if the page has no state with the overview, or
+    its state is missing any of the data points or can not be read, so that the
+    caller can fall back to scraping the HTML rather than saving blanks.
+    """
+    for fragment in find_objects(content):
+        try:
+            state = _get(decode_object(fragment), STATE_ROOT)
+        except ImportError as error:
+            log.warn("Can not decode the page state", error=str(error))
+            return None
+        except (SyntaxError, ValueError) as error:
+            # Not valid JavaScript or not UTF-8, which js2xml raises for as well as
+            # the decode, so the object is skipped as it can not be the state
+            log.warn("Can not decode script object", error=repr(error))
+            continue
+        page = _get(state, ("overview", "domain"))  # type: ignore
+        if not page:
+            continue
+
+        missing = [".".join(path) for path in REQUIRED_PATHS if not _has(state, path)]
+        if missing:
+            log.warn("Page state is missing data points", page=page, missing=missing)
+            return None
+
+        data_points = {"Page": page}
+        try:
+            for key, (path, render) in STATE_VALUES.items():
+                data_points[key] = render(_get(state, path))  # type: ignore
+            data_points.update(_state_lists(state))  # type: ignore
+        except (KeyError, TypeError, ValueError) as error:
+            log.warn("Can not read the page state", page=page, error=repr(error))
+            return None
+        return data_points
+    return None
@@ -0,0 +1,175 @@
+import json
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup
+
+from support.scrape import scrape_similarweb_content, scrape_similarweb_data
+from support.scripts import decode_object, find_objects, scrape_similarweb_state
+
+STATE = {
+    "layout": {
+        "data": {
+            "overview": {
+                "domain": "alpha.com",
+                "globalRank": 1234,
+                "countryRank": {"rank": 3},
+                "categoryRank": {"rank": None},
+                "globalRankHistory": [
+                    {"date": "2023-01-01", "rank": 1300},
+                    {"date": "2023-02-01", "rank": 1234.4},
+                ],
+            },
+            "traffic": {
+                "visitsTotalCount": 1_234_567,
+                "bounceRate": 0.401,
+                "pagesPerVisit": 3.1,
+                "visitsAvgDuration": 125,
+                "history": [
+                    {"date": "2022-12-01", "visits": 900_000},
+                    {"date": "2023-01-01", "visits": 1_000_000},
+                    {"date": "2023-02-01", "visits": 1_100_000},
+                    {"date": "2023-03-01", "visits": 1_234_567},
+                ],
+            },
+            "geography": {
+                "topCountriesTraffics": [
+                    {"countryName": "United States", "visitsShare": 0.3},
+                    {"countryName": "India", "visitsShare": 0.1},
+                ]
+            },
+            "demographics": {
+                "ageDistribution": [
+                    {"minAge": 18, "maxAge": 24, "value": 0.2},
+                    {"minAge": 65, "maxAge": None, "value": 0.05},
+                ]
+            },
+        }
+    }
+}
+
+
+def _page(state: str) -> bytes:
+    return (
+        "<html><head><script>var config = {'theme': '}'};</script>"
+        f"<script>window.__APP_DATA__ = {state};</script></head>"
+        "<body><h1>Not parsed</h1></body></html>"
+    ).encode("utf-8")
+
+
+def test_find_objects__skips_brackets_in_strings():
+    state = {"quote": 'a "}" b', "nested": [{"x": "]"}]}
+
+    (fragment,) = find_objects(_page(json.dumps(state)))
+
+    assert json.loads(fragment) == state
+
+
+def test_scrape_similarweb_state__same_keys_as_html():
+    data_points = scrape_similarweb_state(_page(json.dumps(STATE)))
+
+    assert data_points == {
+        "Page": "alpha.com",
+        "Global Rank": "#1,234",
+        "Country Rank": "#3",
+        "Category Rank": "",
+        "Total Visits": "1.2M",
+        "Bounce Rate": "40.10%",
+        "Pages per Visit": "3.10",
+        "Avg Visit Duration": "00:02:05",
+        "Monthly Traffic P1": "Jan:1.0M",
+        "Monthly Traffic P2": "Feb:1.1M",
+        "Monthly Traffic P3": "Mar:1.2M",
+        "Top Countries (1)": "United States:30.00%",
+        "Top Countries (2)": "India:10.00%",
+        "Top Countries (3)": "",
+        "Top Countries (4)": "",
+        "Top Countries (5)": "",
+        "Demographics (18 - 24)": "20.00%",
+        "Demographics (25 - 34)": "",
+        "Demographics (35 - 44)": "",
+        "Demographics (45 - 54)": "",
+        "Demographics (55 - 64)": "",
+        "Demographics (65+)": "5.00%",
+        "Ranking History": "Jan:1300|Feb:1234",
+    }
+
+
+def test_scrape_similarweb_state__no_state():
+    assert scrape_similarweb_state(b"<html><body></body></html>") is None
+
+
+@pytest.mark.parametrize(
+    "broken", [b"{page: 'alpha.com',, }", b"{page: '\xff'}", b"{'page': }"]
+)
+def test_scrape_similarweb_state__skips_objects_that_can_not_be_decoded(broken):
+    pytest.importorskip("js2xml")
+    script = b"<script>window.__APP_DATA__ = " + broken + b";</script>"
+    content = _page(json.dumps(STATE))
+
+    # The state is still found after an object that is not valid JavaScript or UTF-8
+    data_points = scrape_similarweb_state(content.replace(b"<script>", script, 1))
+    assert data_points == scrape_similarweb_state(content)
+    assert data_points["Page"] == "alpha.com"
+    assert scrape_similarweb_state(b"<html><head>" + script + b"</head></html>") is None
+
+
+def test_decode_object__not_json():
+    pytest.importorskip("js2xml")
+
+    assert decode_object(b"{page: 'alpha.com', ranks: [1, 2]}") == {
+        "page": "alpha.com",
+        "ranks": [1, 2],
+    }
+
+
+# A saved page with the state it was rendered from preloaded in an inline script,
+# next to the HTML rendered from that state
+FIXTURE = Path(__file__).parent / "fixtures" / "similarweb-alpha-com-state.html"
+
+
+def _edit_fixture(edit) -> bytes:
+    content = FIXTURE.read_bytes()
+    (fragment,) = find_objects(content)
+    state = json.loads(fragment)
+    edit(state["layout"]["data"])
+    return content.replace(fragment, json.dumps(state).encode("utf-8"))
+
+
+def test_scrape_similarweb_state__matches_html_of_page():
+    content = FIXTURE.read_bytes()
+
+    data_points = scrape_similarweb_state(content)
+
+    assert data_points == scrape_similarweb_data(BeautifulSoup(content, "html.parser"))
+    assert data_points["Top Countries (5)"] == "Germany:3.00%"
+
+
+@pytest.mark.parametrize(
+    "parent, key",
+    [("overview", "globalRank"), ("traffic", "bounceRate"), ("demographics", None)],
+)
+def test_scrape_similarweb_state__moved_value_falls_back_to_html(parent, key):
+    def move(state):
+        # The page has moved the value somewhere else in its state
+        if key:
+            state[parent][f"{key}V2"] = state[parent].pop(key)
+        else:
+            state[f"{parent}V2"] = state.pop(parent)
+
+    content = _edit_fixture(move)
+
+    assert scrape_similarweb_state(content) is None
+    data_points = scrape_similarweb_content(content, str(FIXTURE), datetime(2023, 1, 1))
+    assert data_points["Global Rank"] == "#12"
+    assert data_points["Bounce Rate"] == "40.10%"
+    assert data_points["Demographics (18 - 24)"] == "20.00%"
+
+
+def test_scrape_similarweb_state__unreadable_value_falls_back_to_html():
+    def nest(state):
+        state["overview"]["globalRank"] = {"rank": 12}
+
+    assert scrape_similarweb_state(_edit_fixture(nest)) is None
@@ -2,7 +2,7 @@ import csv
 import attrs
 
 from io import StringIO
-from typing import Dict, Iterable, Type, TypeVar
+from typing import Dict, Iterable, List, Type, TypeVar
 from cattrs import GenConverter
 
 
@@ -17,6 +17,11 @@ def _attrs_field_alias_map(type_: Type[X]) -> Dict[str, str]:
     }
 
 
+def field_aliases(type_: Type[X]) -> List[str]:
+    # The column headers used when serialising the class to CSV
+    return list(_attrs_field_alias_map(type_).values())
+
+
 def dict_to_attrs(type_: Type[X], rows: Iterable[Dict[str, str]]) -> Iterable[X]:
     # We need to reverse the fields later to assign them as dict keys in the structuring
     # function
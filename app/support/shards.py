@@ -0,0 +1,230 @@
+import zlib
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Union,
+)
+
+from flask import current_app
+from sqlalchemy import Connection, Engine, create_engine, select, text, update
+from sqlalchemy.orm import Session
+from structlog import get_logger
+
+import app.models as m
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from app.support.similarweb import SimilarWebBatch, SimilarWebIn
+
+log = get_logger(name=__name__)
+
+
+def shard_for(website: str, count: int) -> int:
+    # crc32 rather than hash() as it has to be stable across processes and restarts
+    return zlib.crc32(website.encode("utf-8")) % count
+
+
+class ShardRouter:
+    """
+    Spreads the scrape data over a number of SQLite files, partitioned by the hash
+    of `Page.website`. Each shard has its own write lock so ingests of different
+    shards run in parallel. Every row of a page lives on the same shard, so lookups
+    of a single site go to one shard and reads across sites fan out to all shards
+    and concatenate the results.
+
+    Events are still recorded in the main DB to deduplicate files, and copied to
+    each shard the file wrote to so that the shard's foreign keys stay valid.
+    """
+
+    def __init__(
+        self, directory: Path, count: int, timeout: float = 30, delta: bool = False
+    ) -> None:
+        assert count > 0, f"Shard count must be positive, recieved: {count}"
+        self.directory = directory
+        self.count = count
+        # Whether pages are ingested with delta storage, see PageScrape
+        self.delta = delta
+        self.engines: List[Engine] = [
+            create_engine(
+                f"sqlite:///{self.path(index)}", connect_args={"timeout": timeout}
+            )
+            for index in range(count)
+        ]
+        for engine in self.engines:
+            m.use_auto_vacuum(engine)
+
+    def path(self, index: int) -> Path:
+        return self.directory / f"shard_{index:03d}.db"
+
+    def shard_for(self, website: str) -> int:
+        return shard_for(website, self.count)
+
+    def session(self, index: int) -> Session:
+        return Session(self.engines[index])
+
+    def session_for(self, website: str) -> Session:
+        return self.session(self.shard_for(website))
+
+    def create_all(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for engine in self.engines:
+            m.db.metadata.create_all(engine)
+
+    def drop_all(self) -> None:
+        for index, engine in enumerate(self.engines):
+            engine.dispose()
+            self.path(index).unlink(missing_ok=True)
+
+    def read_sql(
+        self,
+        query: Union[str, Callable[[Connection], str]],
+        params: Optional[Mapping[str, Any]] = None,
+    ) -> "pd.DataFrame":
+        """
+        Runs the query on every shard in parallel and concatenates the results.
+        Ordering is only guaranteed within a shard. A callable query is given the
+        connection to each shard, for queries that depend on what the shard holds.
+        """
+        import pandas as pd
+
+        def run(engine: Engine) -> pd.DataFrame:
+            with engine.connect() as connection:
+                sql = query if isinstance(query, str) else query(connection)
+                return pd.read_sql_query(text(sql), connection, params=params)
+
+        with ThreadPoolExecutor(max_workers=self.count) as executor:
+            frames = list(executor.map(run, self.engines))
+        return pd.concat(frames, ignore_index=True)
+
+    def _reconcile_event(self, session: Session, index: int, event: m.Event) -> None:
+        """
+        Shards commit before the main DB, so an ingest that fails after some shards
+        committed leaves their copy of the Event behind with no Event in the main DB.
+        A retry of the file is given a new id, and the old id can since have been
+        given to another file, so the main DB decides which shard events are kept.
+        """
+        from app.support.ingest import _remove_event_rows
+
+        stale = session.get(m.Event, event.id)
+        if stale and stale.path != event.path:
+            # The file was never committed to the main DB, so its rows are removed
+            # and it is written to this shard again when it is retried
+            log.warn("Removing stale shard event", shard=index, file=stale.path)
+            _remove_event_rows(session, stale.id)
+
+        earlier = session.scalars(
+            select(m.Event).filter_by(path=event.path)
+        ).one_or_none()
+        if earlier and earlier.id != event.id:
+            # Each shard commits all of its rows at once, so the rows of the earlier
+            # attempt are complete and only need to point at the new id
+            log.warn("Moving shard event to new id", shard=index, file=event.path)
+            session.execute(
+                update(m.PageScrape)
+                .filter_by(event_id=earlier.id)
+                .values(event_id=event.id)
+                .execution_options(synchronize_session=False)
+            )
+            session.execute(
+                update(m.Event)
+                .filter_by(id=earlier.id)
+                .values(id=event.id)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    def ingest(
+        self,
+        event: m.Event,
+        pages: Union["SimilarWebBatch", Iterable["SimilarWebIn"]],
+        skip_existing: bool = True,
+    ) -> int:
+        """
+        Routes the pages to their shards and writes every shard in parallel, each in
+        its own transaction. With `skip_existing` a shard that already has the event
+        is skipped, so retrying a partially failed ingest does not duplicate rows.
+        The main DB Event has to be flushed, as its id is copied to every shard.
+
+        A SimilarWebBatch is split into a batch per shard and bulk inserted.
+        """
+        from app.support.similarweb import SimilarWebBatch
+
+        by_shard: Dict[int, Any]
+        if isinstance(pages, SimilarWebBatch):
+            indexes: Dict[int, List[int]] = defaultdict(list)
+            for index, website in enumerate(pages.pages):
+                indexes[self.shard_for(website)].append(index)
+            by_shard = {
+                shard: pages.take(shard_indexes)
+                for shard, shard_indexes in indexes.items()
+            }
+        else:
+            by_shard = defaultdict(list)
+            for page in pages:
+                by_shard[self.shard_for(page.page)].append(page)
+
+        def write(index: int) -> int:
+            with self.session(index) as session:
+                self._reconcile_event(session, index, event)
+                shard_event = session.scalars(
+                    select(m.Event).filter_by(path=event.path)
+                ).one_or_none()
+                if shard_event and skip_existing:
+                    log.warn("Shard already ingested", shard=index, file=event.path)
+                    return 0
+
+                m.use_storage_mode(session, self.delta)
+                if not shard_event:
+                    shard_event = m.Event(id=event.id, path=event.path)
+                    session.add(shard_event)
+                    session.flush()
+
+                shard_pages = by_shard[index]
+                if isinstance(shard_pages, SimilarWebBatch):
+                    m.PageScrape.create_from_batch(
+                        event=shard_event,
+                        batch=shard_pages,
+                        session=session,
+                        delta=self.delta,
+                    )
+                else:
+                    for page in shard_pages:
+                        m.PageScrape.create_from_similar_web(
+                            event=shard_event,
+                            sw_page=page,
+                            session=session,
+                            delta=self.delta,
+                        )
+                session.commit()
+            return len(by_shard[index])
+
+        with ThreadPoolExecutor(max_workers=self.count) as executor:
+            return sum(executor.map(write, list(by_shard)))
+
+
+def get_router() -> Optional[ShardRouter]:
+    """
+    Returns the shard router for the app, or None when sharding is turned off by
+    leaving `SHARD_COUNT` as 0.
+    """
+    count = current_app.config.get("SHARD_COUNT", 0)
+    if not count:
+        return None
+
+    if "shards" not in current_app.extensions:
+        current_app.extensions["shards"] = ShardRouter(
+            Path(current_app.config["SHARD_DIRECTORY"]),
+            count,
+            delta=current_app.config["DELTA_STORAGE"],
+        )
+    return current_app.extensions["shards"]
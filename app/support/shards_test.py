@@ -0,0 +1,108 @@
+import pytest
+
+from sqlalchemy import select
+
+import app.models as m
+from app.support.ingest import ingest_similar_web_file
+from app.support.shards import get_router, shard_for
+from support.ingest_test import ROW, write_csv
+
+SITES = [f"site-{index}.com" for index in range(12)]
+
+
+@pytest.fixture
+def router(db_app):
+    db_app.config["SHARD_COUNT"] = 3
+    router = get_router()
+    router.create_all()
+    yield router
+    for engine in router.engines:
+        engine.dispose()
+
+
+def _rows(sites, scraped_at="2023-01-15T12:49:28"):
+    return [dict(ROW, **{"Page": site, "Scraped At": scraped_at}) for site in sites]
+
+
+def _shard_scrapes(router, index):
+    with router.session(index) as session:
+        return session.execute(
+            select(m.Page.website, m.PageScrape.event_id, m.Event.path)
+            .join(m.PageScrape.page)
+            .join(m.Event, m.Event.id == m.PageScrape.event_id)
+            .order_by(m.Page.website)
+        ).all()
+
+
+def test_shard_for__stable():
+    assert shard_for("google.com", 8) == shard_for("google.com", 8) == 3
+    assert {shard_for(site, 3) for site in SITES} == {0, 1, 2}
+
+
+def test_ingest__routes_pages_to_their_shard(router, tmp_path):
+    path = write_csv(tmp_path / "first.csv", _rows(SITES))
+
+    assert ingest_similar_web_file(path)
+
+    event = m.Event.query.one()
+    assert m.PageScrape.query.count() == 0
+    for index in range(router.count):
+        assert _shard_scrapes(router, index) == [
+            (site, event.id, str(path))
+            for site in sorted(SITES)
+            if shard_for(site, router.count) == index
+        ]
+
+
+def _fail_last_shard(router, monkeypatch, path):
+    create_from_batch = m.PageScrape.create_from_batch
+
+    def fail(**kwargs):
+        if kwargs["session"].bind is router.engines[2]:
+            raise RuntimeError("Disk full")
+        return create_from_batch(**kwargs)
+
+    monkeypatch.setattr(m.PageScrape, "create_from_batch", fail)
+    with pytest.raises(RuntimeError):
+        ingest_similar_web_file(path)
+    m.db.session.rollback()
+    monkeypatch.setattr(m.PageScrape, "create_from_batch", create_from_batch)
+
+    assert m.Event.query.count() == 0
+    assert _shard_scrapes(router, 2) == []
+
+
+def test_ingest__retry_after_partial_failure(router, tmp_path, monkeypatch):
+    path = write_csv(tmp_path / "first.csv", _rows(SITES))
+    _fail_last_shard(router, monkeypatch, path)
+    # The retry is given a new id, as another event was recorded in between
+    m.Event.create(path="other.csv")
+    m.db.session.commit()
+
+    assert ingest_similar_web_file(path)
+
+    event = m.Event.query.filter_by(path=str(path)).one()
+    for index in range(router.count):
+        assert _shard_scrapes(router, index) == [
+            (site, event.id, str(path))
+            for site in sorted(SITES)
+            if shard_for(site, router.count) == index
+        ]
+
+
+def test_ingest__failed_event_id_reused(router, tmp_path, monkeypatch):
+    first = write_csv(tmp_path / "first.csv", _rows(SITES))
+    _fail_last_shard(router, monkeypatch, first)
+    # Another file is given the id the failed ingest had on the other shards
+    second = write_csv(tmp_path / "second.csv", _rows(SITES, "2023-02-15T00:00:00"))
+    assert ingest_similar_web_file(second)
+    assert ingest_similar_web_file(first)
+
+    events = {event.path: event.id for event in m.Event.query.all()}
+    for index in range(router.count):
+        sites = [site for site in SITES if shard_for(site, router.count) == index]
+        assert sorted(_shard_scrapes(router, index)) == sorted(
+            (site, events[str(path)], str(path))
+            for site in sites
+            for path in [first, second]
+        )
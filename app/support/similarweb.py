@@ -1,9 +1,13 @@
 import attrs
+import csv
+import sys
 import time
 import re
 
+from array import array
 from datetime import datetime, timedelta
-from typing import Any, Dict, List
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from cattrs import Converter
 
 
@@ -39,6 +43,10 @@ class SimilarWebRaw:
     demgraphics_t4: str = attrs.field(metadata={"alias": "Demographics (45 - 54)"})
     demgraphics_t5: str = attrs.field(metadata={"alias": "Demographics (55 - 64)"})
     demgraphics_t6: str = attrs.field(metadata={"alias": "Demographics (65+)"})
+    # Files scraped before the ranking chart was decoded do not have this column
+    ranking_history: str = attrs.field(
+        default="", metadata={"alias": "Ranking History"}
+    )
 
 
 @attrs.define()
@@ -62,6 +70,13 @@ class SimilarWebDemographics:
     percentage_value: float
 
 
+@attrs.define()
+class SimilarWebRankHistory:
+    month: int
+    year: int
+    rank: int
+
+
 @attrs.define()
 class SimilarWebIn:
     """
@@ -83,6 +98,7 @@ class SimilarWebIn:
     monthly_traffic: List[SimilarWebMonthlyTraffic]
     country_distributions: List[SimilarWebCountriesDistribution]
     demographics: List[SimilarWebDemographics]
+    rank_history: List[SimilarWebRankHistory] = attrs.field(factory=list)
 
 
 def _convert_big_number(val: str) -> int:
@@ -92,7 +108,7 @@ def _convert_big_number(val: str) -> int:
     unit = val[-1]
     float_val = float(val[:-1])
 
-    if unit == "T":
+    if unit in ("K", "T"):
         return int(float_val * 1_000)
     elif unit == "M":
         return int(float_val * 1_000_000)
@@ -136,87 +152,114 @@ def _convert_time(val: str) -> int:
     )
 
 
-def structure_similar_web_traffic(
-    data: Dict[str, str], _: Any
-) -> SimilarWebMonthlyTraffic:
-    key, val = list(data.items()).pop()
+def _convert_scraped_at(val: str) -> datetime:
+    # Every time in the DB is naive UTC, so a time in another zone would be stored
+    # as the wrong instant
+    scraped_at = datetime.fromisoformat(val)
+    if scraped_at.utcoffset():
+        raise ValueError(f"Scraped At must be in UTC. Recieved: {val}")
+    return scraped_at.replace(tzinfo=None)
+
 
+def _parse_traffic(key: str, val: str) -> Tuple[int, int, int, int]:
+    # The page rank, month, year and traffic of a monthly traffic column
     assert "Monthly Traffic" in key, f"Incorrect formatting for key. Recieved: {key}"
     month_name, raw_traffic = val.split(":")
     month = time.strptime(month_name, "%b").tm_mon
     year = datetime.now().year
-    return SimilarWebMonthlyTraffic(
-        page_rank=int(key[-1].replace(",", "")),
-        month=month,
-        year=year,
-        traffic=_convert_big_number(raw_traffic),
-    )
-
+    return int(key[-1].replace(",", "")), month, year, _convert_big_number(raw_traffic)
 
-def structure_similar_web_countries(
-    data: Dict[str, str], _: Any
-) -> SimilarWebCountriesDistribution:
-    key, val = list(data.items()).pop()
 
+def _parse_country(key: str, val: str) -> Tuple[int, str, float]:
     assert "Top Countries" in key, f"Incorrect formatting for key, Recieved: {key}"
     rank = re.search(r"\(([0-9_]+)\)", key).groups()[0]  # type: ignore
     country, raw_pct = val.split(":")
+    return int(rank.replace(",", "")), country, _convert_percentage(raw_pct)
+
+
+def _parse_demographics(key: str, val: str) -> Tuple[str, float]:
+    range = key[key.find("(") + 1 : -1]
+    return range, _convert_percentage(val)
+
+
+def _parse_rank_history(val: str, scraped_at: datetime) -> List[Tuple[int, int, int]]:
+    # The history is a | separated list of month:rank, ending at the scraped month
+    rank_history = []
+    for point in val.split("|") if val else []:
+        month_name, raw_rank = point.split(":")
+        month = time.strptime(month_name[:3], "%b").tm_mon
+        year = scraped_at.year if month <= scraped_at.month else scraped_at.year - 1
+        rank_history.append((month, year, int(raw_rank)))
+    return rank_history
+
+
+def structure_similar_web_traffic(
+    data: Dict[str, str], _: Any
+) -> SimilarWebMonthlyTraffic:
+    key, val = list(data.items()).pop()
+    return SimilarWebMonthlyTraffic(*_parse_traffic(key, val))
 
-    return SimilarWebCountriesDistribution(
-        rank=int(rank.replace(",", "")),
-        country=country,
-        percentage_value=_convert_percentage(raw_pct),
-    )
+
+def structure_similar_web_countries(
+    data: Dict[str, str], _: Any
+) -> SimilarWebCountriesDistribution:
+    key, val = list(data.items()).pop()
+    return SimilarWebCountriesDistribution(*_parse_country(key, val))
 
 
 def structure_similar_web_demographics(
     data: Dict[str, str], _: Any
 ) -> SimilarWebDemographics:
     key, val = list(data.items()).pop()
-    range = key[key.find("(") + 1 : -1]
+    return SimilarWebDemographics(*_parse_demographics(key, val))
 
-    return SimilarWebDemographics(
-        age_range=range, percentage_value=_convert_percentage(val)
-    )
 
+def structure_similar_web_rank_history(
+    val: str, scraped_at: datetime
+) -> List[SimilarWebRankHistory]:
+    return [
+        SimilarWebRankHistory(*point) for point in _parse_rank_history(val, scraped_at)
+    ]
 
-def structure_similar_web_in(data: Dict[str, str], _: Any) -> SimilarWebIn:
+
+# The columns each list of children of SimilarWebIn is parsed from
+CHILD_PARSERS = [
+    ("Monthly Traffic", "monthly_traffic", _parse_traffic),
+    ("Top Countries", "country_distributions", _parse_country),
+    ("Demographics", "demographics", _parse_demographics),
+]
+CHILD_TYPES = {
+    "monthly_traffic": SimilarWebMonthlyTraffic,
+    "country_distributions": SimilarWebCountriesDistribution,
+    "demographics": SimilarWebDemographics,
+    "rank_history": SimilarWebRankHistory,
+}
+
+
+def _parse_row(data: Dict[str, str]) -> Tuple[Dict[str, Any], Dict[str, List[tuple]]]:
+    """
+    Parses a raw row into the scalar fields of SimilarWebIn, and the fields of each
+    of its children as tuples in the order of their attrs class.
+    """
     # Check data is type safe
     assert all(isinstance(val, str) for val in data.values())
 
-    monthly_traffic = []
-    country_distributions = []
-    demographics = []
-
+    children: Dict[str, List[tuple]] = {name: [] for name in CHILD_TYPES}
     for key, val in data.items():
         if val == "":
             continue
 
-        if "Monthly Traffic" in key:
-            monthly_traffic.append(
-                SimilarWebConverter.structure(
-                    {key: val},
-                    SimilarWebMonthlyTraffic,
-                )
-            )
-        if "Top Countries" in key:
-            country_distributions.append(
-                SimilarWebConverter.structure(
-                    {key: val},
-                    SimilarWebCountriesDistribution,
-                )
-            )
-        if "Demographics" in key:
-            demographics.append(
-                SimilarWebConverter.structure(
-                    {key: val},
-                    SimilarWebDemographics,
-                )
-            )
+        for prefix, name, parse in CHILD_PARSERS:
+            if prefix in key:
+                children[name].append(parse(key, val))
 
-    return SimilarWebIn(
+    scraped_at = _convert_scraped_at(data["Scraped At"])
+    children["rank_history"] = _parse_rank_history(
+        data.get("Ranking History", ""), scraped_at
+    )
+    scalars = dict(
         path=data["Path"],
-        scraped_at=datetime.fromisoformat(data["Scraped At"]),
+        scraped_at=scraped_at,
         page=data["Page"],
         global_rank=_convert_rank(data["Global Rank"]),
         country_rank=_convert_rank(data["Country Rank"]),
@@ -225,9 +268,18 @@ def structure_similar_web_in(data: Dict[str, str], _: Any) -> SimilarWebIn:
         bounce_rate=_convert_percentage(data["Bounce Rate"]),
         pages_per_visit=_convert_float(data["Pages per Visit"]),
         avg_vist_duration=_convert_time(data["Avg Visit Duration"]),
-        monthly_traffic=monthly_traffic,
-        country_distributions=country_distributions,
-        demographics=demographics,
+    )
+    return scalars, children
+
+
+def structure_similar_web_in(data: Dict[str, str], _: Any) -> SimilarWebIn:
+    scalars, children = _parse_row(data)
+    return SimilarWebIn(
+        **scalars,
+        **{
+            name: [CHILD_TYPES[name](*child) for child in rows]
+            for name, rows in children.items()
+        },
     )
 
 
@@ -245,3 +297,123 @@ SimilarWebConverter.register_structure_hook(
 SimilarWebConverter.register_structure_hook(
     SimilarWebDemographics, structure_similar_web_demographics
 )
+
+
+def _typecode(type_: Any) -> Optional[str]:
+    # Strings are kept in lists, as there is no typed array for them
+    return {int: "q", float: "d"}.get(type_)
+
+
+# Typed arrays for the scalar fields of SimilarWebIn that are numbers
+SCALAR_TYPECODES = {
+    field.name: _typecode(field.type)
+    for field in attrs.fields(SimilarWebIn)
+    if _typecode(field.type)
+}
+EPOCH = datetime(1970, 1, 1)
+
+
+class SimilarWebBatch:
+    """
+    Columnar container for a batch of structured SimilarWeb rows. The number fields
+    of every row are stored in one typed array per field, and the children of every
+    row back to back in one flat array per child field, with the children of row i
+    at `offsets[child][i]:offsets[child][i + 1]`. This holds a batch in a few dozen
+    arrays instead of a dozen objects per row.
+
+    Iterating the batch builds a SimilarWebIn for each row on demand, for the code
+    that works a row at a time.
+    """
+
+    def __init__(self) -> None:
+        self.paths: List[str] = []
+        self.pages: List[str] = []
+        self.scraped_at_us = array("q")
+        self.scalars = {name: array(code) for name, code in SCALAR_TYPECODES.items()}
+        self.children: Dict[str, Dict[str, Any]] = {
+            name: {
+                field.name: array(code) if code else []
+                for field in attrs.fields(type_)
+                for code in [_typecode(field.type)]
+            }
+            for name, type_ in CHILD_TYPES.items()
+        }
+        self.offsets = {name: array("q", [0]) for name in CHILD_TYPES}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict[str, str]]) -> "SimilarWebBatch":
+        batch = cls()
+        for row in rows:
+            batch.append_row(row)
+        return batch
+
+    @classmethod
+    def from_csv(cls, path: Path, encoding: str = "utf-8") -> "SimilarWebBatch":
+        # Rows are parsed as they are read, so only the batch is held in memory
+        with open(path, newline="", encoding=encoding) as csvfile:
+            return cls.from_rows(csv.DictReader(csvfile))
+
+    def append_row(self, data: Dict[str, str]) -> None:
+        scalars, children = _parse_row(data)
+        self.paths.append(scalars.pop("path"))
+        self.pages.append(scalars.pop("page"))
+        self.scraped_at_us.append(
+            (scalars.pop("scraped_at") - EPOCH) // timedelta(microseconds=1)
+        )
+        for name, value in scalars.items():
+            self.scalars[name].append(value)
+
+        for name, rows in children.items():
+            columns = self.children[name]
+            for row in rows:
+                for values, value in zip(columns.values(), row):
+                    # Countries and age ranges repeat on every row, so share them
+                    values.append(
+                        sys.intern(value) if isinstance(value, str) else value
+                    )
+            self.offsets[name].append(self.offsets[name][-1] + len(rows))
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def scraped_at(self, index: int) -> datetime:
+        return EPOCH + timedelta(microseconds=self.scraped_at_us[index])
+
+    def child_rows(self, name: str, index: int) -> Iterator[Dict[str, Any]]:
+        # The fields of each child of the row, keyed as in its attrs class
+        columns = self.children[name]
+        for position in range(self.offsets[name][index], self.offsets[name][index + 1]):
+            yield {field: values[position] for field, values in columns.items()}
+
+    def __getitem__(self, index: int) -> SimilarWebIn:
+        return SimilarWebIn(
+            path=self.paths[index],
+            scraped_at=self.scraped_at(index),
+            page=self.pages[index],
+            **{name: values[index] for name, values in self.scalars.items()},
+            **{
+                name: [type_(**row) for row in self.child_rows(name, index)]
+                for name, type_ in CHILD_TYPES.items()
+            },
+        )
+
+    def __iter__(self) -> Iterator[SimilarWebIn]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def take(self, indexes: Iterable[int]) -> "SimilarWebBatch":
+        # A new batch of the given rows, such as the rows of one shard
+        batch = SimilarWebBatch()
+        for index in indexes:
+            batch.paths.append(self.paths[index])
+            batch.pages.append(self.pages[index])
+            batch.scraped_at_us.append(self.scraped_at_us[index])
+            for name, values in self.scalars.items():
+                batch.scalars[name].append(values[index])
+
+            for name, columns in self.children.items():
+                start, end = self.offsets[name][index], self.offsets[name][index + 1]
+                for field, values in columns.items():
+                    batch.children[name][field].extend(values[start:end])
+                batch.offsets[name].append(batch.offsets[name][-1] + end - start)
+        return batch
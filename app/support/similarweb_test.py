@@ -1,6 +1,13 @@
+from datetime import datetime
+
 import pytest
+from sqlalchemy import DateTime, delete, select
 
-from support.similarweb import SimilarWebConverter, SimilarWebIn
+import app.models as m
+from app.support import similarweb
+from app.support.shards import get_router
+from support.ingest_test import ROW
+from support.similarweb import SimilarWebBatch, SimilarWebConverter, SimilarWebIn
 
 
 def test_structure__similiar_web_in__happy_path():
@@ -70,3 +77,248 @@ def test_structure__similar_web_in__nulls():
     result = SimilarWebConverter.structure(test_dict, SimilarWebIn)
 
     assert result.global_rank == 7_277_9362_350_824
+
+
+def test_structure__similar_web_in__rank_history():
+    test_dict = {
+        "Path": "local/scraped_pages/similarweb-google-com.html",
+        "Scraped At": "2023-01-15T12:49:28.850051",
+        "Page": "google.com",
+        "Global Rank": "#1",
+        "Country Rank": "#1",
+        "Category Rank": "#1",
+        "Total Visits": "86.4B",
+        "Bounce Rate": "28.77%",
+        "Pages per Visit": "8.29",
+        "Avg Visit Duration": "00:10:35",
+        "Ranking History": "Nov:3|Dec:2|Jan:1",
+    }
+
+    result = SimilarWebConverter.structure(test_dict, SimilarWebIn)
+
+    # Months after the scraped month are from the year before
+    assert [(rank.year, rank.month, rank.rank) for rank in result.rank_history] == [
+        (2022, 11, 3),
+        (2022, 12, 2),
+        (2023, 1, 1),
+    ]
+
+
+BATCH_ROWS = [
+    {
+        "Path": "local/scraped_pages/similarweb-google-com.html",
+        "Scraped At": "2023-01-15T12:49:28.850051",
+        "Page": "google.com",
+        "Global Rank": "#1",
+        "Country Rank": "#1",
+        "Category Rank": "#1",
+        "Total Visits": "86.4B",
+        "Bounce Rate": "28.77%",
+        "Pages per Visit": "8.29",
+        "Avg Visit Duration": "00:10:35",
+        "Monthly Traffic P1": "Oct:87.0B",
+        "Top Countries (1)": "United States:27.04%",
+        "Top Countries (2)": "India:4.51%",
+        "Demographics (18 - 24)": "23.86%",
+        "Ranking History": "Nov:3|Dec:2|Jan:1",
+    },
+    {
+        "Path": "local/scraped_pages/similarweb-byte-trading-com.html",
+        "Scraped At": "2023-03-15T12:49:29.094564",
+        "Page": "byte-trading.com",
+        "Global Rank": "#7,277,936",
+        "Country Rank": "",
+        "Category Rank": "",
+        "Total Visits": "< 5K",
+        "Bounce Rate": "",
+        "Pages per Visit": "",
+        "Avg Visit Duration": "",
+        "Top Countries (1)": "India:100.00%",
+    },
+    {
+        "Path": "local/scraped_pages/similarweb-google-com.html",
+        "Scraped At": "2023-02-15T12:49:28.850051",
+        "Page": "google.com",
+        "Global Rank": "#2",
+        "Country Rank": "#1",
+        "Category Rank": "#1",
+        "Total Visits": "84.1B",
+        "Bounce Rate": "28.50%",
+        "Pages per Visit": "8.31",
+        "Avg Visit Duration": "00:10:31",
+        "Demographics (18 - 24)": "24.02%",
+        "Demographics (25 - 34)": "30.11%",
+    },
+]
+
+
+def test_similar_web_batch__matches_structure():
+    batch = SimilarWebBatch.from_rows(BATCH_ROWS)
+
+    assert len(batch) == 3
+    assert list(batch) == [
+        SimilarWebConverter.structure(row, SimilarWebIn) for row in BATCH_ROWS
+    ]
+    # The children of every row are stored back to back
+    assert list(batch.offsets["country_distributions"]) == [0, 2, 3, 3]
+    assert list(batch.offsets["rank_history"]) == [0, 3, 3, 3]
+    assert [row["country"] for row in batch.child_rows("country_distributions", 1)] == [
+        "India"
+    ]
+
+
+def test_similar_web_batch__take():
+    batch = SimilarWebBatch.from_rows(BATCH_ROWS)
+
+    taken = batch.take([2, 0])
+
+    assert list(taken) == [batch[2], batch[0]]
+    assert list(taken.offsets["demographics"]) == [0, 2, 3]
+
+
+def test_similar_web_batch__scraped_at_in_utc():
+    rows = [
+        dict(BATCH_ROWS[0], **{"Scraped At": "2023-01-15T12:49:28Z"}),
+        dict(BATCH_ROWS[0], **{"Scraped At": "2023-01-15T12:49:28+00:00"}),
+    ]
+
+    batch = SimilarWebBatch.from_rows(rows)
+
+    assert [row.scraped_at for row in batch] == [datetime(2023, 1, 15, 12, 49, 28)] * 2
+    assert batch[0] == SimilarWebConverter.structure(rows[0], SimilarWebIn)
+
+
+def test_similar_web_batch__scraped_at_in_other_zone_is_rejected():
+    row = dict(BATCH_ROWS[0], **{"Scraped At": "2023-01-15T12:49:28+02:00"})
+
+    with pytest.raises(ValueError, match="Scraped At must be in UTC"):
+        SimilarWebBatch.from_rows([row])
+    with pytest.raises(ValueError, match="Scraped At must be in UTC"):
+        SimilarWebConverter.structure(row, SimilarWebIn)
+
+
+# Seen before the batch, so its page exists and only its November is recorded
+EXISTING_ROW = dict(
+    ROW,
+    **{
+        "Scraped At": "2023-01-01T00:00:00",
+        "Monthly Traffic P1": "Nov:80.0B",
+        "Monthly Traffic P2": "",
+    },
+)
+INGEST_ROWS = [
+    ROW,
+    dict(ROW, **{"Page": "bing.com", "Monthly Traffic P1": "Dec:1.0B"}),
+    # Scraped earlier but later in the file, so the first row keeps December
+    dict(
+        ROW,
+        **{
+            "Scraped At": "2023-01-10T00:00:00",
+            "Monthly Traffic P2": "Dec:99.0B",
+            "Ranking History": "Dec:5|Jan:4",
+        },
+    ),
+    *[dict(ROW, Page=f"site-{index}.com") for index in range(6)],
+]
+TABLES = [
+    m.Page,
+    m.PageScrape,
+    m.PageTraffic,
+    m.PageRankHistory,
+    m.PageCountriesDistribution,
+    m.PageDemographics,
+]
+
+
+@pytest.fixture(params=[0, 3], ids=["main_db", "shards"])
+def shard_count(request, db_app):
+    db_app.config["SHARD_COUNT"] = request.param
+    router = get_router()
+    if router:
+        router.create_all()
+    yield request.param
+    for engine in router.engines if router else []:
+        engine.dispose()
+
+
+def _ingest(path, pages):
+    event = m.Event.create(path=path)
+    m.db.session.flush()
+    router = get_router()
+    if router:
+        router.ingest(event, pages)
+    elif isinstance(pages, similarweb.SimilarWebBatch):
+        m.PageScrape.create_from_batch(event=event, batch=pages)
+    else:
+        for sw_page in pages:
+            m.PageScrape.create_from_similar_web(event=event, sw_page=sw_page)
+    m.db.session.commit()
+
+
+def _remove_ingested(session):
+    # Every row of every table, which are emptied for the next ingest. Timestamps set
+    # by the DB differ between the ingests, so they are left out
+    tables = {
+        model.__tablename__: session.execute(
+            select(
+                *[
+                    column
+                    for column in model.__table__.columns
+                    if not (
+                        column.server_default is not None
+                        and isinstance(column.type, DateTime)
+                    )
+                ]
+            ).order_by(model.id)
+        ).all()
+        for model in TABLES
+    }
+    for model in [*reversed(TABLES), m.Event]:
+        session.execute(delete(model))
+    session.commit()
+    return tables
+
+
+def _ingested():
+    router = get_router()
+    if not router:
+        return [_remove_ingested(m.db.session)]
+
+    m.db.session.execute(delete(m.Event))
+    m.db.session.commit()
+    shards = []
+    for index in range(router.count):
+        with router.session(index) as session:
+            shards.append(_remove_ingested(session))
+    return shards
+
+
+def test_create_from_batch__same_rows_as_one_at_a_time(shard_count, monkeypatch):
+    # Slices smaller than the batch, so months are seen across slices
+    monkeypatch.setattr(m, "INSERT_BATCH_SIZE", 2)
+    # Built from the module as the app imports it, which the shard router checks for
+    existing = similarweb.SimilarWebBatch.from_rows([EXISTING_ROW])
+    batch = similarweb.SimilarWebBatch.from_rows(INGEST_ROWS)
+
+    _ingest("existing.csv", list(existing))
+    _ingest("rows.csv", list(batch))
+    one_at_a_time = _ingested()
+    _ingest("existing.csv", list(existing))
+    _ingest("rows.csv", batch)
+
+    assert _ingested() == one_at_a_time
+    # Every shard is written to
+    assert len(one_at_a_time) == max(shard_count, 1)
+    assert all(len(tables["page_scrape"]) > 1 for tables in one_at_a_time)
+    (google,) = [
+        (page.id, tables)
+        for tables in one_at_a_time
+        for page in tables["page"]
+        if page.website == "google.com"
+    ]
+    page_id, tables = google
+    assert [
+        (traffic.month, traffic.traffic)
+        for traffic in tables["page_traffic"]
+        if traffic.page_id == page_id
+    ] == [(11, 80_000_000_000), (12, 85_100_000_000)]
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import re
+
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from flask import current_app
+from sqlalchemy import func, select
+from structlog import get_logger
+
+import app.models as m
+
+log = get_logger(name=__name__)
+
+# Matches the overview title without parsing the page, the same element the scraper
+# reads the website from
+TITLE_PATTERN = re.compile(rb'class="wa-overview__title"[^>]*>\s*([^<\s]+)\s*<')
+
+# The zstd trainer needs this many samples, fewer snapshots are split into blocks
+MIN_TRAINING_SAMPLES = 10
+
+
+def _import_zstandard() -> Any:
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(
+            "The snapshot store requires zstandard, install the snapshots extra"
+        ) from error
+    return zstandard
+
+
+class SnapshotStore:
+    """
+    Content addressed store for raw HTML snapshots. Every blob is named by the
+    sha256 of its uncompressed content, so repeated scrapes with identical markup are
+    stored once, and compressed with zstd. Once a dictionary has been trained on the
+    store, new blobs are compressed with it. Every dictionary ever trained is kept,
+    as each blob's zstd frame records the id of the dictionary it needs.
+
+    The `Snapshot` table indexes the blobs by the website and time they were scraped.
+    """
+
+    def __init__(self, root: Path, level: int = 10) -> None:
+        self.zstd = _import_zstandard()
+        self.root = root
+        self.level = level
+        self._dictionaries: Dict[int, Any] = {}
+
+    @property
+    def dictionary_path(self) -> Path:
+        return self.root / "dictionaries"
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / f"{digest[2:]}.zst"
+
+    def _dictionary(self, dict_id: int) -> Any:
+        if dict_id not in self._dictionaries:
+            path = self.dictionary_path / f"{dict_id}.zdict"
+            self._dictionaries[dict_id] = self.zstd.ZstdCompressionDict(
+                path.read_bytes()
+            )
+        return self._dictionaries[dict_id]
+
+    def _current_dictionary(self) -> Optional[Any]:
+        current_path = self.dictionary_path / "current"
+        if not current_path.exists():
+            return None
+        return self._dictionary(int(current_path.read_text()))
+
+    def put(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        if blob_path.exists():
+            return digest
+
+        dictionary = self._current_dictionary()
+        compressor = self.zstd.ZstdCompressor(level=self.level, dict_data=dictionary)
+
+        # Write to a temporary file first so a crash never leaves a truncated blob
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = blob_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(compressor.compress(content))
+        tmp_path.replace(blob_path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        data = self._blob_path(digest).read_bytes()
+
+        dict_id = self.zstd.get_frame_parameters(data).dict_id
+        dictionary = self._dictionary(dict_id) if dict_id else None
+        return self.zstd.ZstdDecompressor(dict_data=dictionary).decompress(data)
+
+    def add(self, website: str, scraped_at: datetime, content: bytes) -> m.Snapshot:
+        """
+        Stores the content and indexes it for the website. If this scrape of the
+        website is already in the store the existing snapshot is returned, which
+        unlike a new one is not pending in the session.
+        """
+        existing = m.Snapshot.query.filter_by(
+            website=website, scraped_at=scraped_at
+        ).one_or_none()
+        if existing:
+            return existing
+
+        digest = self.put(content)
+        snapshot = m.Snapshot(
+            website=website,
+            scraped_at=scraped_at,
+            digest=digest,
+            size=len(content),
+        )
+        m.db.session.add(snapshot)
+        return snapshot
+
+    def add_file(self, file: Path) -> m.Snapshot:
+        """
+        Stores a saved page, indexed by the website in its overview title and the
+        time the file was saved, which is the closest there is to when it was scraped.
+        """
+        content = file.read_bytes()
+        scraped_at = datetime.utcfromtimestamp(file.stat().st_mtime)
+        return self.add(website_for(file, content), scraped_at, content)
+
+    def scrape(self, snapshot: m.Snapshot) -> Dict[str, str]:
+        from app.support.scrape import scrape_similarweb_content
+
+        return scrape_similarweb_content(
+            self.get(snapshot.digest),
+            snapshot_path(snapshot.digest),
+            snapshot.scraped_at,
+        )
+
+    def latest(
+        self, since: Optional[datetime] = None, website: Optional[str] = None
+    ) -> Iterator[m.Snapshot]:
+        # The most recent snapshot of every website
+        latest = (
+            select(
+                m.Snapshot.website,
+                func.max(m.Snapshot.scraped_at).label("scraped_at"),
+            )
+            .group_by(m.Snapshot.website)
+            .subquery()
+        )
+        query = select(m.Snapshot).join(
+            latest,
+            (m.Snapshot.website == latest.c.website)
+            & (m.Snapshot.scraped_at == latest.c.scraped_at),
+        )
+        if since:
+            query = query.where(m.Snapshot.scraped_at >= since)
+        if website:
+            query = query.where(m.Snapshot.website == website)
+        yield from m.db.session.scalars(query.order_by(m.Snapshot.website))
+
+    def train_dictionary(self, samples: List[bytes], size: int = 112_640) -> int:
+        """
+        Trains a zstd dictionary on sample snapshots and makes it the dictionary
+        used for every new blob. Returns the id of the dictionary.
+        """
+        assert samples, "No samples to train a dictionary on"
+        if len(samples) < MIN_TRAINING_SAMPLES:
+            # Blocks of the snapshots still share the markup the dictionary is for
+            block = max(1, sum(map(len, samples)) // MIN_TRAINING_SAMPLES)
+            samples = [
+                sample[start : start + block]
+                for sample in samples
+                for start in range(0, len(sample), block)
+            ]
+        dictionary = self.zstd.train_dictionary(size, samples)
+        dict_id = dictionary.dict_id()
+
+        self.dictionary_path.mkdir(parents=True, exist_ok=True)
+        (self.dictionary_path / f"{dict_id}.zdict").write_bytes(dictionary.as_bytes())
+        (self.dictionary_path / "current").write_text(str(dict_id))
+        self._dictionaries[dict_id] = dictionary
+        return dict_id
+
+    def disk_usage(self) -> int:
+        return sum(path.stat().st_size for path in (self.root / "blobs").rglob("*.zst"))
+
+
+def website_for(file: Path, content: bytes) -> str:
+    match = TITLE_PATTERN.search(content)
+    if match:
+        return match.group(1).decode("utf-8")
+    log.warn("Overview title not found, using the file name", file=file)
+    return file.stem
+
+
+def snapshot_path(digest: str) -> str:
+    # Recorded as the path of the data scraped from a snapshot
+    return f"snapshot://{digest}"
+
+
+def get_store() -> SnapshotStore:
+    return SnapshotStore(Path(current_app.config["SNAPSHOT_DIRECTORY"]))
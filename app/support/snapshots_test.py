@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import app.models as m
+from app.support.snapshots import SnapshotStore
+from support.scripts_test import STATE, _page
+
+pytest.importorskip("zstandard")
+
+
+def _html(index: int) -> bytes:
+    rows = "".join(f"<li class='row'>Item {index}.{row}</li>" for row in range(200))
+    return f"<html><body><ul>{rows}</ul></body></html>".encode("utf-8")
+
+
+def test_put__round_trip_and_stored_once(tmp_path):
+    store = SnapshotStore(tmp_path)
+
+    digest = store.put(_html(1))
+
+    assert store.put(_html(1)) == digest
+    assert store.get(digest) == _html(1)
+    assert len(list((tmp_path / "blobs").rglob("*.zst"))) == 1
+
+
+def test_train_dictionary__few_samples_round_trip(tmp_path):
+    store = SnapshotStore(tmp_path)
+    before = store.put(_html(1))
+
+    dict_id = store.train_dictionary([_html(1), _html(2)])
+    after = store.put(_html(3))
+
+    frame = (tmp_path / "blobs" / after[:2] / f"{after[2:]}.zst").read_bytes()
+    assert store.zstd.get_frame_parameters(frame).dict_id == dict_id
+    # A new store has to load the dictionary from disk to read the new blob
+    store = SnapshotStore(tmp_path)
+    assert store.get(before) == _html(1)
+    assert store.get(after) == _html(3)
+
+
+def test_add_file__scraped_from_store(db_app, tmp_path):
+    store = SnapshotStore(tmp_path / "snapshots")
+    page = tmp_path / "similarweb-alpha-com.html"
+    page.write_bytes(
+        _page(json.dumps(STATE)).replace(
+            b"<h1>Not parsed</h1>", b'<h1 class="wa-overview__title">alpha.com</h1>'
+        )
+    )
+
+    snapshot = store.add_file(page)
+    m.db.session.commit()
+    # Importing the same file again finds the stored snapshot
+    assert store.add_file(page) not in m.db.session.new
+
+    (latest,) = store.latest(website="alpha.com")
+    assert latest.id == snapshot.id
+    data_points = store.scrape(latest)
+    assert data_points["Page"] == "alpha.com"
+    assert data_points["Path"] == f"snapshot://{snapshot.digest}"
@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+import zlib
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from structlog import get_logger
+
+import app.models as m
+from app.support.shards import get_router
+
+log = get_logger(name=__name__)
+
+Row = Dict[str, Any]
+
+SCRAPE_COLUMNS = [
+    "id",
+    "website",
+    "path",
+    "scraped_at",
+    "event_id",
+    "global_rank",
+    "country_rank",
+    "category_rank",
+    "total_visits",
+    "bounce_rate",
+    "pages_per_visit",
+    "avg_vist_duration",
+]
+
+# The children of a scrape, the columns of each that are exported and the column of
+# the full scrape with the id of the scrape the children are stored on. In delta
+# storage that is an earlier scrape when the countries or demographics were unchanged.
+CHILDREN = {
+    "traffic": (m.PageTraffic, ["page_rank", "year", "month", "traffic"], "id"),
+    "rank_history": (m.PageRankHistory, ["year", "month", "rank"], "id"),
+    "countries": (
+        m.PageCountriesDistribution,
+        ["rank", "country", "percentage_value"],
+        "countries_scrape_id",
+    ),
+    "demographics": (
+        m.PageDemographics,
+        ["age_range", "percentage_value"],
+        "demographics_scrape_id",
+    ),
+}
+
+
+def _children(session: Session, scrapes: List[Row]) -> Dict[str, Dict[int, list]]:
+    # One IN query per child table for the whole batch of scrapes
+    children: Dict[str, Dict[int, list]] = {}
+    for name, (model, columns, key) in CHILDREN.items():
+        scrape_ids = {scrape[key] for scrape in scrapes if scrape[key] is not None}
+        by_scrape = defaultdict(list)
+        rows = session.execute(
+            select(model.scrape_id, *[getattr(model, column) for column in columns])
+            .where(model.scrape_id.in_(scrape_ids))
+            .order_by(model.scrape_id, model.id)
+        )
+        for scrape_id, *values in rows:
+            by_scrape[scrape_id].append(dict(zip(columns, values)))
+        children[name] = by_scrape
+    return children
+
+
+def _session_scrapes(
+    session: Session, batch_size: int, website: Optional[str]
+) -> Iterator[List[Row]]:
+    # In delta storage the full view resolves the values a scrape inherits in the
+    # same pass, otherwise the scrapes are read straight from the table in id order.
+    # Each DB is read in the mode it was written in, whatever is configured now
+    scrape = m.page_scrape_source(m.stored_delta(session)).c
+    keys = ["countries_scrape_id", "demographics_scrape_id"]
+    query = (
+        select(
+            *[
+                m.Page.website if column == "website" else scrape[column]
+                for column in SCRAPE_COLUMNS
+            ],
+            *[scrape[key] for key in keys],
+        )
+        .join(m.Page, m.Page.id == scrape.page_id)
+        .order_by(scrape.id)
+        # Fetch from the cursor in batches rather than loading the whole result
+        .execution_options(yield_per=batch_size)
+    )
+    if website:
+        query = query.where(m.Page.website == website)
+
+    for partition in session.execute(query).partitions():
+        rows = [dict(zip([*SCRAPE_COLUMNS, *keys], row)) for row in partition]
+        children = _children(session, rows)
+        for row in rows:
+            for name, (_, _, key) in CHILDREN.items():
+                row[name] = children[name].get(row[key], [])
+            for key in keys:
+                del row[key]
+        yield rows
+
+
+def iter_scrape_batches(
+    batch_size: int = 1_000, website: Optional[str] = None
+) -> Iterator[List[Row]]:
+    """
+    Yields every PageScrape with its traffic, ranking history, countries and
+    demographics nested, in batches of at most `batch_size` scrapes. Only one batch
+    is held in memory at a time. When sharded, the shards are read one after another.
+    """
+    router = get_router()
+    if not router:
+        yield from _session_scrapes(m.db.session, batch_size, website)
+        return
+
+    indexes = [router.shard_for(website)] if website else range(router.count)
+    for index in indexes:
+        with router.session(index) as session:
+            yield from _session_scrapes(session, batch_size, website)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def ndjson_chunks(batches: Iterable[List[Row]]) -> Iterator[bytes]:
+    # One chunk per batch so each write and compress call is a reasonable size
+    for batch in batches:
+        yield "".join(json.dumps(row, default=_default) + "\n" for row in batch).encode(
+            "utf-8"
+        )
+
+
+def csv_chunks(batches: Iterable[List[Row]]) -> Iterator[bytes]:
+    """
+    Writes a row per scrape, with the children of the scrape as JSON encoded
+    columns. The header is yielded straight away, before the first batch is read.
+    """
+    columns = [*SCRAPE_COLUMNS, *CHILDREN]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns)
+
+    def drain() -> bytes:
+        content = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return content
+
+    writer.writeheader()
+    yield drain()
+    for batch in batches:
+        for row in batch:
+            writer.writerow(
+                {
+                    **row,
+                    "scraped_at": _default(row["scraped_at"]),
+                    **{name: json.dumps(row[name]) for name in CHILDREN},
+                }
+            )
+        yield drain()
+
+
+FORMATS: Dict[str, Callable[[Iterable[List[Row]]], Iterator[bytes]]] = {
+    "ndjson": ndjson_chunks,
+    "csv": csv_chunks,
+}
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    # A wbits of 31 writes the gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # Sync flush every chunk so the client is never waiting on zlib's buffer
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream_scrapes(
+    format_: str = "ndjson",
+    gzip: bool = False,
+    batch_size: int = 1_000,
+    website: Optional[str] = None,
+) -> Iterator[bytes]:
+    """
+    Streams the full scrape history as NDJSON or CSV, optionally gzipped, in
+    constant memory for any number of scrapes.
+    """
+    assert format_ in FORMATS, f"Unknown export format, recieved: {format_}"
+    chunks = FORMATS[format_](iter_scrape_batches(batch_size, website))
+    return gzip_chunks(chunks) if gzip else chunks
@@ -0,0 +1,80 @@
+import csv
+import gzip
+import io
+import json
+
+from datetime import datetime
+
+import app.models as m
+
+from support.ingest import ingest_similar_web_file
+from support.ingest_test import ROW, write_csv
+from support.stream import csv_chunks, gzip_chunks, iter_scrape_batches, ndjson_chunks
+
+BATCHES = [
+    [
+        dict(
+            id=1,
+            website="google.com",
+            scraped_at=datetime(2023, 3, 15),
+            traffic=[dict(page_rank=1, year=2023, month=1, traffic=100)],
+            rank_history=[],
+            countries=[],
+            demographics=[dict(age_range="18 - 24", percentage_value=23.86)],
+        )
+    ],
+    [
+        dict(
+            id=2,
+            website="bing.com",
+            scraped_at=datetime(2023, 3, 15),
+            traffic=[],
+            rank_history=[],
+            countries=[],
+            demographics=[],
+        )
+    ],
+]
+
+
+def test_ndjson_chunks__chunk_per_batch():
+    chunks = list(ndjson_chunks(BATCHES))
+
+    assert len(chunks) == 2
+    first = json.loads(chunks[0])
+    assert first["scraped_at"] == "2023-03-15T00:00:00"
+    assert first["traffic"][0]["traffic"] == 100
+
+
+def test_csv_chunks__header_before_first_batch():
+    chunks = csv_chunks(iter(BATCHES))
+
+    header = next(chunks)
+    assert header.startswith(b"id,website,path,scraped_at")
+
+    rows = list(csv.DictReader(io.StringIO(b"".join([header, *chunks]).decode())))
+    assert [row["website"] for row in rows] == ["google.com", "bing.com"]
+    assert json.loads(rows[0]["demographics"])[0]["age_range"] == "18 - 24"
+
+
+def test_gzip_chunks__decompresses_to_input():
+    chunks = [b"first\n", b"second\n"]
+
+    compressed = list(gzip_chunks(chunks))
+
+    # Every input chunk is flushed through so it can be sent immediately
+    assert len(compressed) == 3
+    assert gzip.decompress(b"".join(compressed)) == b"first\nsecond\n"
+
+
+def test_iter_scrape_batches__table_reads_as_view(db_app, tmp_path, monkeypatch):
+    rows = [ROW, dict(ROW, **{"Page": "bing.com", "Top Countries (2)": ""})]
+    ingest_similar_web_file(write_csv(tmp_path / "first.csv", rows))
+
+    # Without delta storage the table is read directly instead of the full view
+    from_table = list(iter_scrape_batches(batch_size=1))
+    monkeypatch.setattr(m, "stored_delta", lambda connection: True)
+    from_view = list(iter_scrape_batches(batch_size=1))
+
+    assert from_table == from_view
+    assert [len(batch[0]["countries"]) for batch in from_table] == [2, 1]
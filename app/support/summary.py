@@ -1,18 +1,36 @@
+import fcntl
+import hashlib
+import json
+import re
+import threading
+import time
+
 from pathlib import Path
 from rich.console import Console
 import pandas as pd
-import matplotlib.pyplot as plt
+
+# Figures are built on the Agg canvas directly rather than through pyplot, whose
+# global state is not safe for the worker threads rendering sites concurrently
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.ticker as mticker
 import matplotlib.dates as mdates
 import app.models as m
+from app.support.shards import get_router
 
 from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import text
 from structlog import get_logger
 
-
 log = get_logger(name=__name__)
 console = Console()
 
+# Bump when the graph itself changes so that every site is redrawn
+RENDER_VERSION = 1
+# Rendered sites are saved to the manifest in batches rather than after every site
+MANIFEST_SAVE_SECONDS = 5
+
 
 def _parse_date(month: int, year: int) -> datetime:
     return datetime.strptime(f"{month}{year}", "%m%Y")
@@ -28,49 +46,190 @@ def _monthly_growth(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def all_analysis() -> None:
-    # Get db connection to execute SQL and load query from file
-    connection = m.db.engine.connect().connection
+def _output_name(site: str) -> str:
+    """
+    Keeps the whole domain in the file name so google.com and google.co.uk do not
+    overwrite each other. Sites with characters that are not safe in a file name get
+    a short hash of the site as well, so that sites which only differ in those
+    characters are not given the same name.
+    """
+    name = re.sub(r"[^0-9a-z.-]+", "-", site.lower()).strip("-.")
+    if name != site:
+        name += "-" + hashlib.sha256(site.encode("utf-8")).hexdigest()[:8]
+    return name
+
+
+def _fingerprint(site_df: pd.DataFrame) -> str:
+    # Hash of the input series for the site, if this is unchanged so is the graph
+    hashed_rows = pd.util.hash_pandas_object(
+        site_df[["month", "year", "traffic"]], index=False
+    )
+    digest = hashlib.sha256(f"v{RENDER_VERSION}".encode())
+    digest.update(hashed_rows.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _load_manifest(path: Path) -> Dict[str, Dict[str, str]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def _save_manifest(path: Path, manifest: Dict[str, Dict[str, str]]) -> None:
+    # Write to a temporary file first so a crash never leaves a half written manifest
+    tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    tmp_path.replace(path)
+
+
+def render_site(site: str, site_df: pd.DataFrame, save_path: Path) -> None:
+    site_df = _monthly_growth(site_df)
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.bar(site_df.index, site_df.mom_traffic_growth, width=3)
+    ax.set_title(f"Monthly change in traffic for {site}", fontsize=20)
+
+    # set axis lines
+    ax.axhline(y=0, color="k", linestyle="-")
+    ax.axhline(
+        y=site_df.mom_traffic_growth.mean(),
+        color="r",
+        linestyle="-.",
+        linewidth=1,
+        label="Avg Growth",
+    )
+
+    # Percentage Formatting
+    ax.set_ylabel("Percentage Growth (%)", fontsize=12)
+    ax.yaxis.set_major_formatter(mticker.PercentFormatter())
+
+    # Month formatting
+    ax.set_xlabel("Month", fontsize=20)
+    ax.xaxis.set_major_locator(mdates.MonthLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %y"))
+
+    log.info("Saving graphs", path=save_path)
+    fig.savefig(save_path)
+
+
+def _since_key(since: Optional[str]) -> Optional[int]:
+    # YYYY-MM as a sortable YYYYMM integer
+    if not since:
+        return None
+    year, month = (int(part) for part in since.split("-"))
+    return year * 100 + month
+
+
+def _fetch_traffic(
+    website: Optional[str] = None, since: Optional[str] = None
+) -> pd.DataFrame:
     query = """
     -- month-on-month-traffic
     select p.website, pt.month, pt.year, pt.traffic
     from page p
-    join page_scrape ps on ps.page_id = p.id
-    join page_traffic pt on pt.scrape_id = ps.id
+    join page_traffic pt on pt.page_id = p.id
+    where (:website is null or p.website = :website)
+    and (:since is null or pt.year * 100 + pt.month >= :since)
     order by p.website, pt.year asc, pt.month asc;
     """
+    params = dict(website=website, since=_since_key(since))
+
+    # Every row for a site is on the same shard, so concatenating keeps groups intact
+    router = get_router()
+    if router:
+        df = router.read_sql(query, params)
+        return df.sort_values(["website", "year", "month"], ignore_index=True)
+
+    # Get db connection to execute SQL and load query from file
+    with m.db.engine.connect() as connection:
+        return pd.read_sql_query(text(query), connection, params=params)
+
+
+def _update_manifest(path: Path, entries: Dict[str, Dict[str, str]]) -> None:
+    """
+    Merges the entries into the manifest. The manifest is re-read under a lock on a
+    file next to it, as worker threads and processes may render sites concurrently
+    and would otherwise overwrite each other's entries.
+    """
+    with open(path.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = _load_manifest(path)
+        manifest.update(entries)
+        _save_manifest(path, manifest)
+    entries.clear()
+
+
+def _render_sites(df: pd.DataFrame, force: bool) -> int:
+    output_path = Path("app") / "local" / "output"
+    if not output_path.exists():
+        output_path.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = output_path / "manifest.json"
+    manifest = _load_manifest(manifest_path)
+
+    rendered = 0
+    pending: Dict[str, Dict[str, str]] = {}
+    saved_at = time.monotonic()
+    try:
+        for site, site_df in df.groupby("website"):
+            site = str(site)
+            fingerprint = _fingerprint(site_df)
+            save_path = output_path / f"{_output_name(site)}.png"
+
+            # Only redraw the graph if the input series changed since the last render
+            entry = manifest.get(site)
+            if (
+                not force
+                and entry
+                and entry["fingerprint"] == fingerprint
+                and save_path.exists()
+            ):
+                continue
+
+            render_site(site, site_df, save_path)
+            rendered += 1
+
+            # Persist every few seconds so an interrupted run only redraws the sites
+            # rendered since, without rewriting the whole manifest for every site
+            pending[site] = dict(fingerprint=fingerprint, path=str(save_path))
+            if time.monotonic() - saved_at >= MANIFEST_SAVE_SECONDS:
+                _update_manifest(manifest_path, pending)
+                saved_at = time.monotonic()
+    finally:
+        if pending:
+            _update_manifest(manifest_path, pending)
+
+    return rendered
+
+
+def all_analysis(
+    force: bool = False, source: str = "sqlite", since: Optional[str] = None
+) -> None:
     # fetch the required data
-    log.info("Fetching data for all analysis")
-    df = pd.read_sql_query(query, connection)
+    log.info("Fetching data for all analysis", source=source, since=since)
+    if source == "parquet":
+        from app.support.export import read_traffic_parquet
+
+        df = read_traffic_parquet(since=since)
+    else:
+        df = _fetch_traffic(since=since)
+
     # month on month change in web vists
+    sites = df.website.nunique()
+    rendered = _render_sites(df, force)
+    log.info(
+        "Completed all analysis",
+        sites=sites,
+        rendered=rendered,
+        skipped=sites - rendered,
+    )
+
+
+def site_analysis(website: str, force: bool = False) -> None:
+    log.info("Fetching data for site analysis", website=website)
+    df = _fetch_traffic(website)
+    if df.empty:
+        raise NameError(f"No traffic found for {website}")
 
-    save_path = Path("app") / "local" / "output"
-    if not save_path.exists():
-        save_path.mkdir(parents=True)
-
-    grouped_by_site = df.groupby("website")
-    for site, site_df in grouped_by_site:
-        site_df = _monthly_growth(site_df)
-        plt.bar(site_df.index, site_df.mom_traffic_growth, width=3)
-        plt.title(f"Monthly change in traffic for {site}", fontsize=20)
-
-        # set axis lines
-        plt.axhline(y=0, color='k', linestyle='-')
-        plt.axhline(y=site_df.mom_traffic_growth.mean(), color='r', linestyle='-.', linewidth=1, label="Avg Growth")
-
-        # Percentage Formatting
-        plt.ylabel("Percentage Growth (%)", fontsize=12)
-        y = plt.gca().yaxis 
-        y.set_major_formatter(mticker.PercentFormatter())
-        
-        # Month formatting
-        plt.xlabel("Month", fontsize=20)
-        x = plt.gca().xaxis
-        x.set_major_locator(mdates.MonthLocator())
-        x.set_major_formatter(mdates.DateFormatter("%b %y"))
-
-        name = str(site).split(".")[0]
-        save_path = Path("app") / "local" / "output" / f"{name}.png"
-        log.info("Saving graphs", path=save_path)
-        plt.savefig(save_path)
-        
+    _render_sites(df, force)
@@ -0,0 +1,97 @@
+import json
+
+import pandas as pd
+
+import support.summary as s
+
+
+def test_output_name__keeps_domain():
+    assert s._output_name("google.com") == "google.com"
+    assert s._output_name("google.co.uk") == "google.co.uk"
+
+
+def test_output_name__unsafe_characters_do_not_collide():
+    names = {s._output_name(site) for site in ["my-site.com", "my.site.com"]}
+    names |= {s._output_name(site) for site in ["my_site.com", "my site.com"]}
+
+    assert len(names) == 4
+    assert s._output_name("my_site.com").startswith("my-site.com-")
+
+
+def _traffic(sites):
+    return pd.DataFrame(
+        [
+            dict(website=site, month=month, year=2023, traffic=100 * month)
+            for site in sites
+            for month in [1, 2, 3]
+        ]
+    )
+
+
+def test_render_sites__saves_manifest_in_batches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rendered = []
+    saves = []
+    save_manifest = s._save_manifest
+    monkeypatch.setattr(
+        s, "render_site", lambda site, _, path: (rendered.append(site), path.touch())
+    )
+    monkeypatch.setattr(
+        s,
+        "_save_manifest",
+        lambda path, manifest: (saves.append(1), save_manifest(path, manifest)),
+    )
+    sites = [f"site-{index}.com" for index in range(20)]
+
+    assert s._render_sites(_traffic(sites), force=False) == 20
+    # Every site is rendered within the save interval, so the manifest is saved once
+    assert len(saves) == 1
+    manifest = json.loads((tmp_path / "app/local/output/manifest.json").read_text())
+    assert sorted(manifest) == sorted(sites)
+
+    # Nothing changed, so nothing is redrawn
+    assert s._render_sites(_traffic(sites), force=False) == 0
+    assert s._render_sites(_traffic(sites[:2]), force=True) == 2
+    assert len(rendered) == 22
+
+
+def _add_entries(path, worker):
+    for index in range(20):
+        s._update_manifest(path, {f"site-{worker}-{index}.com": dict(fingerprint="x")})
+
+
+def test_update_manifest__processes_do_not_lose_entries(tmp_path):
+    import multiprocessing
+
+    path = tmp_path / "manifest.json"
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_add_entries, args=(path, worker)) for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(json.loads(path.read_text())) == 80
+
+
+def test_render_site__threads_draw_their_own_figures(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    sites = [f"site-{index}.com" for index in range(8)]
+    traffic = _traffic(sites)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(
+            executor.map(
+                lambda site: s.render_site(
+                    site,
+                    traffic[traffic.website == site].copy(),
+                    tmp_path / f"{site}.png",
+                ),
+                sites,
+            )
+        )
+
+    for site in sites:
+        assert (tmp_path / f"{site}.png").read_bytes()[:4] == b"\x89PNG"
@@ -0,0 +1,328 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import os
+import select
+import struct
+import threading
+import time
+
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from attrs import define, field
+from structlog import get_logger
+
+log = get_logger(name=__name__)
+
+# Files are ordered by their ctime then name. Unlike the mtime, the ctime is also
+# updated when a file is moved into the directory, so a file written elsewhere and
+# renamed into place still sorts after every file processed before it landed.
+FileKey = Tuple[int, str]
+# Files are moved into this directory of their target once they have failed on
+# their own `max_attempts` times, so they no longer hold up the files behind them
+FAILED_DIRECTORY = "failed"
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+@define
+class Target:
+    """
+    A directory to watch, the files in it to process and the function processing a
+    batch of them. Batches are passed in the order the files landed.
+    """
+
+    name: str
+    directory: Path
+    pattern: str
+    process: Callable[[List[Path]], None]
+
+
+class Cursor:
+    """
+    Durable record of the files processed in each watched directory, so a restarted
+    watcher picks up from exactly where it stopped. The cursor is written atomically
+    and synced to disk after every batch.
+
+    Each directory has a high water mark of the latest file processed, and the
+    names of the files processed within `lookback_seconds` before it. A file whose
+    last write was before a file already processed, but which was only closed after
+    it, is still new as long as it lands within the lookback.
+    """
+
+    def __init__(self, path: Path, lookback_seconds: float = 60.0) -> None:
+        self.path = path
+        self.lookback_ns = int(lookback_seconds * 1e9)
+        self.positions: Dict[str, FileKey] = {}
+        self.recent: Dict[str, Dict[str, int]] = {}
+        if path.exists():
+            for name, position in json.loads(path.read_text()).items():
+                # Cursors written before the lookback only have the high water mark
+                if isinstance(position, list):
+                    position = dict(position=position, recent={})
+                self.positions[name] = tuple(position["position"])  # type: ignore
+                self.recent[name] = position["recent"]
+
+    def is_new(self, target: str, key: FileKey) -> bool:
+        if target not in self.positions or key > self.positions[target]:
+            return True
+        if key[0] < self.positions[target][0] - self.lookback_ns:
+            return False
+        return key[1] not in self.recent[target]
+
+    def advance(self, target: str, keys: List[FileKey]) -> None:
+        position = max([*keys, self.positions.get(target, keys[0])])
+        self.positions[target] = position
+        recent = self.recent.setdefault(target, {})
+        recent.update({name: ctime for ctime, name in keys})
+        for name, ctime in list(recent.items()):
+            if ctime < position[0] - self.lookback_ns:
+                del recent[name]
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as cursor_file:
+            json.dump(
+                {
+                    name: dict(position=position, recent=self.recent[name])
+                    for name, position in self.positions.items()
+                },
+                cursor_file,
+            )
+            cursor_file.flush()
+            os.fsync(cursor_file.fileno())
+        tmp_path.replace(self.path)
+
+
+class InotifyWatch:
+    """
+    Waits on inotify for files to be closed after writing or moved into the watched
+    directories, returning their paths without listing the directories.
+    """
+
+    def __init__(self, directories: List[Path]) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.directories: Dict[int, Path] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            self.directories[wd] = directory
+
+    def wait(self, timeout: float) -> List[Path]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        paths, offset = [], 0
+        while offset < len(data):
+            wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if name and wd in self.directories:
+                paths.append(self.directories[wd] / os.fsdecode(name))
+        return paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatch:
+    """
+    Fallback for platforms without inotify. A directory is only listed when its
+    mtime has changed, which happens whenever a file is created in or moved into it.
+    """
+
+    def __init__(self, directories: List[Path], poll_seconds: float) -> None:
+        self.poll_seconds = poll_seconds
+        self.mtimes: Dict[Path, int] = {
+            directory: directory.stat().st_mtime_ns for directory in directories
+        }
+
+    def wait(self, timeout: float) -> List[Path]:
+        time.sleep(min(timeout, self.poll_seconds))
+
+        paths = []
+        for directory, mtime in self.mtimes.items():
+            current = directory.stat().st_mtime_ns
+            if current != mtime:
+                self.mtimes[directory] = current
+                paths.extend(Path(entry.path) for entry in os.scandir(directory))
+        return paths
+
+    def close(self) -> None:
+        pass
+
+
+def _file_key(path: Path) -> Optional[FileKey]:
+    try:
+        return path.stat().st_ctime_ns, path.name
+    except FileNotFoundError:
+        return None
+
+
+@define
+class _Pending:
+    key: FileKey
+    seen_at: float = field(factory=time.monotonic)
+    attempts: int = 0
+
+
+class Watcher:
+    """
+    Watches directories for new files and processes them in micro batches, as soon
+    as `batch_size` files are waiting or `batch_seconds` after the first of them was
+    seen. A file is only picked up once it has not changed for `settle_seconds`, so
+    files still being written are left alone.
+
+    Files are processed in the order they landed and the cursor is advanced after
+    every batch, so a restart neither reprocesses nor misses a file. A batch that
+    raises is retried after `batch_seconds`, one file at a time so a bad file can not
+    fail the others. A file that has failed on its own `max_attempts` times is moved
+    into the `failed` directory of its target.
+    """
+
+    def __init__(
+        self,
+        targets: List[Target],
+        cursor: Cursor,
+        batch_size: int = 50,
+        batch_seconds: float = 5.0,
+        settle_seconds: float = 1.0,
+        poll_seconds: float = 1.0,
+        use_inotify: bool = True,
+        max_attempts: int = 3,
+    ) -> None:
+        assert batch_size > 0, f"Batch size must be positive, recieved: {batch_size}"
+        self.targets = targets
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.use_inotify = use_inotify
+        self.max_attempts = max_attempts
+        self.stop = threading.Event()
+        self.pending: Dict[str, Dict[Path, _Pending]] = {
+            target.name: {} for target in targets
+        }
+        self._by_directory = {target.directory.resolve(): target for target in targets}
+
+    def _open_watch(self) -> InotifyWatch | PollingWatch:
+        directories = [target.directory for target in self.targets]
+        if self.use_inotify:
+            try:
+                return InotifyWatch(directories)
+            except (OSError, AttributeError) as error:
+                log.warn("inotify is not available, polling instead", error=str(error))
+        return PollingWatch(directories, self.poll_seconds)
+
+    def offer(self, path: Path) -> None:
+        target = self._by_directory.get(path.parent.resolve())
+        if not target or not fnmatch.fnmatch(path.name, target.pattern):
+            return
+
+        key = _file_key(path)
+        pending = self.pending[target.name]
+        if key and path not in pending and self.cursor.is_new(target.name, key):
+            pending[path] = _Pending(key)
+
+    def catch_up(self) -> None:
+        # Everything that landed while the watcher was not running
+        for target in self.targets:
+            for entry in os.scandir(target.directory):
+                self.offer(Path(entry.path))
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Processes every full batch, and any partial batch whose window has passed.
+        Returns the number of files processed.
+        """
+        processed = 0
+        for target in self.targets:
+            pending = self.pending[target.name]
+            settled_before = time.time_ns() - int(self.settle_seconds * 1e9)
+
+            ready = []
+            for path, item in list(pending.items()):
+                key = _file_key(path)
+                if key is None:
+                    log.warn("Watched file removed before processing", file=path)
+                    del pending[path]
+                elif key != item.key:
+                    # Changed since it was seen, keep waiting for it to settle
+                    pending[path] = _Pending(key, item.seen_at)
+                elif key[0] <= settled_before:
+                    ready.append(path)
+            ready.sort(key=lambda path: pending[path].key)
+
+            while ready:
+                oldest = min(pending[path].seen_at for path in ready)
+                window_passed = time.monotonic() - oldest >= self.batch_seconds
+                if len(ready) < self.batch_size and not (force or window_passed):
+                    break
+
+                # Files that have failed before are retried on their own
+                size = 1 if pending[ready[0]].attempts else self.batch_size
+                batch, ready = ready[:size], ready[size:]
+                try:
+                    target.process(batch)
+                except Exception:
+                    log.exception("Failed to process batch", target=target.name)
+                    for path in batch:
+                        pending[path].attempts += 1
+                    if (
+                        len(batch) == 1
+                        and pending[batch[0]].attempts >= self.max_attempts
+                    ):
+                        self._move_failed(target, batch[0])
+                        del pending[batch[0]]
+                        continue
+                    for path in batch + ready:
+                        pending[path].seen_at = time.monotonic()
+                    break
+
+                self.cursor.advance(target.name, [pending[path].key for path in batch])
+                for path in batch:
+                    del pending[path]
+                processed += len(batch)
+                log.info("Processed batch", target=target.name, files=len(batch))
+        return processed
+
+    def _move_failed(self, target: Target, path: Path) -> None:
+        failed_directory = target.directory / FAILED_DIRECTORY
+        failed_directory.mkdir(exist_ok=True)
+        log.error(
+            "File failed too many times, moving it aside",
+            target=target.name,
+            file=path,
+            attempts=self.max_attempts,
+            directory=failed_directory,
+        )
+        path.replace(failed_directory / path.name)
+
+    def run(self) -> None:
+        watch = self._open_watch()
+        log.info("Watching directories", watch=type(watch).__name__)
+        try:
+            self.catch_up()
+            while not self.stop.is_set():
+                for path in watch.wait(self.poll_seconds):
+                    self.offer(path)
+                self.flush()
+        finally:
+            watch.close()
@@ -0,0 +1,131 @@
+from support.watch import Cursor, Target, Watcher
+
+
+def _watcher(tmp_path, processed, **kwargs):
+    directory = tmp_path / "pages"
+    directory.mkdir(exist_ok=True)
+    target = Target("pages", directory, "*.html", processed.append)
+    kwargs = dict(batch_size=2, batch_seconds=60, settle_seconds=0, **kwargs)
+    return directory, Watcher([target], Cursor(tmp_path / "cursor.json"), **kwargs)
+
+
+def test_watcher__batches_in_landing_order(tmp_path):
+    processed = []
+    directory, watcher = _watcher(tmp_path, processed)
+    for name in ["a.html", "b.html", "c.html", "ignored.txt"]:
+        (directory / name).write_text(name)
+
+    watcher.catch_up()
+    assert watcher.flush() == 2
+    assert [[path.name for path in batch] for batch in processed] == [
+        ["a.html", "b.html"]
+    ]
+
+    # The last file is only processed once its window has passed
+    assert watcher.flush(force=True) == 1
+    assert processed[-1][0].name == "c.html"
+
+
+def test_watcher__restart_resumes_from_cursor(tmp_path):
+    processed = []
+    directory, watcher = _watcher(tmp_path, processed)
+    (directory / "a.html").write_text("a")
+    watcher.catch_up()
+    watcher.flush(force=True)
+
+    (directory / "b.html").write_text("b")
+    processed.clear()
+    _, restarted = _watcher(tmp_path, processed)
+    restarted.catch_up()
+    restarted.flush(force=True)
+
+    assert [[path.name for path in batch] for batch in processed] == [["b.html"]]
+
+
+def test_watcher__failed_batch_is_retried(tmp_path):
+    calls = []
+
+    def process(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise ValueError("database is locked")
+
+    directory, watcher = _watcher(tmp_path, [])
+    watcher.targets[0].process = process
+    (directory / "a.html").write_text("a")
+    watcher.catch_up()
+
+    assert watcher.flush(force=True) == 0
+    assert watcher.flush(force=True) == 1
+    assert len(calls) == 2
+
+
+def test_watcher__failed_ingest_is_retried(db_app, tmp_path, monkeypatch):
+    import app.models as m
+    from app.cli.watch import _ingest_batch
+    from support.ingest_test import ROW, write_csv
+
+    create_from_batch = m.PageScrape.create_from_batch
+
+    def fail_once(**kwargs):
+        monkeypatch.setattr(m.PageScrape, "create_from_batch", create_from_batch)
+        raise ValueError("database is locked")
+
+    monkeypatch.setattr(m.PageScrape, "create_from_batch", fail_once)
+    directory = tmp_path / "input"
+    directory.mkdir()
+    write_csv(directory / "similarweb_1.csv", [ROW])
+    target = Target("input", directory, "similarweb*", _ingest_batch)
+    watcher = Watcher([target], Cursor(tmp_path / "cursor.json"), settle_seconds=0)
+    watcher.catch_up()
+
+    assert watcher.flush(force=True) == 0
+    assert "input" not in watcher.cursor.positions
+    assert watcher.flush(force=True) == 1
+
+    assert [event.path for event in m.Event.query.all()] == [
+        str(directory / "similarweb_1.csv")
+    ]
+    assert m.PageScrape.query.count() == 1
+
+
+def test_watcher__bad_file_is_moved_aside(tmp_path):
+    processed = []
+
+    def process(batch):
+        if any(path.name == "bad.html" for path in batch):
+            raise ValueError("Malformed page")
+        processed.append([path.name for path in batch])
+
+    directory, watcher = _watcher(tmp_path, [], max_attempts=2)
+    watcher.targets[0].process = process
+    for name in ["a.html", "bad.html", "c.html"]:
+        (directory / name).write_text(name)
+    watcher.catch_up()
+
+    assert watcher.flush(force=True) == 0
+    # Retried one at a time, so the bad file only fails itself
+    assert watcher.flush(force=True) == 2
+    assert processed == [["a.html"], ["c.html"]]
+    assert watcher.pending["pages"] == {}
+    assert (directory / "failed" / "bad.html").exists()
+    assert not (directory / "bad.html").exists()
+
+
+def test_watcher__file_closed_after_newer_file_is_processed(tmp_path):
+    processed = []
+    directory, watcher = _watcher(tmp_path, processed)
+    # Written first but only closed once the later file has been processed
+    (directory / "slow.html").write_text("slow")
+    (directory / "fast.html").write_text("fast")
+    watcher.offer(directory / "fast.html")
+    watcher.flush(force=True)
+
+    _, restarted = _watcher(tmp_path, processed)
+    restarted.catch_up()
+    restarted.flush(force=True)
+
+    assert [[path.name for path in batch] for batch in processed] == [
+        ["fast.html"],
+        ["slow.html"],
+    ]